@@ -2,26 +2,176 @@ from fasthtml.common import *
 from sqlite3 import IntegrityError
 import apsw
 import hashlib
+from urllib.parse import urlencode
 import os
-from pyreadability import Readability
-import requests
-import html2text
-from openai import OpenAI
 import logging
 import time
 import asyncio
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+import chunking
+import compression
+import extract
+import feeds
+import fetcher
+import jobs
+import llm_client
+import metrics
+import ratelimit
+import singleflight
+from article_cache import ArticleCache
+from history import History, MATCH_END, MATCH_START
+from llm_cache import LLMCache
+from render_cache import RenderCache, content_hash
+from summary_store import SqliteSummaryStore, SummaryStore
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Database setup
-db = database('users.db')
-users = db.t.users
-if users not in db.t:
-    users.create(dict(username=str, password=str), pk='username')
+# Database, tables and caches are opened on first use, so importing the module has no side effects
+db = users = article_cache = llm_cache = summary_cache = history = llm_clients = feed_store = None
+resources_lock = RLock()
+
+def get_db():
+    global db
+    with resources_lock:
+        if db is None:
+            db = database('users.db')
+        return db
+
+def get_users():
+    global users
+    with resources_lock:
+        if users is None:
+            table = get_db().t.users
+            if table not in get_db().t:
+                table.create(dict(username=str, password=str), pk='username')
+            users = table
+        return users
+
+def get_article_cache():
+    global article_cache
+    with resources_lock:
+        if article_cache is None:
+            article_cache = ArticleCache(get_db())
+        return article_cache
+
+def get_llm_cache():
+    global llm_cache
+    with resources_lock:
+        if llm_cache is None:
+            llm_cache = LLMCache(get_db())
+        return llm_cache
+def get_history():
+    global history
+    with resources_lock:
+        if history is None:
+            history = History(get_db())
+        return history
+
+def get_feeds():
+    global feed_store
+    with resources_lock:
+        if feed_store is None:
+            feed_store = feeds.Feeds(get_db())
+        return feed_store
+
+def flush_history():
+    # Write out queued history rows before the process exits
+    if history is not None:
+        history.flush()
+render_cache = RenderCache()
+
+# Bounded worker pool for LLM calls, plus threads for the custom prompt call running alongside each summary
+scheduler = jobs.JobScheduler()
+llm_pool = ThreadPoolExecutor(max_workers=scheduler.workers, thread_name_prefix="llm-custom")
+
+# Concurrent submissions of the same page share one fetch and extraction, and with the
+# same prompt and model one summary job, each request keeping its own request_id
+article_loads = singleflight.AsyncGroup()
+summary_flights = singleflight.Flights()
+
+def job_counts():
+    snapshot = scheduler.snapshot()
+    return {('queued',): snapshot['queued'], ('running',): snapshot['running']}
+
+metrics.Gauge('webapp_summary_jobs', "Summary jobs by state", ['state'], collect=job_counts)
+metrics.Gauge('webapp_summary_cache_bytes', "Bytes held by pending summary requests",
+              collect=lambda: {(): get_summary_cache().stats()['bytes']})
+
+# Load everything the first requests need in the background once the server is up; PREWARM=0 leaves it all lazy
+PREWARM = os.environ.get('PREWARM', '1') != '0'
+
+def prewarm():
+    start = time.time()
+    get_users()
+    get_article_cache()
+    get_llm_cache()
+    get_summary_cache()
+    get_history()
+    get_feeds()
+    chunking.get_encoding()
+    import markdown
+    for endpoint in get_llm_clients().endpoints:
+        get_llm_clients().client(endpoint)
+    extract.warm_pool()
+    logging.info(f"Prewarm complete in {time.time() - start:.2f}s")
+
+async def start_prewarm():
+    if PREWARM:
+        asyncio.get_running_loop().run_in_executor(None, prewarm)
+
+# Poll registered feeds in the background; with several hosts sharing a database FEED_INGEST=0
+# can leave it to some of them. FEED_URLS lists feeds to register at startup, comma separated.
+FEED_INGEST = os.environ.get('FEED_INGEST', '1') != '0'
+FEED_URLS = [url.strip() for url in os.environ.get('FEED_URLS', '').split(',') if url.strip()]
+ingester = ingest_task = None
+
+async def start_ingester():
+    global ingester, ingest_task
+    if FEED_INGEST:
+        store = await asyncio.to_thread(get_feeds)
+        for url in FEED_URLS:
+            store.add(url)
+        ingester = feeds.Ingester(store, fetch_feed, ingest_url, busy=ingest_busy)
+        ingest_task = asyncio.create_task(ingester.run())
+
+async def stop_ingester():
+    if ingest_task is not None:
+        ingest_task.cancel()
 
 # App with sessions
-app, rt = fast_app(secret_key='secret-key-change-in-production')
+app, rt = fast_app(secret_key='secret-key-change-in-production', on_startup=[start_prewarm, start_ingester],
+                   on_shutdown=[stop_ingester, fetcher.close_client, extract.shutdown_pool, flush_history],
+                   middleware=[Middleware(compression.CompressionMiddleware)])
+
+SUMMARY_PROMPT = "Summarize this article in 2-3 sentences using markdown formatting:\n\n{markdown}"
+CUSTOM_PROMPT = "{custom_prompt}\n\nArticle content:\n\n{markdown}"
+FUSED_PROMPT = ("Read the article below and respond with only a JSON object with two string fields: "
+                "\"summary\", a 2-3 sentence summary of the article using markdown formatting, and "
+                "\"custom_response\", your markdown response to this request: {custom_prompt}\n\n"
+                "Article content:\n\n{markdown}")
+
+# 'concurrent' runs the summary and custom prompt as parallel calls, 'fused' asks for both in one completion
+SUMMARY_MODE = os.environ.get('SUMMARY_MODE', 'concurrent')
+
+# 'map_reduce' summarizes long articles section by section and combines the results,
+# 'truncate' summarizes only the first TRUNCATE_CHARS characters
+SUMMARY_STRATEGY = os.environ.get('SUMMARY_STRATEGY', 'map_reduce')
+TRUNCATE_CHARS = 4000
+CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', 3000))
+CHUNK_FANOUT = int(os.environ.get('SUMMARY_CHUNK_FANOUT', 4))
+CHUNK_PROMPT = ("This is one part of a longer article. Summarize the key points of this part in 2-3 sentences "
+                "using markdown formatting:\n\n{markdown}")
+REDUCE_PROMPT = ("These are summaries of consecutive parts of one article. Combine them into a single 2-3 sentence "
+                 "summary of the whole article using markdown formatting:\n\n{markdown}")
+CUSTOM_CHUNK_PROMPT = ("{custom_prompt}\n\nThis is one part of a longer article; answer from this part only, "
+                       "and say so briefly if it is not relevant.\n\nArticle part:\n\n{markdown}")
+CUSTOM_REDUCE_PROMPT = ("{custom_prompt}\n\nThe article was too long to read at once, so the request above was "
+                        "answered for each part separately. Combine these answers into one response:\n\n{markdown}")
+
+# Push LLM tokens to the page over SSE; set SUMMARY_STREAMING=0 to fall back to polling
+SUMMARY_STREAMING = os.environ.get('SUMMARY_STREAMING', '1') != '0'
+STREAM_INTERVAL = 0.05
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -41,6 +191,9 @@ def get(sess):
                 ),
                 Button("Process URL")
             ),
+            A("History", href="/history"), " | ",
+            A("Feeds", href="/feeds"), " | ",
+            A("Batch process URLs", href="/batch"), " | ",
             A("Logout", href="/logout"))
     return Titled("Home",
         P("hello, world"),
@@ -60,7 +213,7 @@ def get():
 @rt("/register")
 def post(username: str, password: str, sess):
     try:
-        users.insert(dict(username=username, password=hash_password(password)))
+        get_users().insert(dict(username=username, password=hash_password(password)))
         sess['username'] = username
         return RedirectResponse("/", status_code=303)
     except (IntegrityError, apsw.ConstraintError):
@@ -86,7 +239,7 @@ def get():
 @rt("/login")
 def post(username: str, password: str, sess):
     try:
-        user = users.get(username)
+        user = get_users().get(username)
         if user and user['password'] == hash_password(password):
             sess['username'] = username
             return RedirectResponse("/", status_code=303)
@@ -101,235 +254,929 @@ def post(username: str, password: str, sess):
         ),
         A("Back to home", href="/"))
 
+def timing_text(timings, llm=None):
+    text = f"Timing: Request {timings['request_time']:.2f}s | Queue {timings['queue_time']:.2f}s | Readability {timings['readability_time']:.2f}s"
+    if llm is not None:
+        text += f" | LLM {llm['llm_wall_time']:.2f}s"
+        if llm.get('custom_response'):
+            text += f" (summary {llm['llm_time']:.2f}s, custom {llm['custom_llm_time']:.2f}s)"
+        if llm.get('chunks'):
+            calls = llm['chunks']
+            text += (f" | {len([c for c in calls if c['field'] == 'summary' and c['step'] == 'map'])} chunks, "
+                     f"{sum(c['input_tokens'] for c in calls):,} tokens in, {sum(c['output_tokens'] for c in calls):,} out")
+    return text
+
+def summary_chunks(markdown_text):
+    # The article text each summary works from: token-budgeted sections, or the truncated start
+    if SUMMARY_STRATEGY == 'map_reduce':
+        return chunking.split_sections(markdown_text, CHUNK_TOKENS) or ['']
+    return [markdown_text[:TRUNCATE_CHARS]]
+
+def summary_cached(model, chunks, prompt):
+    # Whether every completion the summary (and custom prompt) needs is in the LLM cache.
+    # Partial summaries long enough to be combined in groups first aren't looked up.
+    llm_cache = get_llm_cache()
+    
+    def cached(template, map_template, reduce_template, prompt):
+        if len(chunks) == 1:
+            return llm_cache.contains(model, template, prompt, chunks[0])
+        partials = [llm_cache.peek(model, map_template, prompt, chunk) for chunk in chunks]
+        return None not in partials and llm_cache.contains(model, reduce_template, prompt, '\n\n'.join(partials))
+    
+    if prompt and SUMMARY_MODE == 'fused' and len(chunks) == 1:
+        fused = llm_cache.peek(model, FUSED_PROMPT, prompt, chunks[0])
+        if fused is not None and valid_fused(fused):
+            return True
+    return cached(SUMMARY_PROMPT, CHUNK_PROMPT, REDUCE_PROMPT, None) and \
+        (not prompt or cached(CUSTOM_PROMPT, CUSTOM_CHUNK_PROMPT, CUSTOM_REDUCE_PROMPT, prompt))
+
+# The summary and custom prompt threads both merge their output into a request's entry
+summary_updates_lock = Lock()
+# Open /stream-summary streams per request, woken when its entry changes instead of polling the store
+summary_watchers = {}  # request_id -> {(loop, asyncio.Event)}
+summary_watchers_lock = Lock()
+
+def notify_summary(request_id):
+    with summary_watchers_lock:
+        watchers = list(summary_watchers.get(request_id, ()))
+    for loop, changed in watchers:
+        loop.call_soon_threadsafe(changed.set)
+
+def update_summary(request_id, **fields):
+    # Reassign rather than mutate so the entry is written back to the store
+    store = get_summary_cache()
+    with summary_updates_lock:
+        entry = store.get(request_id)
+        if entry is not None:
+            store[request_id] = {**entry, **fields}
+    notify_summary(request_id)
+
+def parse_fused(content):
+    # Fused completions answer with a JSON object holding both outputs
+    import json
+    text = content.strip()
+    if text.startswith('```'):
+        text = text.strip('`').removeprefix('json').strip()
+    data = json.loads(text)
+    return data['summary'], data['custom_response']
+
+def valid_fused(content):
+    try:
+        parse_fused(content)
+    except (ValueError, KeyError, TypeError):
+        return False
+    return True
+
+# Politeness per LLM provider: requests per second (0 for no limit), burst, starting
+# concurrency (adapted to 429/5xx responses) and retries
+LLM_RATE = float(os.environ.get('LLM_RATE', 10))
+LLM_BURST = int(os.environ.get('LLM_BURST', 20))
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 16))
+LLM_RETRIES = int(os.environ.get('LLM_RETRIES', 4))
+LLM_MAX_RETRY_WAIT = float(os.environ.get('LLM_MAX_RETRY_WAIT', 60))
+llm_limits = ratelimit.RateControl('llm', LLM_RATE, LLM_BURST, LLM_CONCURRENCY, LLM_RETRIES, LLM_MAX_RETRY_WAIT)
+
+# Per-upstream limits only for the configured LLM endpoints; origin hosts are counted, not
+# labelled, so the series stay bounded and don't expose which sites users read
+metrics.Gauge('webapp_upstream_concurrency_limit', "Adaptive concurrency limit per LLM upstream below its starting limit",
+              ['kind', 'upstream'], collect=lambda: {(llm_limits.kind, key): limit
+                                                     for key, limit in llm_limits.limits().items()})
+metrics.Gauge('webapp_upstream_reduced_limits', "Upstreams running below their starting concurrency limit", ['kind'],
+              collect=lambda: {(control.kind,): len(control.limits()) for control in (fetcher.origins, llm_limits)})
+
+def make_client(endpoint):
+    # openai is slow to import, so it is loaded with the first LLM call (or by prewarm).
+    # One client per endpoint for the life of the process, keeping its connections alive.
+    # Retries are left to llm_limits, which also paces the other calls to the provider.
+    import httpx
+    from openai import DefaultHttpxClient, OpenAI
+    return OpenAI(
+        base_url=endpoint.base_url,
+        api_key=endpoint.api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=llm_client.MAX_CONNECTIONS,
+                                                           max_keepalive_connections=llm_client.MAX_CONNECTIONS))
+    )
+
+def get_llm_clients():
+    # LLM_ENDPOINTS lists "base_url|model|API_KEY_VAR" entries; by default the one OpenRouter endpoint
+    global llm_clients
+    with resources_lock:
+        if llm_clients is None:
+            spec = os.environ.get('LLM_ENDPOINTS') or os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+            llm_clients = llm_client.LLMClients(llm_client.parse_endpoints(spec, os.environ.get("OPENROUTER_API_KEY", "")),
+                                                lambda endpoint: make_client(endpoint), limits=llm_limits)
+        return llm_clients
+
+metrics.Gauge('webapp_llm_endpoint_latency_seconds', "Recent time to first token per LLM endpoint", ['endpoint'],
+              collect=lambda: {(e['name'],): e['latency'] for e in get_llm_clients().snapshot()['endpoints']
+                               if e['latency'] is not None})
+metrics.Gauge('webapp_llm_endpoint_error_rate', "Recent share of failed calls per LLM endpoint", ['endpoint'],
+              collect=lambda: {(e['name'],): e['errors'] for e in get_llm_clients().snapshot()['endpoints']})
+
+def summarize(chunks, custom_prompt, model, on_partial=None, on_result=None):
+    # Summary plus optional custom-prompt completion for one article, with timings.
+    # `chunks` comes from summary_chunks(); several chunks are summarized separately
+    # and then combined, with per-call timings and token counts under 'chunks'.
+    # on_partial(field, text) receives the streamed text as it grows and
+    # on_result(field, text) each finished output as soon as it is ready.
+    calls = []
+    
+    def complete(template, markdown_text, prompt=None, field=None, call='summary'):
+        # Serve repeats of the same article/prompt/model from the LLM cache.
+        # Returns the text and its completion token count.
+        llm_cache = get_llm_cache()
+        cached = llm_cache.get(model, template, prompt, markdown_text)
+        metrics.CACHE_LOOKUPS.inc(cache='llm', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            logging.info(f"LLM cache hit ({llm_cache.stats['hits']} hits, {llm_cache.stats['misses']} misses)")
+            return cached, chunking.count_tokens(cached)
+        # Publish partial text at most every STREAM_INTERVAL, or SHARED_PUBLISH_INTERVAL to the shared store
+        published = time.time()
+        interval = SHARED_PUBLISH_INTERVAL if SUMMARY_STORE == 'sqlite' else STREAM_INTERVAL
+        
+        def on_text(content):
+            nonlocal published
+            if time.time() - published >= interval:
+                on_partial(field, content)
+                published = time.time()
+        
+        # Routed to the best endpoint; a failed-over or retried call streams again from the start
+        content, output_tokens, endpoint = get_llm_clients().complete(
+            model,
+            [{"role": "user", "content": template.format(markdown=markdown_text, custom_prompt=prompt)}],
+            on_text if on_partial and field else None
+        )
+        logging.info(f"LLM {call} completion served by {endpoint.name}")
+        if on_partial and field:
+            on_partial(field, content)
+        if output_tokens is None:
+            output_tokens = chunking.count_tokens(content)
+        metrics.OUTPUT_TOKENS.inc(output_tokens, call=call)
+        # A fused reply that isn't the JSON asked for is retried as separate calls, not replayed from the cache
+        if call != 'fused' or valid_fused(content):
+            llm_cache.put(model, template, prompt, markdown_text, content)
+        return content, output_tokens
+    
+    def chunk_call(template, markdown_text, prompt, field, step, index):
+        start = time.time()
+        content, output_tokens = complete(template, markdown_text, prompt, field if step == 'reduce' else None,
+                                          call=field if step == 'reduce' else 'chunk')
+        elapsed = time.time() - start
+        if step != 'reduce':
+            metrics.STAGE_SECONDS.observe(elapsed, stage='llm_chunk')
+        calls.append({'field': field, 'step': step, 'index': index, 'time': elapsed,
+                      'input_tokens': chunking.count_tokens(markdown_text), 'output_tokens': output_tokens})
+        logging.info(f"LLM {field} {step} call {index} complete in {elapsed:.2f}s")
+        return content
+    
+    def map_reduce(map_template, reduce_template, prompt, field):
+        # Summarize chunks in parallel, then combine the partial results; if they are
+        # too long to combine in one call, combine them in groups first
+        partials = list(chunk_pool.map(lambda i: chunk_call(map_template, chunks[i], prompt, field, 'map', i),
+                                       range(len(chunks))))
+        combined = '\n\n'.join(partials)
+        while len(partials) > 2 and chunking.count_tokens(combined) > CHUNK_TOKENS:
+            groups = chunking.split_sections(combined, CHUNK_TOKENS)
+            if len(groups) >= len(partials):
+                break
+            partials = list(chunk_pool.map(lambda i: chunk_call(reduce_template, groups[i], prompt, field, 'combine', i),
+                                           range(len(groups))))
+            combined = '\n\n'.join(partials)
+        return chunk_call(reduce_template, combined, prompt, field, 'reduce', 0)
+    
+    def timed(name, template, prompt=None, field='summary'):
+        stage = {'summary': 'llm_summary', 'custom_response': 'llm_custom'}.get(field, 'llm_fused')
+        logging.info(f"Starting LLM {name} call" + (f" over {len(chunks)} chunks" if len(chunks) > 1 else ""))
+        start = time.time()
+        try:
+            if len(chunks) > 1:
+                map_template, reduce_template = {SUMMARY_PROMPT: (CHUNK_PROMPT, REDUCE_PROMPT),
+                                                 CUSTOM_PROMPT: (CUSTOM_CHUNK_PROMPT, CUSTOM_REDUCE_PROMPT)}[template]
+                content = map_reduce(map_template, reduce_template, prompt, field)
+            else:
+                content, _ = complete(template, chunks[0], prompt, field, call=field or 'fused')
+        except Exception:
+            metrics.STAGE_ERRORS.inc(stage=stage)
+            raise
+        elapsed = time.time() - start
+        metrics.STAGE_SECONDS.observe(elapsed, stage=stage)
+        logging.info(f"LLM {name} call complete in {elapsed:.2f}s")
+        if on_result and field:
+            on_result(field, content)
+        return content, elapsed
+    
+    wall_start = time.time()
+    custom_response = None
+    custom_llm_time = 0
+    fused = False
+    # Bounded fan-out for chunk calls, shared by the summary and the custom prompt
+    chunk_pool = ThreadPoolExecutor(max_workers=CHUNK_FANOUT, thread_name_prefix="llm-chunk") if len(chunks) > 1 else None
+    try:
+        if custom_prompt and SUMMARY_MODE == 'fused' and len(chunks) == 1:
+            # One completion returning both outputs
+            content, llm_time = timed("fused", FUSED_PROMPT, custom_prompt, None)
+            try:
+                summary, custom_response = parse_fused(content)
+                custom_llm_time = llm_time
+                fused = True
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Fused completion was not valid JSON, falling back to separate calls")
+        
+        if fused:
+            if on_result:
+                on_result('custom_response', custom_response)
+                on_result('summary', summary)
+        elif custom_prompt:
+            # Run the custom prompt alongside the summary instead of after it
+            custom_future = llm_pool.submit(timed, "custom prompt", CUSTOM_PROMPT, custom_prompt, 'custom_response')
+            summary, llm_time = timed("summary", SUMMARY_PROMPT)
+            custom_response, custom_llm_time = custom_future.result()
+        else:
+            summary, llm_time = timed("summary", SUMMARY_PROMPT)
+    finally:
+        if chunk_pool is not None:
+            chunk_pool.shutdown(wait=False)
+    
+    result = {
+        'summary': summary,
+        'llm_time': llm_time,
+        'custom_response': custom_response,
+        'custom_llm_time': custom_llm_time,
+        'llm_wall_time': time.time() - wall_start
+    }
+    if calls:
+        result['chunks'] = sorted(calls, key=lambda c: (c['field'], c['step'] != 'map', c['index']))
+    return result
+
+def fail_flight(flight, error):
+    # End a flight whose job never ran, so its members see `error` and later requests start afresh
+    for member in summary_flights.land(flight):
+        get_summary_cache()[member] = {'status': 'error', 'error': error}
+        notify_summary(member)
+
+def join_summary(key, request_id, entry):
+    # Attach `request_id` to the summary flight for `key` and store its pending `entry`. Runs off
+    # the loop; the flights lock makes sure no progress published in between is missed.
+    with summary_flights.lock:
+        flight = summary_flights.join(key, request_id)
+        try:
+            get_summary_cache()[request_id] = {**entry, 'job_id': flight.leader, **flight.state}
+        except Exception as e:
+            if flight.leader == request_id:
+                fail_flight(flight, str(e))
+            raise
+    return flight
+
+def generate_summary(request_id, model, chunks, flight=None):
+    # The article text is passed in rather than stored with the request, keeping shared entries small.
+    # Progress and the outcome go to every request attached to `flight`, each keeping its own timings.
+    def publish(**fields):
+        for member in summary_flights.publish(flight, **fields) if flight else [request_id]:
+            update_summary(member, **fields)
+    
+    try:
+        entry = get_summary_cache()[request_id]
+        result = summarize(chunks, entry['custom_prompt'], model,
+                           on_partial=lambda field, text: publish(**{f'partial_{field}': text}),
+                           on_result=lambda field, text: publish(**{field: text}))
+        outcome = {'status': 'complete', **result}
+    except Exception as e:
+        logging.error(f"LLM summary failed: {str(e)}")
+        outcome = {'status': 'error', 'error': str(e)}
+    
+    store = get_summary_cache()
+    for member in summary_flights.land(flight) if flight else [request_id]:
+        if outcome['status'] == 'complete':
+            get_history().add_summary(member, outcome)
+        with summary_updates_lock:
+            entry = store.get(member)
+            if entry is None:
+                continue
+            if outcome['status'] == 'complete':
+                store[member] = {
+                    **outcome,
+                    'request_time': entry['request_time'],
+                    'queue_time': entry['queue_time'],
+                    'readability_time': entry['readability_time']
+                }
+            else:
+                store[member] = outcome
+        notify_summary(member)
+
+async def load_article(url):
+    # Fetch and extract `url`, revalidating any cached extraction; concurrent loads
+    # of the same page share one fetch. Returns the article with its request,
+    # extraction queue and readability timings.
+    (article, timings), shared = await article_loads.do(fetcher.normalize_url(url), fetch_article, url)
+    if shared:
+        metrics.COALESCED.inc(stage='fetch')
+        logging.info(f"Shared in-flight fetch of {url}")
+    return article, timings
+
+async def fetch_article(url):
+    article_cache = get_article_cache()
+    # The cache holds whole articles (up to MBs of markdown), so it is read and written off the loop
+    cached = await asyncio.to_thread(article_cache.get, url)
+    logging.info(f"Making request to URL: {url}" + (" (revalidating cached copy)" if cached else ""))
+    request_start = time.time()
+    try:
+        response = await fetcher.fetch(url, headers=article_cache.revalidation_headers(cached))
+    except Exception:
+        metrics.STAGE_ERRORS.inc(stage='fetch')
+        raise
+    request_time = time.time() - request_start
+    metrics.STAGE_SECONDS.observe(request_time, stage='fetch')
+    
+    revalidated = response.status_code == 304 and cached
+    metrics.CACHE_LOOKUPS.inc(cache='article', result='hit' if revalidated else 'miss')
+    if revalidated:
+        logging.info(f"Not modified in {request_time:.2f}s, using cached extraction")
+        return cached, {'request_time': request_time, 'queue_time': 0, 'readability_time': 0,
+                        'content_bytes': 0, 'peak_bytes': 0}
+    
+    logging.info(f"Content retrieved: {response.bytes_read:,} bytes ({response.encoding}) in {request_time:.2f}s, "
+                 f"peak buffer ~{response.peak_bytes:,} bytes")
+    
+    metrics.INPUT_BYTES.inc(response.bytes_read)
+    
+    logging.info("Starting readability processing")
+    # Readability and html2text are CPU-bound; they run in the extraction process pool
+    try:
+        article = await extract.extract(response.text, url)
+    except Exception:
+        metrics.STAGE_ERRORS.inc(stage='extraction')
+        raise
+    metrics.STAGE_SECONDS.observe(article['queue_time'], stage='extraction_queue')
+    metrics.STAGE_SECONDS.observe(article['readability_time'] - article['markdown_time'], stage='extraction')
+    metrics.STAGE_SECONDS.observe(article['markdown_time'], stage='markdown')
+    logging.info(f"Readability processing complete in {article['readability_time']:.2f}s (queued {article['queue_time']:.2f}s)")
+    await asyncio.to_thread(article_cache.put, url, response, article)
+    return article, {'request_time': request_time, 'queue_time': article['queue_time'], 'readability_time': article['readability_time'],
+                     'content_bytes': response.bytes_read, 'peak_bytes': response.peak_bytes}
+
+def render_markdown(text, cache=True):
+    # Rendered HTML is reused across requests for the same text; `cache=False` for one-off text
+    if not cache:
+        import markdown
+        return markdown.markdown(text)
+    hits = render_cache.stats['hits']
+    html = render_cache.render(text)
+    metrics.CACHE_LOOKUPS.inc(cache='render', result='hit' if render_cache.stats['hits'] > hits else 'miss')
+    return html
+
+def article_page(url, article, format, timing=None, summary=None):
+    # The processed article with its statistics; `timing` and `summary` are shown when given
+    stat_style = "margin: 0.5em 0; color: #666; font-size: 0.9em;"
+    content = NotStr(render_markdown(article['markdown'])) if format == "html" else Pre(article['markdown'])
+    return Titled("Processed Article",
+        Script(src="https://unpkg.com/htmx.org@1.9.10"),
+        Style("pre { white-space: pre-wrap; background: #f5f5f5; padding: 1em; border-radius: 5px; }") if format != "html" else None,
+        H2(article['title']),
+        Details(open=True)(
+            Summary("📊 Statistics"),
+            P(f"Length: {article['char_count']:,} characters, ~{article['token_count']:,} tokens", style=stat_style),
+            P(f"Links: {article['link_char_count']:,} characters, ~{article['link_token_count']:,} tokens ({article['link_percentage']:.1f}% of total)", style=stat_style),
+            timing
+        ),
+        summary,
+        content,
+        A("Permalink", href=f"/article?{urlencode(dict(url=url, format=format))}"), " | ",
+        A("Back to home", href="/"))
+
+def article_etag(article, format):
+    # Weak, since compressed and uncompressed bodies differ byte for byte
+    return f'W/"{content_hash(chr(0).join([format, article["title"] or "", article["markdown"]]))[:32]}"'
+
+@rt("/article")
+def get(url: str, sess, req, format: str = 'markdown'):
+    # Repeat views of a processed article, served from the article cache with ETag revalidation
+    if not sess.get('username'):
+        return RedirectResponse("/login", status_code=303)
+    article = get_article_cache().get(url)
+    if article is None:
+        return Titled("Not found",
+            P("This article has not been processed yet.", style="color: #666;"),
+            A("Back to home", href="/"))
+    etag = article_etag(article, format)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in [tag.strip() for tag in req.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+    page = article_page(url, article, format, summary=Form(method="post", action="/process-url")(
+        Input(type="hidden", name="url", value=url),
+        Input(type="hidden", name="format", value=format),
+        Button("Summarize")
+    ))
+    return *page, *(HttpHeader(k, v) for k, v in headers.items())
+
 @rt("/process-url")
-def post(url: str, format: str, custom_prompt: str, sess):
+async def post(url: str, format: str, sess, custom_prompt: str = ''):
     username = sess.get('username')
     if not username:
         return RedirectResponse("/login", status_code=303)
     
+    metrics.IN_FLIGHT.inc(kind='process_url')
     try:
-        logging.info(f"Making request to URL: {url}")
-        request_start = time.time()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        request_time = time.time() - request_start
-        content_length = len(response.content)
-        logging.info(f"Content retrieved: {content_length:,} bytes in {request_time:.2f}s")
-        
-        logging.info("Starting readability processing")
-        readability_start = time.time()
-        
-        r = Readability(response.text, url=url)
-        article = r.parse()
-        readability_time = time.time() - readability_start
-        logging.info(f"Readability processing complete in {readability_time:.2f}s")
+        article, timings = await load_article(url)
         
-        h = html2text.HTML2Text()
-        markdown_content = h.handle(article['content'])
-        
-        char_count = len(markdown_content)
-        token_count = int(char_count / 4.5)
-        
-        # Calculate link statistics from markdown
-        import re
-        # Match markdown links [text](url) and extract the text
-        link_pattern = r'\[([^\]]+)\]\([^\)]+\)'
-        links = re.findall(link_pattern, markdown_content)
-        link_char_count = sum(len(link_text) for link_text in links)
-        link_token_count = int(link_char_count / 4.5)
-        link_percentage = (link_char_count / char_count * 100) if char_count > 0 else 0
+        markdown_content = article['markdown']
+        char_count = article['char_count']
+        token_count = article['token_count']
+        link_char_count = article['link_char_count']
+        link_token_count = article['link_token_count']
+        link_percentage = article['link_percentage']
         
         # Generate unique ID for this request
         import uuid
         request_id = str(uuid.uuid4())
         
-        # Store content for async summary generation
-        summary_cache[request_id] = {
-            'status': 'pending',
-            'markdown': markdown_content[:4000],
-            'char_count': char_count,
-            'token_count': token_count,
-            'link_char_count': link_char_count,
-            'link_token_count': link_token_count,
-            'link_percentage': link_percentage,
-            'request_time': request_time,
-            'readability_time': readability_time,
-            'custom_prompt': custom_prompt.strip() if custom_prompt else None
-        }
-        
-        # Start async summary generation
-        def generate_summary():
-            try:
-                logging.info("Starting LLM summary call")
-                llm_start = time.time()
-                client = OpenAI(
-                    base_url="https://openrouter.ai/api/v1",
-                    api_key=os.environ.get("OPENROUTER_API_KEY", "")
-                )
-                
-                model = os.environ.get("OPENROUTER_MODEL", "x-ai/grok-4.1-fast:free")
-                
-                # Generate summary
-                completion = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "user", "content": f"Summarize this article in 2-3 sentences using markdown formatting:\n\n{summary_cache[request_id]['markdown']}"}
-                    ]
-                )
-                summary = completion.choices[0].message.content
-                llm_time = time.time() - llm_start
-                logging.info(f"LLM summary call complete in {llm_time:.2f}s")
-                
-                # Generate custom prompt response if provided
-                custom_response = None
-                custom_llm_time = 0
-                if summary_cache[request_id]['custom_prompt']:
-                    logging.info("Starting custom prompt LLM call")
-                    custom_start = time.time()
-                    custom_completion = client.chat.completions.create(
-                        model=model,
-                        messages=[
-                            {"role": "user", "content": f"{summary_cache[request_id]['custom_prompt']}\n\nArticle content:\n\n{summary_cache[request_id]['markdown']}"}
-                        ]
-                    )
-                    custom_response = custom_completion.choices[0].message.content
-                    custom_llm_time = time.time() - custom_start
-                    logging.info(f"Custom prompt LLM call complete in {custom_llm_time:.2f}s")
-                
-                summary_cache[request_id] = {
-                    'status': 'complete',
-                    'summary': summary,
-                    'llm_time': llm_time,
-                    'custom_response': custom_response,
-                    'custom_llm_time': custom_llm_time,
-                    'request_time': summary_cache[request_id]['request_time'],
-                    'readability_time': summary_cache[request_id]['readability_time']
-                }
-            except Exception as e:
-                logging.error(f"LLM summary failed: {str(e)}")
-                summary_cache[request_id] = {
-                    'status': 'error',
-                    'error': str(e)
-                }
+        model = os.environ.get("OPENROUTER_MODEL", "x-ai/grok-4.1-fast:free")
+        prompt = custom_prompt.strip() if custom_prompt else None
         
-        Thread(target=generate_summary, daemon=True).start()
+        # Store content for async summary generation. If the same summary is already being
+        # generated, attach to it, picking up whatever it has produced so far.
+        flight = None
+        try:
+            flight = await asyncio.to_thread(join_summary, (fetcher.normalize_url(url), prompt, model), request_id, {
+                'status': 'pending',
+                'char_count': char_count,
+                'token_count': token_count,
+                'link_char_count': link_char_count,
+                'link_token_count': link_token_count,
+                'link_percentage': link_percentage,
+                **timings,
+                'custom_prompt': prompt,
+                'worker': os.getpid()
+            })
+            
+            get_history().record(username, url, article, timings, request_id, prompt)
+            
+            if flight.leader != request_id:
+                metrics.COALESCED.inc(stage='summary')
+                logging.info(f"Attached to in-flight summary {flight.leader}")
+            else:
+                # Queue summary generation
+                chunks = await asyncio.to_thread(summary_chunks, markdown_content)
+                if await asyncio.to_thread(summary_cached, model, chunks, prompt):
+                    # Everything is cached: finish now so the first /get-summary poll has the result
+                    await asyncio.to_thread(generate_summary, request_id, model, chunks, flight)
+                else:
+                    try:
+                        scheduler.submit(request_id, generate_summary, request_id, model, chunks, flight,
+                                         priority=jobs.INTERACTIVE)
+                    except jobs.QueueFull as e:
+                        logging.warning(str(e))
+                        fail_flight(flight, 'the summary queue is full, please try again shortly')
+        except Exception as e:
+            # A leader failing before its job started would leave everyone attached waiting for good
+            if flight is not None and flight.leader == request_id:
+                fail_flight(flight, str(e))
+            raise
         
         if format == "html":
-            # Render markdown as HTML
-            import markdown
-            html_content = markdown.markdown(markdown_content)
-            return Titled("Processed Article",
-                Script(src="https://unpkg.com/htmx.org@1.9.10"),
-                H2(article.get('title', 'Article Content')),
-                Details(open=True)(
-                    Summary("📊 Statistics"),
-                    P(f"Length: {char_count:,} characters, ~{token_count:,} tokens", style="margin: 0.5em 0; color: #666; font-size: 0.9em;"),
-                    P(f"Links: {link_char_count:,} characters, ~{link_token_count:,} tokens ({link_percentage:.1f}% of total)", style="margin: 0.5em 0; color: #666; font-size: 0.9em;"),
-                    P(id=f"timing-{request_id}", style="margin: 0.5em 0; color: #666; font-size: 0.9em;")(f"Timing: Request {request_time:.2f}s | Readability {readability_time:.2f}s")
-                ),
-                Details(open=True)(
-                    Summary("📝 Summary"),
-                    Div(id="summary-container", hx_get=f"/get-summary/{request_id}", hx_trigger="load", hx_swap="outerHTML")(
-                        P("⏳ Generating summary...", style="color: #666; font-style: italic;")
-                    )
-                ),
-                NotStr(html_content),
-                A("Back to home", href="/"))
-        else:
-            # Display as markdown
-            return Titled("Processed Article",
-                Script(src="https://unpkg.com/htmx.org@1.9.10"),
-                Style("pre { white-space: pre-wrap; background: #f5f5f5; padding: 1em; border-radius: 5px; }"),
-                H2(article.get('title', 'Article Content')),
-                Details(open=True)(
-                    Summary("📊 Statistics"),
-                    P(f"Length: {char_count:,} characters, ~{token_count:,} tokens", style="margin: 0.5em 0; color: #666; font-size: 0.9em;"),
-                    P(f"Links: {link_char_count:,} characters, ~{link_token_count:,} tokens ({link_percentage:.1f}% of total)", style="margin: 0.5em 0; color: #666; font-size: 0.9em;"),
-                    P(id=f"timing-{request_id}", style="margin: 0.5em 0; color: #666; font-size: 0.9em;")(f"Timing: Request {request_time:.2f}s | Readability {readability_time:.2f}s")
-                ),
-                Details(open=True)(
-                    Summary("📝 Summary"),
-                    Div(id="summary-container", hx_get=f"/get-summary/{request_id}", hx_trigger="load", hx_swap="outerHTML")(
-                        P("⏳ Generating summary...", style="color: #666; font-style: italic;")
-                    )
-                ),
-                Pre(markdown_content),
-                A("Back to home", href="/"))
+            # Render (or fetch the cached render) off the event loop; article_page then hits the cache
+            await asyncio.to_thread(render_markdown, markdown_content)
+        return article_page(url, article, format,
+            P(id=f"timing-{request_id}", style="margin: 0.5em 0; color: #666; font-size: 0.9em;")(timing_text(timings)),
+            Details(open=True)(
+                Summary("📝 Summary"),
+                *summary_container(request_id)
+            ))
     except Exception as e:
         return Titled("Error",
             P(f"Error processing URL: {str(e)}", style="color: red"),
             A("Back to home", href="/"))
+    finally:
+        metrics.IN_FLIGHT.dec(kind='process_url')
 
-# Store summary requests
-summary_cache = {}
+# Store summary requests; abandoned ones expire and the total size is capped. With several
+# worker processes they go in the shared database so any worker can answer the polls.
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+SUMMARY_STORE = os.environ.get('SUMMARY_STORE', 'sqlite' if WEB_WORKERS > 1 else 'memory')
+# Each write to the shared store takes SQLite's one write lock, so streamed text is written less often
+SHARED_PUBLISH_INTERVAL = float(os.environ.get('SUMMARY_SHARED_PUBLISH_INTERVAL', 0.5))
+
+def get_summary_cache():
+    global summary_cache
+    with resources_lock:
+        if summary_cache is None:
+            summary_cache = SqliteSummaryStore(get_db()) if SUMMARY_STORE == 'sqlite' else SummaryStore()
+            # Jobs don't survive their process, so nothing will finish what a stopped worker left pending
+            summary_cache.fail_orphans("the server restarted before this summary finished, please try again")
+        return summary_cache
+
+def summary_sections(summary, custom_response=None, cache=True):
+    # Build summary div with custom response if present
+    summary_content = []
+    
+    if custom_response:
+        custom_html = render_markdown(custom_response, cache)
+        summary_content.append(
+            Div(
+                H4("Custom Analysis", style="margin-top: 0;"),
+                Div(NotStr(custom_html), style="background: #fff3cd; padding: 1em; border-radius: 5px; border-left: 4px solid #ffc107; margin-bottom: 1em;")
+            )
+        )
+    
+    if summary:
+        summary_content.append(
+            Div(
+                H4("Summary", style="margin-top: 0;"),
+                Div(NotStr(render_markdown(summary, cache)), style="background: #f0f8ff; padding: 1em; border-radius: 5px; border-left: 4px solid #4a90e2;")
+            )
+        )
+    return summary_content
+
+def summary_container(request_id):
+    # Without streaming the container polls /get-summary straight away; with it,
+    # tokens arrive over /stream-summary and the final poll fires on 'summary-done'
+    container = Div(id="summary-container", hx_get=f"/get-summary/{request_id}",
+                    hx_trigger="summary-done" if SUMMARY_STREAMING else "load", hx_swap="outerHTML")(
+        P("⏳ Generating summary...", style="color: #666; font-style: italic;")
+    )
+    if not SUMMARY_STREAMING:
+        return container,
+    return container, Script(f"""
+        (function() {{
+            function start() {{
+                const el = document.getElementById('summary-container');
+                if (!window.EventSource) {{ htmx.trigger(el, 'summary-done'); return; }}
+                const source = new EventSource('/stream-summary/{request_id}');
+                const finish = () => {{ source.close(); htmx.trigger(el, 'summary-done'); }};
+                source.addEventListener('summary', e => {{ el.innerHTML = e.data; }});
+                source.addEventListener('done', finish);
+                source.onerror = finish;
+            }}
+            if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', start);
+            else start();
+        }})();
+    """)
+
+@rt("/stream-summary/{request_id}")
+async def get(request_id: str):
+    async def events():
+        # Woken by notify_summary when this process updates the entry; a job running in
+        # another worker process is picked up from the shared store every SHARED_PUBLISH_INTERVAL
+        changed = asyncio.Event()
+        watcher = (asyncio.get_running_loop(), changed)
+        with summary_watchers_lock:
+            summary_watchers.setdefault(request_id, set()).add(watcher)
+        try:
+            sent = None
+            while True:
+                changed.clear()
+                result = await asyncio.to_thread(get_summary_cache().get, request_id)
+                if result is None or result['status'] != 'pending':
+                    yield sse_message(Div(), event='done')
+                    return
+                partial = (result.get('partial_summary'), result.get('partial_custom_response'))
+                if any(partial) and partial != sent:
+                    sent = partial
+                    # Markdown rendering of the growing text runs off the loop as well
+                    yield await asyncio.to_thread(
+                        lambda: sse_message(Div(*summary_sections(*partial, cache=False)), event='summary'))
+                try:
+                    await asyncio.wait_for(changed.wait(), SHARED_PUBLISH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with summary_watchers_lock:
+                watchers = summary_watchers.get(request_id, set())
+                watchers.discard(watcher)
+                if not watchers:
+                    summary_watchers.pop(request_id, None)
+    return EventStream(events())
 
 @rt("/get-summary/{request_id}")
 def get(request_id: str):
-    # Check if summary is ready
-    if request_id not in summary_cache:
+    # Read once: the sweeper or an eviction can drop the entry at any point
+    result = get_summary_cache().get(request_id)
+    if result is None:
         return Div(id="summary-container")(
             P("Summary expired", style="color: #666; font-style: italic;")
         )
     
-    result = summary_cache[request_id]
-    
     if result['status'] == 'complete':
-        # Render markdown summary to HTML
-        import markdown
-        summary_html = markdown.markdown(result['summary'])
-        
         # Update timing info
-        total_llm_time = result['llm_time'] + result.get('custom_llm_time', 0)
         timing_script = Script(f"""
             const timingEl = document.getElementById('timing-{request_id}');
             if (timingEl) {{
-                timingEl.textContent = 'Timing: Request {result['request_time']:.2f}s | Readability {result['readability_time']:.2f}s | LLM {total_llm_time:.2f}s';
+                timingEl.textContent = '{timing_text(result, result)}';
             }}
         """)
         
-        # Build summary div with custom response if present
-        summary_content = []
-        
-        if result.get('custom_response'):
-            custom_html = markdown.markdown(result['custom_response'])
-            summary_content.append(
-                Div(
-                    H4("Custom Analysis", style="margin-top: 0;"),
-                    Div(NotStr(custom_html), style="background: #fff3cd; padding: 1em; border-radius: 5px; border-left: 4px solid #ffc107; margin-bottom: 1em;")
-                )
-            )
-        
-        summary_content.append(
-            Div(
-                H4("Summary", style="margin-top: 0;" if result.get('custom_response') else "margin-top: 0;"),
-                Div(NotStr(summary_html), style="background: #f0f8ff; padding: 1em; border-radius: 5px; border-left: 4px solid #4a90e2;")
-            )
-        )
-        
         summary_div = Div(id="summary-container")(
-            *summary_content,
+            *summary_sections(result['summary'], result.get('custom_response')),
             timing_script
         )
-        del summary_cache[request_id]
+        del get_summary_cache()[request_id]
         return summary_div
     elif result['status'] == 'error':
         error_div = Div(id="summary-container")(
             P(f"Summary unavailable: {result['error']}", style="color: #dc3545; margin-top: 0.5em;")
         )
-        del summary_cache[request_id]
+        del get_summary_cache()[request_id]
         return error_div
     else:
-        # Still processing, poll again
+        # Still processing, show whichever output is ready and poll again
+        position = scheduler.position(result.get('job_id', request_id))
+        status = f"⏳ Queued, position {position}..." if position else "⏳ Generating summary..."
         return Div(id="summary-container", hx_get=f"/get-summary/{request_id}", hx_trigger="load delay:1s", hx_swap="outerHTML")(
-            P("⏳ Generating summary...", style="color: #666; font-style: italic;")
+            *summary_sections(result.get('summary'), result.get('custom_response')),
+            P(status, style="color: #666; font-style: italic;")
         )
 
+HISTORY_PAGE_SIZE = 20
+
+def highlighted(snippet):
+    # Snippet text with the search matches in <mark>; the text itself is escaped as usual
+    parts = []
+    for i, piece in enumerate(snippet.split(MATCH_START)):
+        match, _, rest = piece.partition(MATCH_END) if i else ('', '', piece)
+        if match:
+            parts.append(Mark(match))
+        if rest:
+            parts.append(rest)
+    return parts
+
+@rt("/history")
+def get(sess, q: str = '', page: int = 1):
+    # The user's processed articles, searched through the full-text index
+    username = sess.get('username')
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+    page = max(1, page)
+    start = time.time()
+    rows = get_history().search(username, q, limit=HISTORY_PAGE_SIZE + 1, offset=(page - 1) * HISTORY_PAGE_SIZE)
+    metrics.STAGE_SECONDS.observe(time.time() - start, stage='history_search')
+    more, rows = len(rows) > HISTORY_PAGE_SIZE, rows[:HISTORY_PAGE_SIZE]
+    stat_style = "margin: 0.5em 0; color: #666; font-size: 0.9em;"
+    return Titled("History",
+        Form(method="get", action="/history")(
+            Input(name="q", value=q, type="search", placeholder="Search titles, summaries and article text"),
+            Button("Search")
+        ),
+        Ul(*[Li(
+            A(row['title'] or row['url'], href=f"/history/{row['id']}"),
+            P(row['url'], " · ", time.strftime('%Y-%m-%d %H:%M', time.localtime(row['processed_at'])), style=stat_style),
+            P(*highlighted(row['snippet'] or ''), style=stat_style)
+        ) for row in rows]) if rows else P("No matching articles" if q else "No articles processed yet", style=stat_style),
+        P(A("Previous", href=f"/history?{urlencode(dict(q=q, page=page - 1))}") if page > 1 else None,
+          " " if page > 1 and more else None,
+          A("Next", href=f"/history?{urlencode(dict(q=q, page=page + 1))}") if more else None),
+        A("Back to home", href="/"))
+
+@rt("/history/{article_id}")
+def get(article_id: int, sess, format: str = 'markdown'):
+    # A stored article with its summary, without fetching the page or calling the LLM again
+    username = sess.get('username')
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+    row = get_history().get(username, article_id)
+    if row is None:
+        return Titled("Not found",
+            P("This article is not in your history.", style="color: #666;"),
+            A("Back to history", href="/history"))
+    summary = Details(open=True)(
+        Summary("📝 Summary"),
+        *summary_sections(row['summary'], row['custom_response'])
+    ) if row['summary'] else None
+    return article_page(row['url'], row, format,
+        P(timing_text(row, row if row['summary'] else None), style="margin: 0.5em 0; color: #666; font-size: 0.9em;"),
+        summary)
+
+@rt("/jobs")
+def get(sess):
+    if not sess.get('username'):
+        return RedirectResponse("/login", status_code=303)
+    return dict(scheduler.snapshot(), summary_cache=get_summary_cache().stats(),
+                rate_limits={c.kind: dict(c.stats, retry_reasons=c.retry_reasons, limits=c.limits())
+                             for c in (fetcher.origins, llm_limits)},
+                coalescing=dict(summary_flights.snapshot(), fetch=article_loads.stats),
+                history=get_history().stats,
+                llm=get_llm_clients().snapshot(),
+                feeds=dict(ingester.stats if ingester else {}, items=get_feeds().counts()))
+
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 500))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+BATCH_FIELDS = ['index', 'url', 'status', 'error', 'completed', 'total', 'dropped', 'title', 'char_count', 'token_count',
+                'link_char_count', 'link_token_count', 'link_percentage', 'request_time', 'queue_time', 'readability_time',
+                'content_bytes', 'peak_bytes', 'llm_time', 'custom_llm_time', 'llm_wall_time', 'chunk_count', 'summary', 'custom_response']
+
+def parse_batch_urls(text):
+    # One URL per line; for CSV files the first column. Anything else is skipped.
+    urls, seen = [], set()
+    for line in text.splitlines():
+        url = line.split(',')[0].strip().strip('"')
+        if url.startswith(('http://', 'https://')) and url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+async def submit_batch_job(job_id, *args):
+    # Batch work waits for queue space rather than failing like interactive requests
+    while True:
+        try:
+            return scheduler.submit(job_id, summarize, *args, priority=jobs.BATCH)
+        except jobs.QueueFull:
+            await asyncio.sleep(1)
+
+async def process_batch_url(index, url, custom_prompt, model, with_summary, username):
+    import uuid
+    row = {'index': index, 'url': url}
+    try:
+        article, timings = await load_article(url)
+        request_id = str(uuid.uuid4())
+        get_history().record(username, url, article, timings, request_id, custom_prompt)
+        row.update({k: article[k] for k in ('title', 'char_count', 'token_count', 'link_char_count',
+                                            'link_token_count', 'link_percentage')})
+        row.update(timings)
+        if with_summary:
+            chunks = await asyncio.to_thread(summary_chunks, article['markdown'])
+            job = await submit_batch_job(request_id, chunks, custom_prompt, model)
+            row.update(await asyncio.wrap_future(job.future))
+            get_history().add_summary(request_id, row)
+            row['chunk_count'] = len([c for c in row.get('chunks', []) if c['field'] == 'summary' and c['step'] == 'map']) or 1
+        row['status'] = 'ok'
+    except Exception as e:
+        logging.error(f"Batch item {url} failed: {str(e)}")
+        row.update(status='error', error=str(e))
+    return row
+
+@rt("/batch")
+def get(sess):
+    if not sess.get('username'):
+        return RedirectResponse("/login", status_code=303)
+    return Titled("Batch Process",
+        Form(method="post", action="/batch", enctype="multipart/form-data")(
+            Textarea(name="urls", placeholder="One URL per line", rows=10, style="width: 100%;"),
+            Label("Or upload a text/CSV file of URLs", Input(type="file", name="file", accept=".txt,.csv")),
+            Textarea(name="custom_prompt", placeholder="Optional: Additional prompt for post-processing (e.g., 'Extract all dates and events')", rows=3, style="width: 100%; margin-top: 0.5em;"),
+            Label("Parallelism", Input(type="number", name="parallelism", value=BATCH_CONCURRENCY, min=1, max=32)),
+            Label(Input(type="checkbox", name="with_summary", value="1", checked=True), "Generate summaries"),
+            Div(
+                Label(Input(type="radio", name="output", value="ndjson", checked=True), "NDJSON"),
+                Label(Input(type="radio", name="output", value="csv"), "CSV")
+            ),
+            Button("Process URLs")
+        ),
+        A("Back to home", href="/"))
+
+@rt("/batch")
+async def post(sess, urls: str = '', file: UploadFile = None, custom_prompt: str = '', output: str = 'ndjson',
+               parallelism: int = BATCH_CONCURRENCY, with_summary: str = ''):
+    if not sess.get('username'):
+        return RedirectResponse("/login", status_code=303)
+    
+    text = urls
+    if file is not None and getattr(file, 'filename', None):
+        text += '\n' + (await file.read()).decode('utf-8', errors='replace')
+    url_list = parse_batch_urls(text)
+    # URLs past BATCH_MAX_URLS are left out; every row reports how many
+    dropped = max(0, len(url_list) - BATCH_MAX_URLS)
+    url_list = url_list[:BATCH_MAX_URLS]
+    if not url_list:
+        return Titled("Error",
+            P("No valid http(s) URLs found", style="color: red"),
+            A("Back to batch", href="/batch"))
+    
+    model = os.environ.get("OPENROUTER_MODEL", "x-ai/grok-4.1-fast:free")
+    prompt = custom_prompt.strip() or None
+    parallelism = max(1, min(parallelism, 32))
+    limit = asyncio.Semaphore(parallelism)
+    logging.info(f"Starting batch of {len(url_list)} URLs with parallelism {parallelism}")
+    if dropped:
+        logging.warning(f"Batch limited to {BATCH_MAX_URLS} URLs, dropped {dropped}")
+    
+    async def run(index, url):
+        async with limit:
+            metrics.IN_FLIGHT.inc(kind='batch_item')
+            try:
+                return await process_batch_url(index, url, prompt, model, bool(with_summary), sess['username'])
+            finally:
+                metrics.IN_FLIGHT.dec(kind='batch_item')
+    
+    async def rows():
+        # Emit each result as soon as it finishes
+        import csv, io, json
+        tasks = [asyncio.create_task(run(i, url)) for i, url in enumerate(url_list)]
+        try:
+            if output == 'csv':
+                buf = io.StringIO()
+                writer = csv.DictWriter(buf, fieldnames=BATCH_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                yield buf.getvalue()
+            for completed, task in enumerate(asyncio.as_completed(tasks), 1):
+                row = dict(await task, completed=completed, total=len(tasks), dropped=dropped)
+                if output == 'csv':
+                    buf.seek(0)
+                    buf.truncate()
+                    writer.writerow(row)
+                    yield buf.getvalue()
+                else:
+                    yield json.dumps(row) + '\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    if output == 'csv':
+        return StreamingResponse(rows(), media_type="text/csv",
+                                 headers={'Content-Disposition': 'attachment; filename="batch.csv"'})
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+# Article tokens per hour feed ingestion may send to the LLM, with up to ten minutes' worth at once
+feed_llm_budget = ratelimit.TokenBucket(feeds.LLM_TOKENS_PER_HOUR / 3600, feeds.LLM_TOKENS_PER_HOUR / 6)
+
+def ingest_busy():
+    # Interactive work comes first: no new feed entries while summaries wait for a worker
+    # or the extraction pool is fully used
+    return scheduler.queued(jobs.INTERACTIVE) > 0 or extract.in_flight >= max(1, extract.WORKERS)
+
+async def fetch_feed(url, headers):
+    return await fetcher.fetch(url, headers=headers, media_types=feeds.FEED_TYPES)
+
+async def ingest_url(url):
+    # The /process-url pipeline for a feed entry at batch priority. The article and summary
+    # end up in the article and LLM caches, which answer a later /process-url for it.
+    import uuid
+    model = os.environ.get("OPENROUTER_MODEL", "x-ai/grok-4.1-fast:free")
+    article, timings = await load_article(url)
+    chunks = await asyncio.to_thread(summary_chunks, article['markdown'])
+    if await asyncio.to_thread(summary_cached, model, chunks, None):
+        return
+    await asyncio.sleep(feed_llm_budget.take(article['token_count']))
+    job = await submit_batch_job(f"feed-{uuid.uuid4()}", chunks, None, model)
+    await asyncio.wrap_future(job.future)
+
+def feeds_page(username, message=None):
+    store = get_feeds()
+    rows, items = store.list(username), store.recent_items(username)
+    stat_style = "margin: 0.5em 0; color: #666; font-size: 0.9em;"
+    when = lambda t: time.strftime('%Y-%m-%d %H:%M', time.localtime(t)) if t else "not yet"
+    return Titled("Feeds",
+        P("New entries in these RSS/Atom feeds and sitemaps are fetched and summarized in the background, "
+          "so they open straight away.", style=stat_style),
+        P(message, style="color: red") if message else None,
+        Form(method="post", action="/feeds")(
+            Input(name="url", type="url", placeholder="Feed or sitemap URL", required=True),
+            Button("Add feed")
+        ),
+        Table(
+            Tr(Th("Feed"), Th("Status"), Th("Last polled"), Th("Processed"), Th()),
+            *[Tr(Td(row['url']), Td(row['status'] + (f": {row['error']}" if row['error'] else '')),
+                 Td(when(row['polled_at'])), Td(row['processed']),
+                 Td(Form(method="post", action=f"/feeds/{row['id']}/delete")(Button("Remove"))))
+              for row in rows]
+        ) if rows else P("No feeds registered yet", style=stat_style),
+        H3("Recent entries") if items else None,
+        Ul(*[Li(A(item['title'] or item['url'], href=f"/article?{urlencode(dict(url=item['url']))}")
+                if item['status'] == 'done' else item['title'] or item['url'],
+                f" · {item['status']}", f": {item['error']}" if item['error'] else None)
+             for item in items]) if items else None,
+        A("Back to home", href="/"))
+
+@rt("/feeds")
+def get(sess):
+    username = sess.get('username')
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+    return feeds_page(username)
+
+@rt("/feeds")
+def post(url: str, sess):
+    username = sess.get('username')
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        return feeds_page(username, "Feed URLs must start with http:// or https://")
+    feed = get_feeds().add(url, username)
+    if feed['username'] != username:
+        return feeds_page(username, "That feed is already registered and being ingested")
+    logging.info(f"Feed {url} registered by {username}")
+    return RedirectResponse("/feeds", status_code=303)
+
+@rt("/feeds/{feed_id}/delete")
+def post(feed_id: int, sess):
+    username = sess.get('username')
+    if not username:
+        return RedirectResponse("/login", status_code=303)
+    get_feeds().remove(feed_id, username)
+    return RedirectResponse("/feeds", status_code=303)
+
+@rt("/metrics")
+def get():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @rt("/logout")
 def get(sess):
     sess.clear()
     return RedirectResponse("/", status_code=303)
 
-serve(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
+if __name__ == '__main__':
+    if WEB_WORKERS > 1:
+        # uvicorn's multi-process mode; live reload only works with a single worker
+        import uvicorn
+        uvicorn.run('app:app', host='0.0.0.0', port=int(os.environ.get('PORT', 10000)), workers=WEB_WORKERS)
+    else:
+        serve(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,41 @@
+import time
+
+from apswutils.db import NotFoundError
+
+from fetcher import normalize_url
+
+class ArticleCache:
+    """Extracted articles keyed by normalized URL, revalidated with ETag/Last-Modified."""
+
+    def __init__(self, db):
+        self.articles = db.t.articles
+        if self.articles not in db.t:
+            self.articles.create(dict(url=str, etag=str, last_modified=str, title=str, markdown=str,
+                                      char_count=int, token_count=int, link_char_count=int,
+                                      link_token_count=int, link_percentage=float, fetched_at=float),
+                                 pk='url')
+
+    def get(self, url):
+        try:
+            return self.articles.get(normalize_url(url))
+        except NotFoundError:
+            return None
+
+    def revalidation_headers(self, cached):
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def put(self, url, response, extracted):
+        """Store `extracted` (title, markdown and link stats) along with `response`'s validators."""
+        row = dict(url=normalize_url(url),
+                   etag=response.headers.get('etag'),
+                   last_modified=response.headers.get('last-modified'),
+                   fetched_at=time.time(),
+                   **{k: extracted[k] for k in ('title', 'markdown', 'char_count', 'token_count',
+                                                'link_char_count', 'link_token_count', 'link_percentage')})
+        self.articles.upsert(row)
+        return row
@@ -0,0 +1,156 @@
+"""Offline benchmarks for the extraction and rendering pipeline.
+
+    python bench/run.py                 # per-stage timings over bench/corpus
+    python bench/run.py --e2e           # plus /process-url against local stub servers
+
+Everything runs locally: pages are served from bench/corpus and the LLM is
+bench/stub_llm.py, so results are comparable between runs and machines.
+"""
+import argparse
+import functools
+import logging
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+CORPUS_DIR = BENCH_DIR / 'corpus'
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def measure(fn, iterations):
+    """Run `fn` `iterations` times; returns (durations, peak traced bytes of one extra run)."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return durations, peak
+
+def report(rows):
+    header = f"{'page':<18} {'stage':<16} {'p50 ms':>9} {'p99 ms':>9} {'MB/s':>9} {'pages/s':>9} {'peak KB':>9}"
+    print(header)
+    print('-' * len(header))
+    for page, stage, size, durations, peak in rows:
+        mean = statistics.mean(durations)
+        peak_kb = f"{peak / 1024:.0f}" if peak is not None else '-'
+        print(f"{page:<18} {stage:<16} {percentile(durations, 50) * 1000:>9.2f} {percentile(durations, 99) * 1000:>9.2f} "
+              f"{size / mean / 1e6 if mean else 0:>9.2f} {1 / mean if mean else 0:>9.1f} {peak_kb:>9}")
+
+def bench_stages(pages, iterations):
+    import html2text
+    import markdown
+    from pyreadability import Readability
+    import dom_markdown
+    from extract import LINK_PATTERN
+
+    rows = []
+    for path in pages:
+        html = path.read_text(encoding='utf-8')
+        url = f"https://bench.local/{path.name}"
+        article = Readability(html, url=url).parse()
+        markdown_content = html2text.HTML2Text().handle(article['content'])
+        stages = [
+            ('readability', len(html.encode()), lambda: Readability(html, url=url).parse()),
+            ('html2text', len(article['content'].encode()), lambda: html2text.HTML2Text().handle(article['content'])),
+            ('link_regex', len(markdown_content.encode()), lambda: LINK_PATTERN.findall(markdown_content)),
+            ('dom_markdown', len(article['content'].encode()), lambda: dom_markdown.convert(article['content'])),
+            ('markdown_render', len(markdown_content.encode()), lambda: markdown.markdown(markdown_content)),
+        ]
+        for stage, size, fn in stages:
+            durations, peak = measure(fn, iterations)
+            rows.append((path.stem, stage, size, durations, peak))
+    return rows
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve_corpus():
+    handler = functools.partial(QuietHandler, directory=str(CORPUS_DIR))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def bench_e2e(pages, iterations, llm_latency):
+    """Time /process-url (fetch + extraction) and the summary it queues, with fresh caches each run."""
+    from stub_llm import start_stub
+    llm_server, llm_url = start_stub(latency=llm_latency)
+    corpus_server, corpus_url = serve_corpus()
+    os.environ['OPENROUTER_BASE_URL'] = llm_url
+    os.environ.setdefault('OPENROUTER_API_KEY', 'stub')
+    # Every request goes to one local origin and one stub provider; don't pace them
+    os.environ.setdefault('FETCH_RATE', '0')
+    os.environ.setdefault('LLM_RATE', '0')
+    logging.disable(logging.INFO)
+
+    # The app keeps users.db in the working directory; keep it out of the repo
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from fasthtml.common import database
+        from starlette.testclient import TestClient
+        import app as app_module
+        from article_cache import ArticleCache
+        from llm_cache import LLMCache
+
+        client = TestClient(app_module.app)
+        client.post("/register", data={"username": "bench", "password": "bench"})
+        rows = []
+        for path in pages:
+            page_times, summary_times = [], []
+            for _ in range(iterations):
+                fresh = database(':memory:')
+                app_module.article_cache = ArticleCache(fresh)
+                app_module.llm_cache = LLMCache(fresh)
+                start = time.perf_counter()
+                response = client.post("/process-url", data={"url": f"{corpus_url}/{path.name}", "format": "html"})
+                page_times.append(time.perf_counter() - start)
+                request_id = re.search(r'/get-summary/([0-9a-f-]+)', response.text).group(1)
+                while 'hx-get' in client.get(f"/get-summary/{request_id}", headers={'HX-Request': '1'}).text:
+                    time.sleep(0.005)
+                summary_times.append(time.perf_counter() - start)
+            size = path.stat().st_size
+            rows.append((path.stem, 'process_url', size, page_times, None))
+            rows.append((path.stem, 'with_summary', size, summary_times, None))
+        return rows
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        llm_server.shutdown()
+        corpus_server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--page', action='append', help="corpus file name to include (default: all)")
+    parser.add_argument('--e2e', action='store_true', help="also benchmark /process-url end to end")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="stub LLM time to first token")
+    args = parser.parse_args()
+
+    pages = sorted(CORPUS_DIR.glob('*.html'))
+    if args.page:
+        pages = [p for p in pages if p.name in args.page]
+    rows = bench_stages(pages, args.iterations)
+    if args.e2e:
+        rows += bench_e2e(pages, max(1, args.iterations // 4), args.llm_latency)
+    report(rows)
+
+if __name__ == '__main__':
+    main()
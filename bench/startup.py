@@ -0,0 +1,113 @@
+"""Cold start benchmarks: module import time and first-request latency of a fresh server.
+
+    python bench/startup.py                 # 5 cold starts
+    python bench/startup.py --runs 10 --no-prewarm
+
+Each run starts a new uvicorn process in an empty directory, so nothing is
+cached on disk. Pages come from bench/corpus and the LLM is bench/stub_llm.py.
+"""
+import argparse
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from run import percentile, serve_corpus
+from stub_llm import start_stub
+
+def child_env(**extra):
+    # Keep any extra import paths of this interpreter (e.g. a local pyreadability)
+    path = os.pathsep.join([str(REPO_DIR)] + [p for p in sys.path if p])
+    return dict(os.environ, PYTHONPATH=path, **extra)
+
+def import_time(workdir):
+    script = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', script], cwd=workdir, env=child_env(),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def cold_start(workdir, page_url, llm_url, prewarm):
+    """Start a server; returns seconds to the first response, the first and second
+    /process-url, and the first finished summary."""
+    port = free_port()
+    env = child_env(OPENROUTER_BASE_URL=llm_url, OPENROUTER_API_KEY='stub', PREWARM='1' if prewarm else '0',
+                    SUMMARY_STREAMING='0')
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port), '--log-level', 'warning'],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            while True:
+                try:
+                    client.get('/')
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None:
+                        raise RuntimeError("server exited during startup")
+                    time.sleep(0.005)
+            first_response = time.perf_counter() - start
+            client.post('/register', data={'username': 'bench', 'password': 'bench'})
+            timings = {'first_response': first_response}
+            for name in ('first_process_url', 'second_process_url'):
+                request_start = time.perf_counter()
+                response = client.post('/process-url', data={'url': page_url, 'format': 'html'})
+                timings[name] = time.perf_counter() - request_start
+                if name == 'first_process_url':
+                    request_id = re.search(r'/get-summary/([0-9a-f-]+)', response.text).group(1)
+                    while 'hx-get' in client.get(f'/get-summary/{request_id}').text:
+                        time.sleep(0.005)
+                    timings['first_summary'] = time.perf_counter() - request_start
+            return timings
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--page', default='small_blog.html', help="corpus file to process")
+    parser.add_argument('--no-prewarm', action='store_true', help="start servers with PREWARM=0")
+    args = parser.parse_args()
+
+    llm_server, llm_url = start_stub()
+    corpus_server, corpus_url = serve_corpus()
+    results = {}
+    try:
+        for _ in range(args.runs):
+            workdir = tempfile.mkdtemp()
+            try:
+                results.setdefault('import_app', []).append(import_time(workdir))
+                for name, value in cold_start(workdir, f"{corpus_url}/{args.page}", llm_url, not args.no_prewarm).items():
+                    results.setdefault(name, []).append(value)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        llm_server.shutdown()
+        corpus_server.shutdown()
+
+    header = f"{'measure':<20} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, values in results.items():
+        print(f"{name:<20} {percentile(values, 50) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f} "
+              f"{statistics.mean(values) * 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
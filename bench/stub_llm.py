@@ -0,0 +1,93 @@
+"""Local OpenAI-compatible chat completions server for benchmarks and tests.
+
+    python bench/stub_llm.py --port 8001 --latency 0.5
+
+then point the app at it with OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "This is a **stub** summary of the article, generated locally for benchmarking. It has no real content."
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0        # seconds before the first token
+    token_delay = 0.0    # seconds between streamed tokens
+    status = 200         # any other status is returned as an error, for failover tests
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.latency)
+        if self.status != 200:
+            body = json.dumps({'error': {'message': f"stub error {self.status}", 'code': self.status}}).encode()
+            self.send_response(self.status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        words = REPLY.split(' ')
+        usage = {'prompt_tokens': 0, 'completion_tokens': len(words), 'total_tokens': len(words)}
+        if request.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for i, word in enumerate(words):
+                delta = {'content': word if i == 0 else ' ' + word}
+                self._event(self._chunk(request, [{'index': 0, 'delta': delta, 'finish_reason': None}]))
+                time.sleep(self.token_delay)
+            self._event(self._chunk(request, [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+            if request.get('stream_options', {}).get('include_usage'):
+                self._event(dict(self._chunk(request, []), usage=usage))
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.close_connection = True
+        else:
+            body = json.dumps({
+                'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()),
+                'model': request.get('model', 'stub'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': REPLY}, 'finish_reason': 'stop'}],
+                'usage': usage
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def _chunk(self, request, choices):
+        return {'id': 'stub', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': request.get('model', 'stub'), 'choices': choices}
+
+    def _event(self, data):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+def start_stub(port=0, latency=0.0, token_delay=0.0, status=200):
+    """Serve the stub in a background thread; returns (server, base_url)."""
+    handler = type('Handler', (StubHandler,), {'latency': latency, 'token_delay': token_delay, 'status': status})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+    server, base_url = start_stub(args.port, args.latency, args.token_delay)
+    print(f"Stub LLM listening at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,87 @@
+import logging
+import re
+from threading import Lock
+
+# tiktoken gives exact counts for OpenAI-style tokenizers; without it (or without
+# its encoding files) fall back to counting word and punctuation pieces, which
+# tracks BPE token counts for English prose far better than a chars/N ratio.
+# The encoding is loaded on the first count, since it may read or download its files.
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = Lock()
+
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+HEADING_PATTERN = re.compile(r'^#{1,6} ', re.M)
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+def get_encoding():
+    """The tiktoken encoding, or None if tiktoken or its encoding files are unavailable."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                logging.warning(f"tiktoken unavailable ({str(e)}), estimating token counts")
+            _encoding_loaded = True
+        return _encoding
+
+def count_tokens(text):
+    encoding = _encoding if _encoding_loaded else get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Long words split into several BPE tokens
+    return sum(1 + len(piece) // 8 for piece in PIECE_PATTERN.findall(text))
+
+def _cut(text, max_tokens):
+    # No structure left: cut into the widest pieces that fit, preferring whitespace
+    pieces = []
+    while text:
+        width = min(len(text), max(1, len(text) * max_tokens // max(1, count_tokens(text))))
+        while width < len(text) and count_tokens(text[:width * 2]) <= max_tokens:
+            width *= 2
+        while width > 1 and count_tokens(text[:width]) > max_tokens:
+            width = width * 9 // 10
+        if width < len(text):
+            space = text.rfind(' ', width // 2, width)
+            width = space + 1 if space > 0 else width
+        pieces.append(text[:width])
+        text = text[width:]
+    return pieces
+
+def _split(text, max_tokens, separators):
+    # Split on the coarsest separator that works, recursing into oversized pieces
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    if not separators:
+        return _cut(text, max_tokens)
+    pattern, rest = separators[0], separators[1:]
+    parts = [p for p in pattern.split(text) if p.strip()]
+    if len(parts) == 1:
+        return _split(text, max_tokens, rest)
+    return [piece for part in parts for piece in _split(part, max_tokens, rest)]
+
+def split_sections(markdown_text, max_tokens):
+    """Split markdown into chunks of at most `max_tokens`, breaking on headings,
+    then paragraphs, then sentences, and packing adjacent small pieces together."""
+    starts = [m.start() for m in HEADING_PATTERN.finditer(markdown_text)]
+    bounds = [0] + [s for s in starts if s > 0] + [len(markdown_text)]
+    sections = [markdown_text[a:b] for a, b in zip(bounds, bounds[1:]) if markdown_text[a:b].strip()]
+
+    pieces = []
+    for section in sections:
+        pieces.extend(_split(section, max_tokens, [re.compile(r'\n\s*\n'), SENTENCE_PATTERN]))
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece.strip('\n'))
+        current_tokens += tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    logging.info(f"Split {len(markdown_text):,} characters into {len(chunks)} chunks of <= {max_tokens} tokens")
+    return chunks
@@ -0,0 +1,106 @@
+import os
+import zlib
+
+# Brotli is optional; without it responses are only gzip-compressed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIMUM_SIZE = int(os.environ.get('COMPRESS_MIN_BYTES', 500))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+# Streams the browser consumes incrementally are passed through untouched
+EXCLUDED_TYPES = ('text/event-stream',)
+
+def choose_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header, honouring q-values."""
+    offered = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        offered[name.strip()] = q
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    ranked = [(offered.get(enc, offered.get('*', 0.0)), -i, enc) for i, enc in enumerate(candidates)]
+    q, _, encoding = max(ranked)
+    return encoding if q > 0 else None
+
+class _Compressor:
+    def __init__(self, encoding):
+        if encoding == 'br':
+            self.impl = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.flush, self.finish = self.impl.process, self.impl.flush, self.impl.finish
+        else:
+            self.impl = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = self.impl.compress
+            self.flush = lambda: self.impl.flush(zlib.Z_SYNC_FLUSH)
+            self.finish = self.impl.flush
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with brotli or gzip, as negotiated via Accept-Encoding.
+
+    Small bodies, already-encoded responses and event streams are sent as-is.
+    Streamed bodies are compressed chunk by chunk and flushed so each part
+    still reaches the client as soon as it is produced.
+    """
+
+    def __init__(self, app, minimum_size=MINIMUM_SIZE):
+        self.app, self.minimum_size = app, minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, compressor, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                response_headers = dict(message.get('headers') or [])
+                content_type = response_headers.get(b'content-type', b'').decode('latin-1')
+                passthrough = (b'content-encoding' in response_headers or message['status'] in (204, 304)
+                               or content_type.startswith(EXCLUDED_TYPES))
+                if passthrough:
+                    await send(message)
+                return
+            if message['type'] != 'http.response.body' or passthrough:
+                return await send(message)
+
+            body, more_body = message.get('body', b''), message.get('more_body', False)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                compressor = _Compressor(encoding)
+                response_headers = [(k, v) for k, v in start.get('headers', [])
+                                    if k.lower() not in (b'content-length', b'content-encoding')]
+                vary = [v for k, v in response_headers if k.lower() == b'vary']
+                response_headers = [(k, v) for k, v in response_headers if k.lower() != b'vary']
+                response_headers.append((b'vary', b', '.join(vary + [b'Accept-Encoding'])))
+                response_headers.append((b'content-encoding', encoding.encode()))
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    response_headers.append((b'content-length', str(len(body)).encode()))
+                    await send(dict(start, headers=response_headers))
+                    return await send({'type': 'http.response.body', 'body': body})
+                await send(dict(start, headers=response_headers))
+            data = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+            await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, wrapped_send)
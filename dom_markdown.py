@@ -0,0 +1,208 @@
+"""Markdown conversion from one lxml parse of the article HTML.
+
+html2text tokenizes its input with the pure-Python html.parser. Here lxml
+parses the article and the tree walk feeds html2text's formatter directly,
+which gives the same markdown without the slower tokenizer. lxml repairs
+malformed markup (closing unclosed tags, moving misnested ones) where
+html.parser passes the tags through as written, so when the parsed tree's tags
+don't match the source's, the page is handed to html2text itself instead.
+"""
+import re
+import textwrap
+
+import html2text
+from html2text import config
+from html2text.utils import skipwrap
+import lxml.html
+from lxml import etree
+from lxml.html.defs import empty_tags
+
+# html.parser reports character and entity references separately (html2text maps
+# e.g. &mdash; to "--" and doesn't escape them), but lxml decodes them into the
+# text. Swap each reference for a private-use placeholder before parsing so the
+# walk can report it the same way. These patterns are html.parser's own.
+ENTITYREF = re.compile(r'&([a-zA-Z][-.a-zA-Z0-9]*)(;|(?=[^a-zA-Z0-9]|$))')
+CHARREF = re.compile(r'&#(?:[0-9]+|[xX][0-9a-fA-F]+)(;|(?=[^0-9a-fA-F]|$))')
+TAG = re.compile(r'(<[^>]*>)')
+SPACES = re.compile(r'( +)')
+PLACEHOLDER_BASE = 0xF0000
+PLACEHOLDERS = re.compile('([\U000F0000-\U000FFFFD])')
+DOCUMENT_TAGS = re.compile(r'<(html|head|body)\b', re.I)
+TAG_NAME = re.compile(r'<(/?)([a-zA-Z][^\s/>]*)')
+# Match markdown links [text](url) and extract the text
+LINK_PATTERN = re.compile(r'\[([^\]]+)\]\([^\)]+\)')
+
+class _Converter(html2text.HTML2Text):
+    """html2text's formatter, fed from a tree walk."""
+
+    def optwrap(self, text):
+        # html2text's optwrap, with _wrap in place of textwrap.wrap
+        if not self.body_width:
+            return text
+        result = ""
+        newlines = 0
+        if not self.wrap_links:
+            self.inline_links = False
+        for para in text.split("\n"):
+            if len(para) > 0:
+                if not skipwrap(para, self.wrap_links, self.wrap_list_items, self.wrap_tables):
+                    indent = ""
+                    if para.startswith("  " + self.ul_item_mark):
+                        indent = "    "
+                    elif para.startswith("> "):
+                        indent = "> "
+                    result += "\n".join(_wrap(para, self.body_width, indent))
+                    if para.endswith("  "):
+                        result += "  \n"
+                        newlines = 1
+                    elif indent:
+                        result += "\n"
+                        newlines = 1
+                    else:
+                        result += "\n\n"
+                        newlines = 2
+                elif not config.RE_SPACE.match(para):
+                    result += para + "\n"
+                    newlines = 1
+            elif newlines < 2:
+                result += "\n"
+                newlines += 1
+        return result
+
+def _wrap(text, width, indent):
+    """textwrap.wrap(text, width, break_long_words=False, subsequent_indent=indent), fast
+    for the usual case of words separated by spaces only."""
+    if '-' in text or not text.isprintable():
+        return textwrap.wrap(text, width, break_long_words=False, subsequent_indent=indent)
+    if len(text) <= width:
+        stripped = text.rstrip(' ')
+        return [stripped] if stripped else []
+    chunks = [c for c in SPACES.split(text) if c]
+    chunks.reverse()
+    lines = []
+    while chunks:
+        prefix = indent if lines else ''
+        available = width - len(prefix)
+        if lines and chunks[-1][0] == ' ':
+            chunks.pop()
+        line, length = [], 0
+        while chunks and length + len(chunks[-1]) <= available:
+            length += len(chunks[-1])
+            line.append(chunks.pop())
+        if chunks and len(chunks[-1]) > available and not line:
+            line.append(chunks.pop())
+        if line and line[-1][0] == ' ':
+            line.pop()
+        if line:
+            lines.append(prefix + ''.join(line))
+    return lines
+
+def _protect(content):
+    """Replace references in text (not inside tags) with placeholders; returns (content, references)."""
+    references = []
+
+    def placeholder(match):
+        references.append(match.group(0))
+        return chr(PLACEHOLDER_BASE + len(references) - 1)
+
+    parts = TAG.split(content)
+    for i in range(0, len(parts), 2):
+        if '&' in parts[i]:
+            parts[i] = ENTITYREF.sub(placeholder, CHARREF.sub(placeholder, parts[i]))
+    return ''.join(parts), references
+
+def _data(h, text, references):
+    if not references:
+        h.handle_data(text)
+        return
+    for i, piece in enumerate(PLACEHOLDERS.split(text)):
+        if i % 2 == 0:
+            h.handle_data(piece)
+            continue
+        reference = references[ord(piece) - PLACEHOLDER_BASE]
+        if reference.startswith('&#'):
+            h.handle_charref(reference[2:].rstrip(';'))
+        else:
+            h.handle_entityref(reference[1:].rstrip(';'))
+
+def _source_tags(content):
+    # The start and end tags in the source, in order, as html.parser would report them
+    # to html2text (empty elements have no end tag)
+    tags = []
+    for slash, name in TAG_NAME.findall(content):
+        name = name.lower()
+        if not slash:
+            tags.append(name)
+        elif name not in empty_tags:
+            tags.append('/' + name)
+    return tags
+
+def _tree_tags(roots, present):
+    tags = []
+    for root in roots:
+        for event, node in etree.iterwalk(root, events=('start', 'end')):
+            if not isinstance(node.tag, str) or (node.tag in ('html', 'head', 'body') and node.tag not in present):
+                continue
+            if event == 'start':
+                tags.append(node.tag)
+            elif node.tag not in empty_tags:
+                tags.append('/' + node.tag)
+    return tags
+
+def _html2text(content):
+    markdown = html2text.HTML2Text().handle(content)
+    return markdown, sum(len(text) for text in LINK_PATTERN.findall(markdown))
+
+def _walk(h, root, references):
+    # Iterative, so deeply nested pages can't hit the recursion limit
+    stack = [(root, 'start')]
+    while stack:
+        node, step = stack.pop()
+        if step == 'tail':
+            if node.tail:
+                _data(h, node.tail, references)
+            continue
+        if step == 'end':
+            h.handle_endtag(node.tag)
+            continue
+        if not isinstance(node.tag, str):
+            # Comments and processing instructions produce no output
+            stack.append((node, 'tail'))
+            continue
+        h.handle_starttag(node.tag, list(node.attrib.items()))
+        stack.append((node, 'tail'))
+        if node.tag not in empty_tags:
+            stack.append((node, 'end'))
+        stack.extend((child, 'start') for child in reversed(node))
+        if node.text:
+            _data(h, node.text, references)
+
+def convert(content):
+    """Markdown for an HTML fragment, as html2text renders it, plus the length of its link text."""
+    protected, references = _protect(content) if '&' in content else (content, [])
+    if references and PLACEHOLDERS.search(content):
+        # The page already uses the placeholder range; let html2text tokenize it
+        return _html2text(content)
+
+    h = _Converter()
+    h.start = True
+    if protected.strip():
+        document = lxml.html.document_fromstring(protected)
+        # lxml always builds html/head/body; only report the ones the source has
+        present = {tag.lower() for tag in DOCUMENT_TAGS.findall(protected[:2048])}
+        roots = [document] if 'html' in present else list(document)
+        if _tree_tags(roots, present) != _source_tags(protected):
+            # lxml repaired the markup, which html.parser would have passed through as written
+            return _html2text(content)
+        for root in roots:
+            if root.tag in ('head', 'body') and root.tag not in present:
+                if root.text:
+                    _data(h, root.text, references)
+                for child in root:
+                    _walk(h, child, references)
+            else:
+                _walk(h, root, references)
+    markdown = h.optwrap(h.finish())
+    if h.pad_tables:
+        markdown = html2text.pad_tables_in_text(markdown)
+    return markdown, sum(len(text) for text in LINK_PATTERN.findall(markdown))
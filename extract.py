@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock, Thread
+
+# Process pool size (0 runs extraction in a thread instead) and per-page CPU budget in seconds
+WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 1))
+CPU_LIMIT = int(os.environ.get('EXTRACT_CPU_LIMIT', 20))
+# Wall-clock seconds a page may take once a worker starts on it. SIGXCPU is only acted on between
+# Python bytecodes and never fires for a worker blocked off-CPU, so workers also set an alarm
+WALL_LIMIT = float(os.environ.get('EXTRACT_WALL_LIMIT', CPU_LIMIT * 2))
+# Seconds past WALL_LIMIT before the parent kills a worker whose alarm couldn't stop it (stuck in C code)
+KILL_GRACE = 5.0
+# 'lxml' converts the article from an lxml parse (see dom_markdown; pages lxml has to repair still go through
+# html2text, so the output is the same), 'html2text' always uses html2text's own parser
+ENGINE = os.environ.get('EXTRACT_ENGINE', 'lxml')
+
+# Match markdown links [text](url) and extract the text
+LINK_PATTERN = re.compile(r'\[([^\]]+)\]\([^\)]+\)')
+
+class ExtractionTimeout(Exception):
+    pass
+
+def extract_article(html, url):
+    # Imported on first use: the web process never needs them when extraction runs in the pool
+    from pyreadability import Readability
+    r = Readability(html, url=url)
+    article = r.parse()
+
+    markdown_start = time.time()
+    if ENGINE == 'lxml':
+        import dom_markdown
+        markdown_content, link_char_count = dom_markdown.convert(article['content'])
+    else:
+        import html2text
+        h = html2text.HTML2Text()
+        markdown_content = h.handle(article['content'])
+        # Calculate link statistics from markdown
+        links = LINK_PATTERN.findall(markdown_content)
+        link_char_count = sum(len(link_text) for link_text in links)
+    markdown_time = time.time() - markdown_start
+
+    char_count = len(markdown_content)
+
+    return {
+        'title': article.get('title', 'Article Content'),
+        'markdown': markdown_content,
+        'char_count': char_count,
+        'token_count': int(char_count / 4.5),
+        'link_char_count': link_char_count,
+        'link_token_count': int(link_char_count / 4.5),
+        'link_percentage': (link_char_count / char_count * 100) if char_count > 0 else 0,
+        'markdown_time': markdown_time
+    }
+
+def _cpu_exceeded(signum, frame):
+    raise ExtractionTimeout(f"extraction exceeded its {CPU_LIMIT}s CPU budget")
+
+def _time_exceeded(signum, frame):
+    raise ExtractionTimeout(f"extraction exceeded its {_wall_limit:g}s time limit")
+
+_starts = None  # multiprocessing queue of (job id, pid) that workers post as they start a job
+_wall_limit = WALL_LIMIT
+
+def _init_worker(starts):
+    global _starts
+    _starts = starts
+    signal.signal(signal.SIGXCPU, _cpu_exceeded)
+    signal.signal(signal.SIGALRM, _time_exceeded)
+
+def _warm():
+    import dom_markdown
+    import pyreadability
+    return os.getpid()
+
+def _cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _run(job_id, html, url, submitted_at, cpu_limit, wall_limit):
+    # Runs in a pool worker. RLIMIT_CPU is per process, so raise the soft limit to
+    # "CPU used so far + budget" for this job; the kernel sends SIGXCPU past it.
+    # The wall-clock alarm starts here too, so time spent queued doesn't count.
+    global _wall_limit
+    started_at = time.time()
+    _starts.put((job_id, os.getpid()))
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = int(_cpu_used()) + cpu_limit + 1
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    _wall_limit = wall_limit
+    signal.setitimer(signal.ITIMER_REAL, wall_limit)
+    try:
+        result = extract_article(html, url)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    result['queue_time'] = started_at - submitted_at
+    result['readability_time'] = time.time() - started_at
+    return result
+
+def _run_inline(html, url, submitted_at):
+    started_at = time.time()
+    result = extract_article(html, url)
+    result['queue_time'] = started_at - submitted_at
+    result['readability_time'] = time.time() - started_at
+    return result
+
+_pool = None
+# Prewarm creates the pool from a thread while the first requests may do so on the loop
+_pool_lock = Lock()
+_job_ids = itertools.count()
+_started = {}  # job id -> callback taking the pid of the worker that started it
+
+def _listen(starts):
+    while True:
+        job_id, pid = starts.get()
+        with _pool_lock:
+            callback = _started.pop(job_id, None)
+        if callback is not None:
+            callback(pid)
+
+def get_pool():
+    global _pool, _starts
+    with _pool_lock:
+        if _pool is None:
+            if _starts is None:
+                _starts = multiprocessing.Queue()
+                Thread(target=_listen, args=(_starts,), name="extract-starts", daemon=True).start()
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker, initargs=(_starts,))
+        return _pool
+
+def warm_pool():
+    """Start every pool worker and load the extraction libraries now, so the first
+    requests don't pay for process startup and imports."""
+    if WORKERS:
+        pool = get_pool()
+        pids = set(f.result() for f in [pool.submit(_warm) for _ in range(WORKERS)])
+        logging.info(f"Extraction pool ready with {len(pids)} workers")
+    else:
+        _warm()
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _discard(pool):
+    # Later jobs go to a fresh pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+def _kill(pool, pid):
+    # Only the stuck worker is killed, but concurrent.futures then fails the pool's other
+    # jobs with BrokenProcessPool, which extract() retries on a fresh pool
+    _discard(pool)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    pool.shutdown(wait=False)
+
+# Extractions submitted and not finished yet, so background work can hold off while the pool is busy
+in_flight = 0
+
+async def extract(html, url):
+    """Extract `url`'s article off the event loop, reporting queue wait and extraction time."""
+    global in_flight
+    submitted_at = time.time()
+    in_flight += 1
+    try:
+        if not WORKERS:
+            return await asyncio.to_thread(_run_inline, html, url, submitted_at)
+        loop = asyncio.get_running_loop()
+        for attempt in itertools.count():
+            pool = get_pool()
+            job_id = next(_job_ids)
+            started = loop.create_future()
+            with _pool_lock:
+                _started[job_id] = lambda pid, started=started: loop.call_soon_threadsafe(
+                    lambda: started.done() or started.set_result(pid))
+            try:
+                done = asyncio.wrap_future(pool.submit(_run, job_id, html, url, submitted_at, CPU_LIMIT, WALL_LIMIT))
+                await asyncio.wait({started, done}, return_when=asyncio.FIRST_COMPLETED)
+                if done.done():
+                    return done.result()
+                # The worker's alarm stops the job at WALL_LIMIT; past the grace period it is stuck
+                try:
+                    return await asyncio.wait_for(asyncio.shield(done), WALL_LIMIT + KILL_GRACE)
+                except asyncio.TimeoutError:
+                    logging.error(f"Extraction of {url} is stuck past {WALL_LIMIT:g}s, killing its worker")
+                    done.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    _kill(pool, started.result())
+                    raise ExtractionTimeout(f"extraction exceeded its {WALL_LIMIT:g}s time limit")
+            except BrokenProcessPool:
+                # A worker died (crashed, or killed above for another job); retry once on a fresh pool
+                logging.error("Extraction pool broken, restarting")
+                _discard(pool)
+                if attempt:
+                    raise
+            finally:
+                with _pool_lock:
+                    _started.pop(job_id, None)
+    finally:
+        in_flight -= 1
@@ -0,0 +1,348 @@
+import asyncio
+import email.utils
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+
+from fastlite import database
+
+import metrics
+
+# Feeds are polled every POLL_INTERVAL seconds, backing off after failures up to MAX_BACKOFF
+POLL_INTERVAL = float(os.environ.get('FEED_POLL_INTERVAL', 900))
+MAX_BACKOFF = float(os.environ.get('FEED_MAX_BACKOFF', 6 * 3600))
+# Entries processed at once, and the most a single poll queues (older new entries are skipped)
+CONCURRENCY = int(os.environ.get('FEED_CONCURRENCY', 2))
+MAX_ITEMS = int(os.environ.get('FEED_MAX_ITEMS', 20))
+# Child sitemaps fetched per poll of a sitemap index, newest first
+MAX_SITEMAPS = int(os.environ.get('FEED_MAX_SITEMAPS', 3))
+# Article tokens per hour the ingester may send to the LLM (0 for no limit)
+LLM_TOKENS_PER_HOUR = float(os.environ.get('FEED_LLM_TOKENS_PER_HOUR', 200_000))
+# How often the scheduler looks for due feeds and queued entries, and how long a claim
+# lasts before another worker process may take over a poll or entry that never finished
+TICK = float(os.environ.get('FEED_TICK', 5))
+LEASE = 3600
+# Milliseconds a transaction waits for another connection's write lock
+BUSY_TIMEOUT = int(os.environ.get('FEED_BUSY_TIMEOUT', 5000))
+
+FEED_TYPES = {'application/rss+xml', 'application/atom+xml', 'application/rdf+xml', 'application/xml', 'text/xml'}
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+class FeedError(Exception):
+    pass
+
+def _local(element):
+    return element.tag.rsplit('}', 1)[-1] if isinstance(element.tag, str) else ''
+
+def _text(element, name):
+    # Text of the first `name` child with any, whatever its namespace (e.g. skipping an empty atom:link in RSS)
+    return next((c.text.strip() for c in element if _local(c) == name and c.text and c.text.strip()), None)
+
+def parse_time(value):
+    """Epoch seconds from an RFC 822 (RSS) or ISO 8601 (Atom, sitemaps) date, or None."""
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+def parse_feed(text, base_url=''):
+    """(kind, entries) from an RSS, Atom, sitemap or sitemap index document.
+
+    kind is 'feed', 'sitemap' or 'sitemapindex'. Entries are dicts with id, url,
+    title and updated (epoch seconds or None), newest first where dates allow.
+    For a sitemap index the entries are its child sitemaps.
+    """
+    from lxml import etree
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+    try:
+        root = etree.fromstring(XML_DECLARATION.sub('', text, count=1), parser)
+    except etree.XMLSyntaxError as e:
+        raise FeedError(f"Unparseable feed: {e}")
+    if root is None:
+        raise FeedError("Empty feed")
+    kind = _local(root)
+    entries = []
+    if kind in ('rss', 'RDF'):
+        for item in root.iter('{*}item'):
+            url = _text(item, 'link') or _text(item, 'guid')
+            if url:
+                entries.append(dict(id=_text(item, 'guid') or url, url=urljoin(base_url, url), title=_text(item, 'title'),
+                                    updated=parse_time(_text(item, 'pubDate') or _text(item, 'date'))))
+        kind = 'feed'
+    elif kind == 'feed':
+        for entry in root.iter('{*}entry'):
+            links = [l for l in entry if _local(l) == 'link' and l.get('rel', 'alternate') == 'alternate']
+            url = links[0].get('href') if links else None
+            if url:
+                url = urljoin(base_url, url)
+                entries.append(dict(id=_text(entry, 'id') or url, url=url, title=_text(entry, 'title'),
+                                    updated=parse_time(_text(entry, 'updated') or _text(entry, 'published'))))
+    elif kind in ('urlset', 'sitemapindex'):
+        for entry in root:
+            url = _text(entry, 'loc')
+            if url:
+                entries.append(dict(id=url, url=urljoin(base_url, url), title=None,
+                                    updated=parse_time(_text(entry, 'lastmod'))))
+        kind = 'sitemap' if kind == 'urlset' else kind
+    else:
+        raise FeedError(f"Not an RSS, Atom or sitemap document (root element {kind!r})")
+    # Stable, so undated entries keep document order (newest first in nearly every feed)
+    entries.sort(key=lambda e: -(e['updated'] or 0))
+    return kind, entries
+
+def new_entries(kind, entries, last_seen):
+    """Entries newer than `last_seen`, plus what to remember as last seen next time.
+
+    For feeds `last_seen` is the id of the newest entry from the previous poll;
+    for sitemaps, which have no order, it is the newest lastmod seen. Entries
+    with no date in a sitemap are always returned and left to de-duplication.
+    """
+    if kind == 'feed':
+        ids = [e['id'] for e in entries]
+        new = entries[:ids.index(last_seen)] if last_seen in ids else entries
+        return new, ids[0] if ids else last_seen
+    watermark = float(last_seen) if last_seen else None
+    new = [e for e in entries if watermark is None or e['updated'] is None or e['updated'] > watermark]
+    newest = max([e['updated'] for e in entries if e['updated']] + ([watermark] if watermark else []), default=None)
+    return new, str(newest) if newest else last_seen
+
+class Feeds:
+    """Registered feeds and the entries found in them, stored so any worker process can poll and process them.
+
+    A feed or entry is claimed by atomically pushing its due time forward, so
+    with several workers each poll and each entry is handled once. Multi-statement
+    writes run in a transaction on a connection of the calling thread's own, never
+    on the connection shared with request threads.
+    """
+
+    def __init__(self, db, poll_interval=POLL_INTERVAL, max_items=MAX_ITEMS):
+        self.db, self.poll_interval, self.max_items = db, poll_interval, max_items
+        self.feeds, self.items = db.t.feeds, db.t.feed_items
+        if self.feeds not in db.t:
+            self.feeds.create(dict(id=int, url=str, username=str, kind=str, etag=str, last_modified=str,
+                                   last_seen=str, next_poll=float, polled_at=float, failures=int, status=str,
+                                   error=str, created_at=float), pk='id')
+            self.feeds.create_index(['url'], unique=True)
+            self.feeds.create_index(['next_poll'])
+        if self.items not in db.t:
+            self.items.create(dict(id=int, feed_id=int, item_id=str, url=str, title=str, updated=float,
+                                   status=str, error=str, found_at=float, claimed_at=float, done_at=float), pk='id')
+            self.items.create_index(['feed_id', 'item_id'], unique=True)
+            self.items.create_index(['status', 'claimed_at'])
+        self.local = threading.local()
+        self.path = db.conn.filename  # read once, since other threads may be using the shared connection
+
+    def _own_db(self):
+        # This thread's connection for transactions; an in-memory database only exists on the shared one
+        if not self.path:
+            return self.db
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = database(self.path)
+            db.conn.setbusytimeout(BUSY_TIMEOUT)
+        return db
+
+    def add(self, url, username=None):
+        """Register `url`, due for polling straight away; returns the feed, existing or new."""
+        self.db.execute("insert into feeds (url, username, next_poll, failures, status, created_at) "
+                        "values (?, ?, 0, 0, 'new', ?) on conflict(url) do nothing", [url, username, time.time()])
+        return self.db.q("select * from feeds where url = ?", [url])[0]
+
+    def remove(self, feed_id, username):
+        """Unregister a feed `username` added; returns whether there was one."""
+        if not self.db.q("select id from feeds where id = ? and username = ?", [feed_id, username]):
+            return False
+        db = self._own_db()
+        with db.conn:
+            db.execute("delete from feed_items where feed_id = ?", [feed_id])
+            db.execute("delete from feeds where id = ?", [feed_id])
+        return True
+
+    def list(self, username):
+        return self.db.q("select feeds.*, (select count(*) from feed_items where feed_id = feeds.id and status = 'done') "
+                         "as processed from feeds where username = ? order by created_at desc", [username])
+
+    def recent_items(self, username, limit=20):
+        return self.db.q("select feed_items.* from feed_items join feeds on feeds.id = feed_items.feed_id "
+                         "where feeds.username = ? and feed_items.status != 'skipped' "
+                         "order by feed_items.found_at desc limit ?", [username, limit])
+
+    def claim_due(self, now=None):
+        """Feeds due for a poll, each leased to the caller until it reports back."""
+        now = now or time.time()
+        return self.db.q("update feeds set next_poll = ? where next_poll <= ? returning *", [now + LEASE, now])
+
+    def polled(self, feed, kind=None, entries=(), last_seen=None, response=None, error=None):
+        """Record a poll of `feed`: its new `entries` and validators, or the error. Returns how many entries were queued.
+
+        Entries not seen before are queued, newest first, up to `max_items`;
+        the rest are recorded as skipped so they are never processed.
+        """
+        now = time.time()
+        if error is not None:
+            failures = feed['failures'] + 1
+            self.feeds.update(dict(next_poll=now + min(MAX_BACKOFF, self.poll_interval * 2 ** failures), polled_at=now,
+                                   failures=failures, status='error', error=error), feed['id'])
+            return 0
+        queued = 0
+        db = self._own_db()
+        with db.conn:
+            for entry in entries:
+                status = 'queued' if queued < self.max_items else 'skipped'
+                if db.q("insert into feed_items (feed_id, item_id, url, title, updated, status, found_at) "
+                             "values (?, ?, ?, ?, ?, ?, ?) on conflict(feed_id, item_id) do nothing returning id",
+                             [feed['id'], entry['id'], entry['url'], entry['title'], entry['updated'], status, now]):
+                    queued += status == 'queued'
+            fields = dict(next_poll=now + self.poll_interval, polled_at=now, failures=0, error=None,
+                          status='not modified' if response is not None and response.status_code == 304 else 'ok')
+            if kind is not None:
+                fields.update(kind=kind, last_seen=last_seen)
+            if response is not None and response.status_code != 304:
+                fields.update(etag=response.headers.get('etag'), last_modified=response.headers.get('last-modified'))
+            db.t.feeds.update(fields, feed['id'])
+        return queued
+
+    def claim_item(self, now=None):
+        """The oldest queued entry, marked as running; entries whose claim lapsed are taken again."""
+        now = now or time.time()
+        rows = self.db.q("update feed_items set status = 'running', claimed_at = ? where id = ("
+                         "select id from feed_items where status = 'queued' or (status = 'running' and claimed_at < ?) "
+                         "order by found_at, id limit 1) returning *", [now, now - LEASE])
+        return rows[0] if rows else None
+
+    def finished(self, item, error=None):
+        self.items.update(dict(status='error' if error else 'done', error=error, done_at=time.time()), item['id'])
+
+    def counts(self):
+        return {row['status']: row['n'] for row in self.db.q("select status, count(*) as n from feed_items group by status")}
+
+class Ingester:
+    """Polls due feeds and feeds their new entries through `process`, a few at a time.
+
+    `fetch(url, headers)` returns a fetcher.Page for a feed (a 304 when the
+    conditional headers match). `process(url)` runs the article pipeline for
+    one entry. `busy()` says interactive work is waiting, in which case no new
+    entry is started until it clears. Parsing and database work run in threads,
+    keeping the event loop free for requests.
+    """
+
+    def __init__(self, feeds, fetch, process, busy=lambda: False, concurrency=CONCURRENCY,
+                 max_sitemaps=MAX_SITEMAPS, tick=TICK):
+        self.feeds, self.fetch, self.process, self.busy = feeds, fetch, process, busy
+        self.concurrency, self.max_sitemaps, self.tick = concurrency, max_sitemaps, tick
+        self.tasks = set()
+        self.active = 0
+        self.stats = {'polls': 0, 'not_modified': 0, 'poll_errors': 0, 'queued': 0, 'processed': 0, 'failed': 0,
+                      'deferred': 0}
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self):
+        while True:
+            await self._step()
+            await asyncio.sleep(self.tick)
+
+    async def _step(self):
+        try:
+            await self.step()
+        except Exception as e:
+            logging.error(f"Feed ingestion step failed: {str(e)}")
+
+    async def step(self):
+        """Start polls of due feeds, and queued entries up to the concurrency limit."""
+        for feed in await asyncio.to_thread(self.feeds.claim_due):
+            self._spawn(self.poll(feed))
+        while self.active < self.concurrency:
+            if self.busy():
+                self.stats['deferred'] += 1
+                break
+            # Count the slot before claiming, as another step may run while this one waits
+            self.active += 1
+            try:
+                item = await asyncio.to_thread(self.feeds.claim_item)
+            except Exception:
+                self.active -= 1
+                raise
+            if item is None:
+                self.active -= 1
+                break
+            self._spawn(self.ingest(item))
+
+    async def poll(self, feed):
+        start = time.time()
+        headers = {}
+        if feed['etag']:
+            headers['If-None-Match'] = feed['etag']
+        if feed['last_modified']:
+            headers['If-Modified-Since'] = feed['last_modified']
+        self.stats['polls'] += 1
+        try:
+            response = await self.fetch(feed['url'], headers)
+            if response.status_code == 304:
+                self.stats['not_modified'] += 1
+                metrics.FEED_POLLS.inc(result='not_modified')
+                await asyncio.to_thread(self.feeds.polled, feed, response=response)
+                return
+            kind, entries, last_seen = await asyncio.to_thread(self._parse, response.text, feed)
+            if kind == 'sitemapindex':
+                entries = await self._sitemap_entries(entries)
+        except Exception as e:
+            self.stats['poll_errors'] += 1
+            metrics.FEED_POLLS.inc(result='error')
+            logging.warning(f"Polling feed {feed['url']} failed: {str(e)}")
+            await asyncio.to_thread(self.feeds.polled, feed, error=str(e))
+            return
+        queued = await asyncio.to_thread(self.feeds.polled, feed, kind, entries, last_seen, response)
+        self.stats['queued'] += queued
+        metrics.FEED_POLLS.inc(result='ok')
+        metrics.FEED_ITEMS.inc(queued, status='queued')
+        logging.info(f"Polled feed {feed['url']} in {time.time() - start:.2f}s: {len(entries)} new entries, {queued} queued")
+
+    @staticmethod
+    def _parse(text, feed):
+        kind, entries = parse_feed(text, feed['url'])
+        return kind, *new_entries(kind, entries, feed['last_seen'])
+
+    async def _sitemap_entries(self, sitemaps):
+        # The URLs listed in the newest of the child sitemaps changed since the last poll;
+        # the index's last seen date applies to the child sitemaps, not to their URLs
+        entries = []
+        for sitemap in sitemaps[:self.max_sitemaps]:
+            response = await self.fetch(sitemap['url'], {})
+            kind, children = await asyncio.to_thread(parse_feed, response.text, sitemap['url'])
+            if kind == 'sitemap':
+                entries += [dict(e, updated=e['updated'] or sitemap['updated']) for e in children]
+        entries.sort(key=lambda e: -(e['updated'] or 0))
+        return entries
+
+    async def ingest(self, item):
+        try:
+            await self.process(item['url'])
+        except Exception as e:
+            self.stats['failed'] += 1
+            metrics.FEED_ITEMS.inc(status='error')
+            logging.warning(f"Ingesting {item['url']} failed: {str(e)}")
+            await asyncio.to_thread(self.feeds.finished, item, error=str(e))
+        else:
+            self.stats['processed'] += 1
+            metrics.FEED_ITEMS.inc(status='done')
+            await asyncio.to_thread(self.feeds.finished, item)
+        finally:
+            self.active -= 1
+        # Start the next entry now rather than at the next tick
+        await self._step()
@@ -0,0 +1,161 @@
+import asyncio
+import codecs
+import os
+import re
+import sys
+import weakref
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+import ratelimit
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Timeouts (seconds) and pool limits, overridable from the environment
+CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', 15))
+TOTAL_TIMEOUT = float(os.environ.get('FETCH_TOTAL_TIMEOUT', 30))
+MAX_CONNECTIONS = int(os.environ.get('FETCH_MAX_CONNECTIONS', 100))
+MAX_KEEPALIVE = int(os.environ.get('FETCH_MAX_KEEPALIVE', 20))
+KEEPALIVE_EXPIRY = float(os.environ.get('FETCH_KEEPALIVE_EXPIRY', 30))
+MAX_PER_HOST = int(os.environ.get('FETCH_MAX_PER_HOST', 6))
+MAX_BYTES = int(os.environ.get('FETCH_MAX_BYTES', 10 * 1024 * 1024))
+# Politeness per origin: requests per second (0 for no limit), burst, and retries of 429/5xx/connect errors
+RATE = float(os.environ.get('FETCH_RATE', 2))
+BURST = int(os.environ.get('FETCH_BURST', 5))
+RETRIES = int(os.environ.get('FETCH_RETRIES', 2))
+MAX_RETRY_WAIT = float(os.environ.get('FETCH_MAX_RETRY_WAIT', 10))
+
+HTML_TYPES = {'text/html', 'application/xhtml+xml'}
+BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.I)
+
+# One client (and set of per-host semaphores) per event loop. In production
+# there is a single loop; the test client spins up a fresh one per request.
+_loop_state = weakref.WeakKeyDictionary()
+
+def _state():
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None or state['client'].is_closed:
+        client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            follow_redirects=True,
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_KEEPALIVE,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+        )
+        state = {'client': client}
+        _loop_state[loop] = state
+    return state
+
+def get_client():
+    return _state()['client']
+
+# Shared by all event loops: concurrency per origin starts at MAX_PER_HOST and backs off on 429/5xx
+origins = ratelimit.RateControl('fetch', RATE, BURST, MAX_PER_HOST, RETRIES, MAX_RETRY_WAIT)
+
+class FetchError(Exception):
+    pass
+
+class Page:
+    """A fetched document: status, headers and body decoded into a single string."""
+
+    def __init__(self, url, status_code, headers, text='', encoding=None, bytes_read=0, peak_bytes=0):
+        self.url, self.status_code, self.headers = url, status_code, headers
+        self.text, self.encoding = text, encoding
+        self.bytes_read, self.peak_bytes = bytes_read, peak_bytes
+
+def _media_type(headers):
+    return headers.get('content-type', '').split(';')[0].strip().lower()
+
+def _declared_charset(headers):
+    match = re.search(r'charset=["\']?([\w.:-]+)', headers.get('content-type', ''), re.I)
+    return match and match.group(1)
+
+def _sniff_charset(head):
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    match = META_CHARSET.search(head[:4096])
+    return match and match.group(1).decode('ascii', errors='ignore')
+
+def _codec(*candidates):
+    for name in candidates:
+        if name:
+            try:
+                return codecs.lookup(name).name
+            except LookupError:
+                pass
+    return 'utf-8'
+
+async def _read(response, max_bytes, media_types):
+    # Stream the body, decoding chunk by chunk so no full raw copy is ever held
+    media_type = _media_type(response.headers)
+    if media_type and media_type not in media_types:
+        raise FetchError(f"Unsupported content type {media_type}")
+    declared = int(response.headers.get('content-length') or 0)
+    if declared > max_bytes:
+        raise FetchError(f"Page is {declared:,} bytes, over the {max_bytes:,} byte limit")
+    
+    decoder, encoding = None, None
+    parts, bytes_read, largest_chunk = [], 0, 0
+    async for chunk in response.aiter_bytes():
+        bytes_read += len(chunk)
+        if bytes_read > max_bytes:
+            raise FetchError(f"Page exceeded the {max_bytes:,} byte limit")
+        if decoder is None:
+            if not media_type and b'\x00' in chunk[:1024]:
+                raise FetchError("Response looks binary, not HTML")
+            encoding = _codec(_declared_charset(response.headers), _sniff_charset(chunk))
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        largest_chunk = max(largest_chunk, len(chunk))
+        parts.append(decoder.decode(chunk))
+    if decoder is not None:
+        parts.append(decoder.decode(b'', final=True))
+    text = ''.join(parts)
+    # Decoded pieces and the joined text coexist briefly, plus one raw chunk
+    peak_bytes = 2 * sys.getsizeof(text) + largest_chunk
+    return Page(str(response.url), response.status_code, response.headers, text, encoding or 'utf-8',
+                bytes_read, peak_bytes)
+
+async def fetch(url, headers=None, max_bytes=None, media_types=HTML_TYPES):
+    """GET `url` through the shared pooled client, rate limited per origin and bounded by TOTAL_TIMEOUT.
+
+    The body is streamed and decoded incrementally; content types other than
+    `media_types` (HTML by default) and bodies over `max_bytes` (default
+    MAX_BYTES) raise FetchError before they are fully read. A 304 is returned as-is so callers sending conditional headers
+    can revalidate. Rate-limit and server errors are retried (see ratelimit.RateControl);
+    each attempt gets the full TOTAL_TIMEOUT.
+    """
+    state = _state()
+    
+    async def get():
+        async with state['client'].stream('GET', url, headers=headers) as response:
+            if response.status_code == 304:
+                return Page(str(response.url), 304, response.headers)
+            response.raise_for_status()
+            return await _read(response, max_bytes or MAX_BYTES, media_types)
+    
+    async def attempt():
+        return await asyncio.wait_for(get(), TOTAL_TIMEOUT)
+    
+    return await origins.call_async(urlsplit(url).netloc.lower(), attempt,
+                                    transient=(httpx.ConnectError, httpx.ConnectTimeout))
+
+async def close_client():
+    state = _loop_state.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state['client'].aclose()
+
+def normalize_url(url):
+    """Canonical form of `url` for cache keys: lowercase scheme/host, no default port, no fragment, sorted query."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port
+    netloc = host if port is None or (scheme, port) in (('http', 80), ('https', 443)) else f"{host}:{port}"
+    query = '&'.join(sorted(q for q in parts.query.split('&') if q))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
@@ -0,0 +1,155 @@
+import logging
+import os
+import re
+import time
+from queue import Empty, Queue
+from threading import Lock, Thread
+
+from fastlite import database
+
+from fetcher import normalize_url
+
+FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 1))
+BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 100))
+# Milliseconds the writer waits for another connection's write lock before a batch fails
+BUSY_TIMEOUT = int(os.environ.get('HISTORY_BUSY_TIMEOUT', 5000))
+
+ARTICLE_FIELDS = ['title', 'markdown', 'char_count', 'token_count', 'link_char_count', 'link_token_count',
+                  'link_percentage']
+SUMMARY_FIELDS = ['summary', 'custom_response', 'llm_time', 'custom_llm_time', 'llm_wall_time']
+SEARCH_FIELDS = ['title', 'summary', 'custom_response', 'markdown', 'url']
+
+# Search terms are wrapped in these to mark them in snippets, then escaped by the page
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+def fts_query(text):
+    """FTS5 query for free text: every word must match, the last one as a prefix. None if there are no words."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{w}"' for w in words) + '*'
+
+class History:
+    """Articles each user has processed, with their summaries, searchable through an FTS5 index.
+
+    One row per user and normalized URL; processing a page again replaces it.
+    `record` and `add_summary` only queue the write. A background thread applies
+    queued writes in one transaction every `flush_interval` seconds, or sooner
+    once `batch_size` are waiting, so requests never wait on the index. The
+    thread writes through its own connection, so its transactions never take in
+    statements that request threads run on the shared one.
+    """
+
+    def __init__(self, db, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        self.db, self.flush_interval, self.batch_size = db, flush_interval, batch_size
+        # Read here: touching the shared connection from the writer thread can collide with a request's query
+        self.path = db.conn.filename
+        self.articles = db.t.history
+        if self.articles not in db.t:
+            self.articles.create(dict(id=int, username=str, url=str, request_id=str, custom_prompt=str,
+                                      title=str, markdown=str, char_count=int, token_count=int,
+                                      link_char_count=int, link_token_count=int, link_percentage=float,
+                                      summary=str, custom_response=str,
+                                      request_time=float, queue_time=float, readability_time=float,
+                                      llm_time=float, custom_llm_time=float, llm_wall_time=float,
+                                      processed_at=float), pk='id')
+            self.articles.create_index(['username', 'url'], unique=True)
+            self.articles.create_index(['username', 'processed_at'])
+            self.articles.create_index(['request_id'])
+            self.articles.enable_fts(SEARCH_FIELDS, create_triggers=True, tokenize='porter')
+        self.pending = Queue()
+        self.lock = Lock()
+        self.writer = self.write_db = None
+        self.stats = {'queued': 0, 'written': 0, 'batches': 0, 'failed': 0}
+
+    def record(self, username, url, article, timings, request_id=None, custom_prompt=None):
+        """Queue `article` (title, markdown and link stats) with its fetch timings for `username`."""
+        row = dict(username=username, url=normalize_url(url), request_id=request_id, custom_prompt=custom_prompt,
+                   processed_at=time.time(), **dict.fromkeys(SUMMARY_FIELDS),
+                   **{k: article[k] for k in ARTICLE_FIELDS},
+                   **{k: timings.get(k) for k in ('request_time', 'queue_time', 'readability_time')})
+        self._queue(('record', row))
+
+    def add_summary(self, request_id, result):
+        """Queue the summary outputs and LLM timings of a finished request."""
+        self._queue(('summary', request_id, {k: result.get(k) for k in SUMMARY_FIELDS}))
+
+    def _queue(self, item):
+        self.pending.put(item)
+        with self.lock:
+            self.stats['queued'] += 1
+            if self.writer is None:
+                self.writer = Thread(target=self._write_forever, name="history-writer", daemon=True)
+                self.writer.start()
+
+    def _connect(self):
+        if not self.path:
+            return self.db  # an in-memory database only exists on its own connection
+        db = database(self.path)
+        db.conn.setbusytimeout(BUSY_TIMEOUT)
+        return db
+
+    def _write_forever(self):
+        self.write_db = self._connect()
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(0, deadline - time.time())))
+                except Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self.pending.task_done()
+
+    def _write(self, batch):
+        columns = list(self.write_db.t.history.columns_dict)
+        columns.remove('id')
+        updates = [c for c in columns if c not in ('username', 'url')]
+        insert = (f"insert into history ({', '.join(columns)}) values ({', '.join('?' * len(columns))}) "
+                  f"on conflict(username, url) do update set {', '.join(f'{c} = excluded.{c}' for c in updates)}")
+        try:
+            with self.write_db.conn:
+                for item in batch:
+                    if item[0] == 'record':
+                        self.write_db.execute(insert, [item[1][c] for c in columns])
+                    else:
+                        _, request_id, fields = item
+                        self.write_db.execute(f"update history set {', '.join(f'{k} = ?' for k in fields)} where request_id = ?",
+                                        [*fields.values(), request_id])
+        except Exception as e:
+            logging.error(f"History write of {len(batch)} items failed: {str(e)}")
+            with self.lock:
+                self.stats['failed'] += len(batch)
+            return
+        with self.lock:
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+
+    def flush(self):
+        """Wait until everything queued so far has been written."""
+        self.pending.join()
+
+    def search(self, username, text='', limit=20, offset=0):
+        """`username`'s articles matching `text`, best match first, or the most recent ones for empty text.
+
+        Rows have id, url, title, processed_at and a snippet with matches
+        wrapped in MATCH_START/MATCH_END.
+        """
+        query = fts_query(text)
+        if query is None:
+            return self.db.q("select id, url, title, processed_at, substr(coalesce(summary, markdown), 1, 200) as snippet "
+                             "from history where username = ? order by processed_at desc limit ? offset ?",
+                             [username, limit, offset])
+        # The unary + keeps SQLite from driving the join off the username index, which
+        # re-runs the full-text match once per row the user has (seconds instead of ms)
+        return self.db.q("select history.id, history.url, history.title, history.processed_at, "
+                         "snippet(history_fts, -1, ?, ?, '…', 24) as snippet "
+                         "from history_fts join history on history.id = history_fts.rowid "
+                         "where history_fts match ? and +history.username = ? order by rank limit ? offset ?",
+                         [MATCH_START, MATCH_END, query, username, limit, offset])
+
+    def get(self, username, article_id):
+        rows = self.db.q("select * from history where id = ? and username = ?", [article_id, username])
+        return rows[0] if rows else None
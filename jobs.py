@@ -0,0 +1,118 @@
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import Future
+from queue import PriorityQueue
+from threading import Lock, Thread
+
+# Lower runs first
+INTERACTIVE = 0
+BATCH = 10
+
+WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))
+MAX_QUEUE = int(os.environ.get('SUMMARY_MAX_QUEUE', 100))
+# Queue slots only interactive jobs may take, so batch work can't fill the queue (default a quarter of it)
+INTERACTIVE_RESERVE = os.environ.get('SUMMARY_INTERACTIVE_RESERVE')
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id, fn, args, priority, seq):
+        self.id, self.fn, self.args, self.priority, self.seq = job_id, fn, args, priority, seq
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = self.finished_at = None
+        self.future = Future()
+
+    def info(self):
+        return dict(id=self.id, status=self.status, priority=self.priority, submitted_at=self.submitted_at,
+                    started_at=self.started_at, finished_at=self.finished_at)
+
+class JobScheduler:
+    """A fixed pool of worker threads draining a bounded priority queue.
+
+    `submit` raises QueueFull once `max_queue` jobs are waiting, or for
+    lower-priority jobs once all but `reserved` slots are taken; jobs of equal
+    priority run in submission order.
+    """
+
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, reserved=None):
+        if reserved is None:
+            reserved = int(INTERACTIVE_RESERVE) if INTERACTIVE_RESERVE else max_queue // 4
+        self.workers, self.max_queue, self.reserved = workers, max_queue, reserved
+        self.queue = PriorityQueue()
+        self.jobs = {}
+        self.lock = Lock()
+        self.seq = itertools.count()
+        self.threads = []
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0}
+
+    def _start(self):
+        while len(self.threads) < self.workers:
+            t = Thread(target=self._work, name=f"summary-worker-{len(self.threads)}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, job_id, fn, *args, priority=INTERACTIVE):
+        with self.lock:
+            limit = self.max_queue if priority <= INTERACTIVE else max(1, self.max_queue - self.reserved)
+            if self._queued() >= limit:
+                self.stats['rejected'] += 1
+                raise QueueFull(f"Summary queue is full ({limit} jobs waiting)")
+            job = self.jobs[job_id] = Job(job_id, fn, args, priority, next(self.seq))
+            self.stats['submitted'] += 1
+            self.queue.put((priority, job.seq, job))
+            self._start()
+        return job
+
+    def _queued(self, priority=None):
+        return sum(1 for j in self.jobs.values() if j.status == 'queued' and priority in (None, j.priority))
+
+    def queued(self, priority=None):
+        """Jobs waiting to run, only those of `priority` if given."""
+        with self.lock:
+            return self._queued(priority)
+
+    def position(self, job_id):
+        """1-based place of a queued job in run order, or None if it is not waiting."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return None
+            ahead = [j for j in self.jobs.values() if j.status == 'queued'
+                     and (j.priority, j.seq) < (job.priority, job.seq)]
+            return len(ahead) + 1
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(workers=self.workers, max_queue=self.max_queue, reserved=self.reserved, queued=self._queued(),
+                        running=sum(1 for j in self.jobs.values() if j.status == 'running'),
+                        **self.stats, jobs=[j.info() for j in self.jobs.values()])
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            with self.lock:
+                job.status, job.started_at = 'running', time.time()
+            try:
+                result = job.fn(*job.args)
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {str(e)}")
+                with self.lock:
+                    job.status = 'error'
+                    self.stats['failed'] += 1
+                job.future.set_exception(e)
+            else:
+                with self.lock:
+                    job.status = 'done'
+                    self.stats['completed'] += 1
+                job.future.set_result(result)
+            finally:
+                job.finished_at = time.time()
+                with self.lock:
+                    self.jobs.pop(job.id, None)
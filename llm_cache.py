@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from apswutils.db import NotFoundError
+
+TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+def cache_key(model, template, custom_prompt, markdown):
+    payload = json.dumps([model, template, custom_prompt or '', markdown])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class LLMCache:
+    """Completions keyed by a hash of (model, prompt template, custom prompt, article text).
+
+    Entries expire after `ttl` seconds; once the stored responses exceed `max_bytes`
+    the least recently used ones are evicted. Puts add to a running estimate of
+    the total, so the table is only summed once the estimate crosses `max_bytes`.
+    """
+
+    def __init__(self, db, ttl=TTL, max_bytes=MAX_BYTES):
+        self.db, self.ttl, self.max_bytes = db, ttl, max_bytes
+        self.completions = db.t.llm_cache
+        if self.completions not in db.t:
+            self.completions.create(dict(key=str, model=str, response=str, size=int,
+                                         created_at=float, last_used=float), pk='key')
+        self.completions.create_index(['created_at'], if_not_exists=True)
+        self.completions.create_index(['last_used'], if_not_exists=True)
+        self.bytes = None  # estimate of the stored total; other processes' writes only show up at a recount
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _lookup(self, key, now):
+        try:
+            row = self.completions.get(key)
+        except NotFoundError:
+            return None
+        return row if now - row['created_at'] <= self.ttl else None
+
+    def contains(self, model, template, custom_prompt, markdown):
+        return self._lookup(cache_key(model, template, custom_prompt, markdown), time.time()) is not None
+
+    def peek(self, model, template, custom_prompt, markdown):
+        """The cached response, or None, without counting it as a lookup."""
+        row = self._lookup(cache_key(model, template, custom_prompt, markdown), time.time())
+        return row['response'] if row else None
+
+    def get(self, model, template, custom_prompt, markdown):
+        key = cache_key(model, template, custom_prompt, markdown)
+        now = time.time()
+        row = self._lookup(key, now)
+        with self.lock:
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+        self.completions.update({'last_used': now}, key)
+        return row['response']
+
+    def _total(self):
+        return self.db.q("select coalesce(sum(size), 0) as total from llm_cache")[0]['total']
+
+    def put(self, model, template, custom_prompt, markdown, response):
+        now = time.time()
+        size = len(response.encode())
+        self.completions.upsert(dict(key=cache_key(model, template, custom_prompt, markdown), model=model,
+                                     response=response, size=size, created_at=now, last_used=now))
+        with self.lock:
+            if self.bytes is None:
+                self.bytes = self._total()
+            else:
+                self.bytes += size
+            full = self.bytes > self.max_bytes
+        self.evict(now, by_size=full)
+
+    def evict(self, now=None, by_size=True):
+        """Drop expired entries, then (with `by_size`) least recently used ones until under `max_bytes`."""
+        now = now or time.time()
+        evicted = self.completions.count_where("created_at < ?", [now - self.ttl])
+        if evicted:
+            self.completions.delete_where("created_at < ?", [now - self.ttl])
+        if by_size:
+            total = self._total()
+            if total > self.max_bytes:
+                for row in self.db.q("select key, size from llm_cache order by last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    self.completions.delete(row['key'])
+                    total -= row['size']
+                    evicted += 1
+            with self.lock:
+                self.bytes = total
+        if evicted:
+            with self.lock:
+                self.stats['evictions'] += evicted
+            logging.info(f"LLM cache evicted {evicted} entries")
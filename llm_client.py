@@ -0,0 +1,183 @@
+import logging
+import os
+import random
+import time
+from threading import Lock
+from urllib.parse import urlsplit
+
+import metrics
+import ratelimit
+
+# Seconds an attempt may wait for the next streamed bytes before failing over,
+# and for the whole completion including failovers
+ATTEMPT_TIMEOUT = float(os.environ.get('LLM_ATTEMPT_TIMEOUT', 30))
+DEADLINE = float(os.environ.get('LLM_DEADLINE', 120))
+# Routing: weight of recent samples, seconds of latency an error rate of 1 counts as,
+# and the share of calls sent to a random endpoint to keep measuring the others
+EWMA_ALPHA = 0.3
+ERROR_PENALTY = float(os.environ.get('LLM_ERROR_PENALTY', 10))
+EXPLORE = float(os.environ.get('LLM_EXPLORE', 0.05))
+MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 32))
+
+# Also raised by the rate control when a call would wait for its turn past the deadline
+DeadlineExceeded = ratelimit.DeadlineExceeded
+
+def parse_endpoints(spec, api_key=''):
+    """Endpoints from "base_url[|model[|API_KEY_VAR]]" entries separated by commas.
+
+    Without a model, an endpoint serves whichever model is requested; without
+    a key variable it uses `api_key`.
+    """
+    endpoints = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        base_url, model, key_var = (entry.strip().split('|') + ['', ''])[:3]
+        endpoints.append(Endpoint(base_url.strip(), model.strip() or None,
+                                  os.environ.get(key_var.strip(), '') if key_var.strip() else api_key))
+    return endpoints
+
+def _ewma(current, sample):
+    return sample if current is None else current + EWMA_ALPHA * (sample - current)
+
+class Endpoint:
+    """An OpenAI-compatible endpoint with its long-lived client and recent latency and error rate."""
+
+    def __init__(self, base_url, model=None, api_key=''):
+        self.base_url, self.model, self.api_key = base_url, model, api_key
+        self.provider = urlsplit(base_url).netloc
+        self.name = f"{self.provider}/{model}" if model else self.provider
+        self.client = None
+        self.latency = None  # seconds to the first streamed token
+        self.errors = 0.0
+        self.calls = self.failures = 0
+
+    def score(self):
+        # Lower is better; endpoints not yet measured come first so each gets tried
+        return (self.latency or 0.0) + ERROR_PENALTY * self.errors
+
+    def info(self):
+        return dict(name=self.name, base_url=self.base_url, model=self.model, latency=self.latency,
+                    errors=self.errors, calls=self.calls, failures=self.failures)
+
+class LLMClients:
+    """Shared clients for a list of endpoints, routing each completion to the best one.
+
+    Endpoints are ranked by recent time to first token plus a penalty for recent
+    errors, with an occasional call sent elsewhere so a recovered endpoint is
+    noticed. A call that times out, can't connect, or gets a 429/5xx fails over
+    to the next endpoint; only the last one left retries (through `limits`,
+    a ratelimit.RateControl keyed by provider, which also paces the calls).
+    Each client is created once and keeps its connections alive.
+    """
+
+    def __init__(self, endpoints, make_client, limits=None, attempt_timeout=ATTEMPT_TIMEOUT,
+                 deadline=DEADLINE, explore=EXPLORE):
+        if not endpoints:
+            raise ValueError("no LLM endpoints configured")
+        self.endpoints, self.make_client, self.limits = endpoints, make_client, limits
+        self.attempt_timeout, self.deadline, self.explore = attempt_timeout, deadline, explore
+        self.lock = Lock()
+        self.stats = {'calls': 0, 'failovers': 0, 'deadline_exceeded': 0}
+
+    def client(self, endpoint):
+        with self.lock:
+            if endpoint.client is None:
+                endpoint.client = self.make_client(endpoint)
+            return endpoint.client
+
+    def ranked(self):
+        with self.lock:
+            order = sorted(self.endpoints, key=Endpoint.score)
+        if len(order) > 1 and random.random() < self.explore:
+            order.insert(0, order.pop(random.randrange(1, len(order))))
+        return order
+
+    def _record(self, endpoint, latency=None, failed=False):
+        with self.lock:
+            endpoint.calls += 1
+            endpoint.failures += failed
+            endpoint.errors = _ewma(endpoint.errors if endpoint.calls > 1 else None, 1.0 if failed else 0.0)
+            if latency is not None:
+                endpoint.latency = _ewma(endpoint.latency, latency)
+
+    def complete(self, model, messages, on_text=None, deadline=None):
+        """Stream a chat completion; returns (content, completion tokens or None, endpoint).
+
+        `on_text(content)` gets the text so far after each streamed piece; after a
+        failover it starts again from the beginning. Raises DeadlineExceeded once
+        `deadline` seconds (default LLM_DEADLINE) have passed.
+        """
+        import openai
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        order = self.ranked()
+        with self.lock:
+            self.stats['calls'] += 1
+        for i, endpoint in enumerate(order):
+            last = i == len(order) - 1
+            start = time.monotonic()
+            first_token = None
+
+            def request():
+                nonlocal first_token
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"LLM deadline of {deadline or self.deadline:.0f}s exceeded")
+                stream = self.client(endpoint).chat.completions.create(
+                    model=endpoint.model or model,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=min(self.attempt_timeout, remaining)
+                )
+                content, output_tokens = '', None
+                for chunk in stream:
+                    if getattr(chunk, 'usage', None):
+                        output_tokens = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.monotonic() - start
+                        content += chunk.choices[0].delta.content
+                        if on_text:
+                            on_text(content)
+                    if time.monotonic() > deadline_at:
+                        getattr(stream, 'close', lambda: None)()
+                        raise DeadlineExceeded(f"LLM deadline of {deadline or self.deadline:.0f}s exceeded")
+                return content, output_tokens
+
+            try:
+                if self.limits is None:
+                    content, output_tokens = request()
+                else:
+                    content, output_tokens = self.limits.call(endpoint.provider, request, retries=None if last else 0,
+                                                              transient=(openai.APIConnectionError,),
+                                                              deadline=deadline_at)
+            except DeadlineExceeded:
+                self._record(endpoint, failed=True)
+                with self.lock:
+                    self.stats['deadline_exceeded'] += 1
+                raise
+            except Exception as e:
+                throttled = isinstance(e, ratelimit.Throttled)
+                retryable = throttled or isinstance(e, openai.APIConnectionError) or \
+                    getattr(e, 'status_code', None) in ratelimit.RETRY_STATUSES
+                if not retryable:
+                    raise
+                # Throttled is our own rate control declining to wait, not a verdict on the endpoint;
+                # a fast error response says nothing about how soon its tokens arrive
+                if not throttled:
+                    self._record(endpoint, latency=first_token, failed=True)
+                if last:
+                    raise
+                with self.lock:
+                    self.stats['failovers'] += 1
+                metrics.LLM_FAILOVERS.inc(endpoint=endpoint.name)
+                logging.warning(f"LLM endpoint {endpoint.name} failed ({type(e).__name__}: {e}), "
+                                f"failing over to {order[i + 1].name}")
+                continue
+            self._record(endpoint, latency=first_token)
+            return content, output_tokens, endpoint
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, endpoints=[e.info() for e in sorted(self.endpoints, key=Endpoint.score)])
@@ -0,0 +1,127 @@
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+REGISTRY = []
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = {}
+        self.lock = Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A gauge set directly, or read from `collect()` (returning {label tuple: value}) at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.collect is not None:
+            return [(self.name, tuple(str(v) for v in key), (), value) for key, value in self.collect().items()]
+        return super().samples()
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        samples = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, (('le', _format_value(bound)),), count))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), counts[-1]))
+        return samples
+
+def render(registry=REGISTRY):
+    """All registered metrics in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+STAGE_SECONDS = Histogram('webapp_stage_duration_seconds', "Time spent in each pipeline stage", ['stage'])
+STAGE_ERRORS = Counter('webapp_stage_errors_total', "Failures by pipeline stage", ['stage'])
+INPUT_BYTES = Counter('webapp_input_bytes_total', "Bytes of page content fetched")
+OUTPUT_TOKENS = Counter('webapp_llm_output_tokens_total', "Completion tokens received from the LLM", ['call'])
+CACHE_LOOKUPS = Counter('webapp_cache_lookups_total', "Cache lookups by cache and result", ['cache', 'result'])
+COALESCED = Counter('webapp_coalesced_requests_total', "Requests that attached to identical in-flight work", ['stage'])
+UPSTREAM_RETRIES = Counter('webapp_upstream_retries_total', "Upstream calls retried, by kind and reason", ['kind', 'reason'])
+UPSTREAM_THROTTLE_SECONDS = Histogram('webapp_upstream_throttle_seconds', "Time calls waited for rate or concurrency limits, when they had to wait", ['kind'])
+LLM_FAILOVERS = Counter('webapp_llm_failovers_total', "LLM calls moved to another endpoint, by the endpoint that failed", ['endpoint'])
+FEED_POLLS = Counter('webapp_feed_polls_total', "Feed polls by result", ['result'])
+FEED_ITEMS = Counter('webapp_feed_items_total', "Feed entries queued for ingestion and processed", ['status'])
+IN_FLIGHT = Gauge('webapp_in_flight', "Requests currently being processed", ['kind'])
@@ -0,0 +1,328 @@
+import asyncio
+import email.utils
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from threading import Event, Lock
+
+import metrics
+
+BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.5))
+MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 20))
+# Upstreams tracked per RateControl before idle ones are dropped (one per origin host for fetches)
+MAX_UPSTREAMS = int(os.environ.get('RATE_MAX_UPSTREAMS', 1000))
+
+# Responses worth retrying; they also count as overload, shrinking the concurrency limit
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# At most one multiplicative decrease per window, so a burst of failures from one
+# round of requests halves the limit once rather than collapsing it to the minimum
+DECREASE_INTERVAL = 1.0
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+def _status(exc):
+    return getattr(exc, 'status_code', None) or getattr(getattr(exc, 'response', None), 'status_code', None)
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers['retry-after-ms']) / 1000
+    except (KeyError, ValueError):
+        return parse_retry_after(headers.get('retry-after'))
+
+class TokenBucket:
+    """`rate` calls per second with bursts of up to `burst`; a rate of 0 means unlimited.
+
+    `take` reserves a token (or `cost` of them) and returns how long the caller
+    must wait before using it, so callers queue up in order without polling.
+    A caller not willing to wait longer than `max_wait` reserves nothing.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = Lock()
+
+    def take(self, cost=1, max_wait=None):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.rate > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < cost:
+                    wait = max(wait, (cost - self.tokens) / self.rate)
+                if max_wait is None or wait <= max_wait:
+                    self.tokens -= cost
+            return wait
+
+    def block(self, seconds):
+        """Hold back every caller for `seconds`, e.g. after a Retry-After."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def full(self):
+        """Whether a caller could take a whole burst now, as from a new bucket."""
+        with self.lock:
+            now = time.monotonic()
+            return self.blocked_until <= now and \
+                (self.rate <= 0 or self.tokens + (now - self.updated) * self.rate >= self.burst)
+
+class AdaptiveLimit:
+    """A concurrency limit adjusted AIMD-style.
+
+    Each success adds 1/limit (about one slot per round of calls) up to
+    `maximum`; an overload halves it, down to `minimum`. Usable from threads
+    (`acquire`) and from any event loop (`acquire_async`).
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None):
+        self.minimum, self.maximum = minimum, maximum or initial
+        self.limit = float(initial)
+        self.active = 0
+        self.waiters = deque()
+        self.decreased_at = 0.0
+        self.lock = Lock()
+
+    def _wake(self):
+        while self.waiters and self.active < max(self.minimum, int(self.limit)):
+            self.active += 1
+            self.waiters.popleft()()
+
+    def _try_acquire(self, wake):
+        with self.lock:
+            if not self.waiters and self.active < max(self.minimum, int(self.limit)):
+                self.active += 1
+                return True
+            self.waiters.append(wake)
+            return False
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting up to `timeout` seconds (forever if None); returns whether one was taken."""
+        ready = Event()
+        wake = ready.set
+        if self._try_acquire(wake) or ready.wait(timeout):
+            return True
+        with self.lock:
+            if wake in self.waiters:
+                self.waiters.remove(wake)
+                return False
+        return True
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        wake = lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        if self._try_acquire(wake):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = wake not in self.waiters
+                if not granted:
+                    self.waiters.remove(wake)
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            self._wake()
+
+    def idle(self):
+        """Whether nothing holds or waits for a slot and the limit is back at its maximum."""
+        with self.lock:
+            return not self.active and not self.waiters and self.limit >= self.maximum
+
+    def success(self):
+        with self.lock:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def overload(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.decreased_at >= DECREASE_INTERVAL:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased_at = now
+
+class Throttled(Exception):
+    """Raised instead of waiting longer than a RateControl's `max_wait` for a call's turn."""
+
+class DeadlineExceeded(TimeoutError):
+    """Raised instead of waiting for a call's turn past the caller's deadline."""
+
+class Upstream:
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = AdaptiveLimit(concurrency)
+
+    def idle(self):
+        # In the state a new Upstream starts in, so dropping it loses nothing
+        return self.limit.idle() and self.bucket.full()
+
+class RateControl:
+    """Politeness and retries for one kind of upstream (origin sites, LLM providers), per key.
+
+    Calls wait for a token from the key's bucket and a slot under its adaptive
+    concurrency limit. 429s, 5xx responses and `transient` exceptions are
+    retried with exponential backoff and full jitter, or after the server's
+    Retry-After, which also holds back other calls to the same key. A wait
+    longer than `max_wait`, for a retry or for a call's turn, fails straight
+    away instead (the latter with Throttled). Callers can also pass a
+    `deadline` (a time.monotonic() value) that no wait may run past.
+
+    Once more than `max_upstreams` keys are tracked, idle ones are dropped
+    as new keys arrive, so fetching from many hosts doesn't grow it forever.
+    """
+
+    def __init__(self, kind, rate, burst, concurrency, retries, max_wait=MAX_DELAY, max_upstreams=MAX_UPSTREAMS):
+        self.kind = kind
+        self.rate, self.burst, self.concurrency = rate, burst, concurrency
+        self.retries, self.max_wait, self.max_upstreams = retries, max_wait, max_upstreams
+        self.upstreams = {}
+        self.lock = Lock()
+        self.stats = {'calls': 0, 'throttled': 0, 'throttle_seconds': 0.0, 'retries': 0, 'gave_up': 0}
+        self.retry_reasons = {}  # status code or 'connection' -> retries
+
+    def upstream(self, key):
+        with self.lock:
+            upstream = self.upstreams.get(key)
+            if upstream is None:
+                if len(self.upstreams) >= self.max_upstreams:
+                    for idle in [k for k, u in self.upstreams.items() if u.idle()]:
+                        del self.upstreams[idle]
+                upstream = self.upstreams[key] = Upstream(self.rate, self.burst, self.concurrency)
+            return upstream
+
+    def limits(self):
+        """Current concurrency limit per key, for the keys running below their starting limit."""
+        with self.lock:
+            return {key: int(upstream.limit.limit) for key, upstream in self.upstreams.items()
+                    if upstream.limit.limit < upstream.limit.maximum}
+
+    def _waited(self, seconds):
+        with self.lock:
+            self.stats['calls'] += 1
+            if seconds > 0.001:
+                self.stats['throttled'] += 1
+                self.stats['throttle_seconds'] += seconds
+        if seconds > 0.001:
+            metrics.UPSTREAM_THROTTLE_SECONDS.observe(seconds, kind=self.kind)
+
+    def _failed(self, key, upstream, exc, attempt, transient, retries, deadline):
+        # Seconds to wait before retrying, or None to give up
+        status = _status(exc)
+        if status in RETRY_STATUSES:
+            reason = str(status)
+            upstream.limit.overload()
+        elif isinstance(exc, transient):
+            reason = 'connection'
+        else:
+            return None
+        retry_after = _retry_after(exc) if status else None
+        delay = retry_after if retry_after is not None else random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+        with self.lock:
+            if attempt >= retries or delay > self.max_wait or \
+                    (deadline is not None and time.monotonic() + delay > deadline):
+                self.stats['gave_up'] += 1
+                return None
+            self.stats['retries'] += 1
+            self.retry_reasons[reason] = self.retry_reasons.get(reason, 0) + 1
+        # Only a Retry-After we act on holds back the other calls, so a long one (e.g. a
+        # daily quota) fails this call without stalling everything behind it
+        if retry_after is not None:
+            upstream.bucket.block(min(retry_after, self.max_wait))
+        metrics.UPSTREAM_RETRIES.inc(kind=self.kind, reason=reason)
+        logging.warning(f"{self.kind} call to {key} failed ({reason}), retry {attempt + 1}/{retries} in {delay:.2f}s")
+        return delay
+
+    def _gave_up(self, exc):
+        with self.lock:
+            self.stats['gave_up'] += 1
+        raise exc
+
+    def _remaining(self, deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _turn(self, key, upstream, deadline):
+        # Seconds until the next call to `key` may start, raising past `max_wait` or the deadline
+        remaining = self._remaining(deadline)
+        wait = upstream.bucket.take(max_wait=self.max_wait if remaining is None else min(self.max_wait, remaining))
+        if wait > self.max_wait:
+            self._gave_up(Throttled(f"{self.kind} calls to {key} are held back for another {wait:.0f}s"))
+        if remaining is not None and wait > remaining:
+            self._gave_up(DeadlineExceeded(f"{self.kind} call to {key} would wait past its deadline"))
+        return wait
+
+    def call(self, key, fn, *args, transient=(), retries=None, deadline=None):
+        """fn(*args) under the limits for `key`, retried as described above; `retries` overrides the default."""
+        upstream = self.upstream(key)
+        retries = self.retries if retries is None else retries
+        for attempt in itertools.count():
+            start = time.monotonic()
+            wait = self._turn(key, upstream, deadline)
+            if wait:
+                time.sleep(wait)
+            if not upstream.limit.acquire(self._remaining(deadline)):
+                self._gave_up(DeadlineExceeded(f"{self.kind} call to {key} would wait past its deadline"))
+            self._waited(time.monotonic() - start)
+            try:
+                result = fn(*args)
+            except Exception as e:
+                delay = self._failed(key, upstream, e, attempt, transient, retries, deadline)
+                if delay is None:
+                    raise
+            else:
+                upstream.limit.success()
+                return result
+            finally:
+                upstream.limit.release()
+            time.sleep(delay)
+
+    async def call_async(self, key, fn, *args, transient=(), retries=None, deadline=None):
+        """Like `call`, awaiting the coroutine function `fn`."""
+        upstream = self.upstream(key)
+        retries = self.retries if retries is None else retries
+        for attempt in itertools.count():
+            start = time.monotonic()
+            wait = self._turn(key, upstream, deadline)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                await asyncio.wait_for(upstream.limit.acquire_async(), self._remaining(deadline))
+            except asyncio.TimeoutError:
+                self._gave_up(DeadlineExceeded(f"{self.kind} call to {key} would wait past its deadline"))
+            self._waited(time.monotonic() - start)
+            try:
+                result = await fn(*args)
+            except Exception as e:
+                delay = self._failed(key, upstream, e, attempt, transient, retries, deadline)
+                if delay is None:
+                    raise
+            else:
+                upstream.limit.success()
+                return result
+            finally:
+                upstream.limit.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,53 @@
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+
+MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class RenderCache:
+    """Markdown rendered to HTML, keyed by a hash of the markdown text.
+
+    Holds at most `max_bytes` of HTML, evicting the least recently used renders.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # content hash -> html
+        self.bytes = 0
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, text):
+        key = content_hash(text)
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return html
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, text, html):
+        key = content_hash(text)
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = html
+            self.bytes += len(html)
+            while self.bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def render(self, text):
+        html = self.get(text)
+        if html is None:
+            import markdown
+            html = markdown.markdown(text)
+            self.put(text, html)
+        return html
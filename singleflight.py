@@ -0,0 +1,82 @@
+import asyncio
+from threading import RLock
+
+class AsyncGroup:
+    """Concurrent awaits of the same key share one call (single-flight).
+
+    The call runs as its own task, so a caller that goes away (e.g. its client
+    disconnected) doesn't cancel it for the others still waiting.
+    """
+
+    def __init__(self):
+        self.calls = {}  # key -> task
+        self.stats = {'calls': 0, 'shared': 0}
+
+    def _done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Retrieve the exception so it isn't reported as unhandled when every caller left
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key, fn, *args):
+        """Await fn(*args), or the call already running for `key`; returns (result, shared)."""
+        loop = asyncio.get_running_loop()
+        task = self.calls.get(key)
+        shared = task is not None and task.get_loop() is loop
+        if shared:
+            self.stats['shared'] += 1
+        else:
+            self.stats['calls'] += 1
+            task = self.calls[key] = loop.create_task(fn(*args))
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), shared
+
+class Flight:
+    def __init__(self, key, leader):
+        self.key, self.leader = key, leader
+        self.members = [leader]
+        self.state = {}  # progress published so far, for members joining late
+
+class Flights:
+    """Jobs in flight by key, which identical requests attach to instead of starting their own.
+
+    The first member leads: it runs the job, publishing progress to every member
+    and landing the flight when done. Hold `lock` around `join` and whatever
+    records the new member, so nobody can join a flight after it has landed.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = RLock()
+        self.stats = {'started': 0, 'joined': 0}
+
+    def join(self, key, member):
+        """The flight for `key` with `member` attached; a new one led by `member` if none is running."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Flight(key, member)
+                self.stats['started'] += 1
+            else:
+                flight.members.append(member)
+                self.stats['joined'] += 1
+            return flight
+
+    def publish(self, flight, **fields):
+        """Record progress of `flight`; returns the members to pass it on to."""
+        with self.lock:
+            flight.state.update(fields)
+            return list(flight.members)
+
+    def land(self, flight):
+        """End `flight`, returning its members. Later requests for the key start a new flight."""
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            return list(flight.members)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.flights),
+                        attached=sum(len(f.members) for f in self.flights.values()))
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from threading import Lock, Thread
+
+from apswutils.db import NotFoundError
+
+TTL = float(os.environ.get('SUMMARY_TTL', 3600))
+MAX_BYTES = int(os.environ.get('SUMMARY_MAX_BYTES', 64 * 1024 * 1024))
+SWEEP_INTERVAL = float(os.environ.get('SUMMARY_SWEEP_INTERVAL', 60))
+# How long a worker waits for another process's write lock, in milliseconds
+BUSY_TIMEOUT = int(os.environ.get('SUMMARY_BUSY_TIMEOUT', 5000))
+
+def entry_size(entry):
+    """Approximate bytes held by an entry: its strings (and lists of strings) plus a fixed per-field overhead."""
+    def size(v):
+        if isinstance(v, str):
+            return len(v)
+        if isinstance(v, list):
+            return sum(size(item) for item in v)
+        return 0
+    return sum(len(k) + size(v) + 64 for k, v in entry.items())
+
+def process_alive(pid):
+    """Whether `pid` is a running process other than this one."""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running, as another user
+    return True
+
+class SummaryStore:
+    """Dict-like store for in-flight summary requests.
+
+    Entries expire `ttl` seconds after they were last read or written, and the
+    least recently used ones are evicted once the total exceeds `max_bytes`.
+    A daemon thread sweeps expired entries every `sweep_interval` seconds.
+    """
+
+    def __init__(self, ttl=TTL, max_bytes=MAX_BYTES, sweep_interval=SWEEP_INTERVAL):
+        self.ttl, self.max_bytes, self.sweep_interval = ttl, max_bytes, sweep_interval
+        self.entries = OrderedDict()  # request_id -> (entry, size, touched_at)
+        self.bytes = 0
+        self.lock = Lock()
+        self.evictions = {'expired': 0, 'size': 0}
+        self.sweeper = None
+
+    def _drop(self, request_id):
+        # The sweeper or an eviction may already have removed it
+        item = self.entries.pop(request_id, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def _live(self, request_id, now):
+        item = self.entries.get(request_id)
+        if item is not None and now - item[2] > self.ttl:
+            self._drop(request_id)
+            self.evictions['expired'] += 1
+            return None
+        return item
+
+    def __setitem__(self, request_id, entry):
+        size = entry_size(entry)
+        with self.lock:
+            if request_id in self.entries:
+                self._drop(request_id)
+            self.entries[request_id] = (entry, size, time.time())
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                oldest = next(iter(self.entries))
+                self._drop(oldest)
+                self.evictions['size'] += 1
+            self._start_sweeper()
+
+    def get(self, request_id, default=None):
+        now = time.time()
+        with self.lock:
+            item = self._live(request_id, now)
+            if item is None:
+                return default
+            self.entries[request_id] = (item[0], item[1], now)
+            self.entries.move_to_end(request_id)
+            return item[0]
+
+    def __getitem__(self, request_id):
+        entry = self.get(request_id)
+        if entry is None:
+            raise KeyError(request_id)
+        return entry
+
+    def __contains__(self, request_id):
+        with self.lock:
+            return self._live(request_id, time.time()) is not None
+
+    def __delitem__(self, request_id):
+        with self.lock:
+            self._drop(request_id)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            expired = [k for k, (_, _, touched) in self.entries.items() if now - touched > self.ttl]
+            for request_id in expired:
+                self._drop(request_id)
+            self.evictions['expired'] += len(expired)
+        if expired:
+            logging.info(f"Expired {len(expired)} abandoned summary requests")
+        return len(expired)
+
+    def fail_orphans(self, error):
+        # Entries held in memory never outlive the process running their jobs
+        return 0
+
+    def _start_sweeper(self):
+        if self.sweeper is None and self.sweep_interval:
+            self.sweeper = Thread(target=self._sweep_forever, name="summary-sweeper", daemon=True)
+            self.sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes,
+                        evictions=sum(self.evictions.values()),
+                        expired=self.evictions['expired'], evicted_for_size=self.evictions['size'])
+
+class SqliteSummaryStore(SummaryStore):
+    """SummaryStore kept in a SQLite table, so every worker process using the same
+    database file sees the same requests and any of them can serve a poll.
+
+    Expiry and the size limit work as in SummaryStore. Reads refresh an entry's
+    expiry at most once a second to avoid a write per poll. Writes add to a
+    running estimate of the stored bytes, and the table is only summed once the
+    estimate passes `max_bytes`.
+    """
+
+    def __init__(self, db, ttl=TTL, max_bytes=MAX_BYTES, sweep_interval=SWEEP_INTERVAL):
+        super().__init__(ttl, max_bytes, sweep_interval)
+        self.db = db
+        self.requests = db.t.summary_requests
+        if self.requests not in db.t:
+            self.requests.create(dict(request_id=str, entry=str, size=int, touched_at=float), pk='request_id')
+        db.conn.setbusytimeout(BUSY_TIMEOUT)
+        self.estimate = None  # other workers' writes only show up at a recount
+
+    def _row(self, request_id, now):
+        try:
+            row = self.requests.get(request_id)
+        except NotFoundError:
+            return None
+        if now - row['touched_at'] > self.ttl:
+            self.requests.delete_where("request_id = ? and touched_at = ?", [request_id, row['touched_at']])
+            with self.lock:
+                self.evictions['expired'] += 1
+            return None
+        return row
+
+    def _total(self):
+        return self.db.q("select coalesce(sum(size), 0) as total from summary_requests")[0]['total']
+
+    def __setitem__(self, request_id, entry):
+        size = entry_size(entry)
+        self.requests.upsert(dict(request_id=request_id, entry=json.dumps(entry), size=size, touched_at=time.time()))
+        with self.lock:
+            self.estimate = self._total() if self.estimate is None else self.estimate + size
+            if self.estimate <= self.max_bytes:
+                self._start_sweeper()
+                return
+        total = self._total()
+        if total > self.max_bytes:
+            evicted = 0
+            for row in self.db.q("select request_id, size from summary_requests where request_id != ? order by touched_at",
+                                 [request_id]):
+                if total <= self.max_bytes:
+                    break
+                self.requests.delete_where("request_id = ?", [row['request_id']])
+                total -= row['size']
+                evicted += 1
+            with self.lock:
+                self.evictions['size'] += evicted
+        with self.lock:
+            self.estimate = total
+        self._start_sweeper()
+
+    def get(self, request_id, default=None):
+        now = time.time()
+        row = self._row(request_id, now)
+        if row is None:
+            return default
+        if now - row['touched_at'] > 1:
+            self.requests.update({'touched_at': now}, request_id)
+        return json.loads(row['entry'])
+
+    def __contains__(self, request_id):
+        return self._row(request_id, time.time()) is not None
+
+    def __delitem__(self, request_id):
+        self.requests.delete_where("request_id = ?", [request_id])
+
+    def __len__(self):
+        return self.requests.count
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl
+        expired = self.requests.count_where("touched_at < ?", [cutoff])
+        if expired:
+            self.requests.delete_where("touched_at < ?", [cutoff])
+            with self.lock:
+                self.evictions['expired'] += expired
+            logging.info(f"Expired {expired} abandoned summary requests")
+        return expired
+
+    def fail_orphans(self, error):
+        """Mark pending entries whose worker process is gone as failed with `error`; returns how many.
+
+        Summary jobs only live in the memory of the process that queued them
+        (recorded as the entry's `worker` pid), so after a restart nothing will
+        ever finish them. Meant to run at startup, before this process adds
+        entries: one with its own pid is left from an earlier process (e.g.
+        pid 1 in a restarted container).
+        """
+        failed = 0
+        for row in self.db.q("select request_id, entry from summary_requests "
+                             "where json_extract(entry, '$.status') = 'pending'"):
+            entry = json.loads(row['entry'])
+            if process_alive(entry.get('worker')):
+                continue
+            self[row['request_id']] = {**entry, 'status': 'error', 'error': error}
+            failed += 1
+        if failed:
+            logging.warning(f"Failed {failed} summary requests left pending by stopped workers")
+        return failed
+
+    def stats(self):
+        with self.lock:
+            evictions = dict(self.evictions)
+        return dict(entries=len(self), bytes=self._total(), max_bytes=self.max_bytes,
+                    evictions=sum(evictions.values()),
+                    expired=evictions['expired'], evicted_for_size=evictions['size'])
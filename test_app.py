@@ -4,6 +4,11 @@ from starlette.testclient import TestClient
 import os
 import tempfile
 import shutil
+import apsw
+from article_cache import ArticleCache
+from llm_cache import LLMCache
+from history import History
+from feeds import Feeds
 
 @pytest.fixture
 def client():
@@ -28,6 +33,10 @@ def client():
     # Patch the app module
     app_module.db = test_db_obj
     app_module.users = test_users
+    app_module.article_cache = ArticleCache(test_db_obj)
+    app_module.llm_cache = LLMCache(test_db_obj)
+    app_module.history = History(test_db_obj)
+    app_module.feed_store = Feeds(test_db_obj)
     
     client = TestClient(app_module.app)
     yield client
@@ -41,6 +50,10 @@ def client():
     # Restore original database for app module
     app_module.db = database(original_db_path)
     app_module.users = app_module.db.t.users
+    app_module.article_cache = ArticleCache(app_module.db)
+    app_module.llm_cache = LLMCache(app_module.db)
+    app_module.history = None
+    app_module.feed_store = None
 
 def test_homepage_not_logged_in(client):
     """Test homepage shows 'hello, world' when not logged in"""
@@ -213,3 +226,409 @@ def test_process_url_not_logged_in(client):
     # Should redirect to login
     assert response.status_code == 303
     assert response.headers["location"] == "/login"
+
+def test_stream_summary_unknown_request(client):
+    """Test that streaming an unknown summary ends immediately"""
+    response = client.get("/stream-summary/does-not-exist")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: done" in response.text
+
+def test_get_summary_survives_entry_removed_concurrently(client):
+    """Test that a finished summary still renders when the sweeper drops it before the poll deletes it"""
+    import app as app_module
+    store = app_module.get_summary_cache()
+    store['swept'] = {'status': 'complete', 'summary': 'Done', 'custom_response': None,
+                      'request_time': 0, 'queue_time': 0, 'readability_time': 0, 'llm_time': 0, 'llm_wall_time': 0}
+    get = store.get
+
+    def get_then_sweep(request_id, default=None):
+        entry = get(request_id, default)
+        del store[request_id]
+        return entry
+
+    store.get = get_then_sweep
+    try:
+        response = client.get("/get-summary/swept")
+    finally:
+        del store.get
+    assert response.status_code == 200
+    assert "Done" in response.text
+    assert "Summary expired" in client.get("/get-summary/swept").text
+
+def test_parse_batch_urls():
+    """Test extracting URLs from pasted text or CSV rows"""
+    import app as app_module
+    text = "https://a.com/1\n\nnot a url\nhttps://b.com/2,Some title\nhttps://a.com/1\n\"http://c.com\"\n"
+    assert app_module.parse_batch_urls(text) == ["https://a.com/1", "https://b.com/2", "http://c.com"]
+
+def test_batch_not_logged_in(client):
+    """Test that batch processing requires login"""
+    response = client.post("/batch", data={"urls": "https://example.com"}, follow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["location"] == "/login"
+
+def test_batch_without_urls(client):
+    """Test that a batch with no valid URLs is rejected"""
+    client.post("/register", data={
+        "username": "batchtest",
+        "password": "testpass123"
+    }, follow_redirects=True)
+    
+    response = client.post("/batch", data={"urls": "not a url"})
+    assert response.status_code == 200
+    assert "No valid http(s) URLs found" in response.text
+
+def test_parse_fused():
+    """Test reading both outputs from a fused completion"""
+    import app as app_module
+    content = '```json\n{"summary": "Short summary.", "custom_response": "- 2024: launch"}\n```'
+    assert app_module.parse_fused(content) == ("Short summary.", "- 2024: launch")
+    with pytest.raises(ValueError):
+        app_module.parse_fused("Not JSON at all")
+
+def test_timing_text_reports_wall_and_per_call_time():
+    """Test that the timing line separates wall time from each LLM call"""
+    import app as app_module
+    timings = {'request_time': 0.5, 'queue_time': 0.01, 'readability_time': 0.2}
+    llm = {'llm_wall_time': 2.1, 'llm_time': 2.0, 'custom_response': 'x', 'custom_llm_time': 1.9}
+    text = app_module.timing_text(timings, llm)
+    assert "LLM 2.10s (summary 2.00s, custom 1.90s)" in text
+    assert "Queue 0.01s" in text
+
+def test_summary_chunks_strategies(monkeypatch):
+    """Test that long articles are chunked for map-reduce and truncated otherwise"""
+    import app as app_module
+    text = '\n\n'.join(f"## Section {i}\n\n" + 'Some words here. ' * 300 for i in range(5))
+    monkeypatch.setattr(app_module, 'SUMMARY_STRATEGY', 'truncate')
+    assert app_module.summary_chunks(text) == [text[:app_module.TRUNCATE_CHARS]]
+    monkeypatch.setattr(app_module, 'SUMMARY_STRATEGY', 'map_reduce')
+    assert len(app_module.summary_chunks(text)) > 1
+    assert app_module.summary_chunks("short") == ["short"]
+
+def test_summarize_map_reduce(monkeypatch):
+    """Test that chunk summaries are combined by a reduce call and reported per chunk"""
+    import app as app_module
+    prompts = []
+
+    class Completions:
+        def create(self, model, messages, **kwargs):
+            prompts.append(messages[0]['content'])
+            delta = type('Delta', (), {'content': f"partial {len(prompts)}"})
+            return [type('Chunk', (), {'usage': None, 'choices': [type('Choice', (), {'delta': delta})]})]
+
+    class Client:
+        def __init__(self, endpoint):
+            self.chat = type('Chat', (), {'completions': Completions()})
+
+    monkeypatch.setattr(app_module, 'make_client', Client)
+    monkeypatch.setattr(app_module, 'llm_clients', None)
+    monkeypatch.setattr(app_module, 'llm_cache', app_module.LLMCache(database(':memory:')))
+    result = app_module.summarize(['first part', 'second part', 'third part'], None, 'test-model')
+    assert len(prompts) == 4
+    assert prompts[-1].startswith(app_module.REDUCE_PROMPT.split('{')[0])
+    assert [(c['step'], c['index']) for c in result['chunks']] == [('map', 0), ('map', 1), ('map', 2), ('reduce', 0)]
+    assert all(c['input_tokens'] > 0 and c['output_tokens'] > 0 for c in result['chunks'])
+    assert "3 chunks" in app_module.timing_text({'request_time': 0, 'queue_time': 0, 'readability_time': 0}, result)
+
+def test_article_permalink_etag(client):
+    """Test that repeat views of a processed article revalidate with ETag and 304"""
+    import app as app_module
+    from types import SimpleNamespace
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    app_module.article_cache.put("https://example.com/post", SimpleNamespace(headers={}), {
+        'title': 'Cached Post', 'markdown': '# Heading\n\nSome *text*.', 'char_count': 24, 'token_count': 5,
+        'link_char_count': 0, 'link_token_count': 0, 'link_percentage': 0.0})
+    response = client.get("/article", params={"url": "https://example.com/post", "format": "html"})
+    assert response.status_code == 200
+    assert "Cached Post" in response.text
+    assert "<em>text</em>" in response.text
+    etag = response.headers['etag']
+    repeat = client.get("/article", params={"url": "https://example.com/post", "format": "html"},
+                        headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    other = client.get("/article", params={"url": "https://example.com/post", "format": "markdown"},
+                       headers={"If-None-Match": etag})
+    assert other.status_code == 200
+
+def test_responses_are_compressed(client):
+    """Test that large pages are gzip-compressed when the client accepts it"""
+    import app as app_module
+    from types import SimpleNamespace
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    app_module.article_cache.put("https://example.com/long", SimpleNamespace(headers={}), {
+        'title': 'Long Post', 'markdown': 'Some words here. ' * 2000, 'char_count': 34000, 'token_count': 7555,
+        'link_char_count': 0, 'link_token_count': 0, 'link_percentage': 0.0})
+    response = client.get("/article", params={"url": "https://example.com/long"}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert "Long Post" in response.text
+    plain = client.get("/article", params={"url": "https://example.com/long"}, headers={"Accept-Encoding": "identity"})
+    assert 'content-encoding' not in plain.headers
+
+def test_import_has_no_side_effects(tmp_path):
+    """Test that importing the app opens no database and defers heavy libraries"""
+    import subprocess, sys
+    script = ("import sys, app; "
+              "print(sorted(m for m in ('openai', 'html2text', 'pyreadability', 'markdown') if m in sys.modules))")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + sys.path))
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
+    assert os.listdir(tmp_path) == []
+
+def test_identical_summaries_share_one_job(monkeypatch):
+    """Test that requests attached to an in-flight summary each get the shared result with their own timings"""
+    import app as app_module
+    calls = []
+
+    def summarize(chunks, custom_prompt, model, on_partial=None, on_result=None):
+        calls.append(chunks)
+        on_partial('summary', 'Partial')
+        return {'summary': 'Shared summary', 'llm_time': 1.0, 'custom_response': None, 'custom_llm_time': 0, 'llm_wall_time': 1.0}
+
+    monkeypatch.setattr(app_module, 'summarize', summarize)
+    store = app_module.get_summary_cache()
+    flights = app_module.summary_flights
+    key = ('https://example.com/shared', None, 'test-model')
+    for request_id, request_time in (('leader', 0.5), ('follower', 0.1)):
+        flight = flights.join(key, request_id)
+        store[request_id] = {'status': 'pending', 'custom_prompt': None, 'request_time': request_time,
+                             'queue_time': 0, 'readability_time': 0, 'job_id': flight.leader}
+    app_module.generate_summary('leader', 'test-model', ['text'], flight)
+    assert len(calls) == 1
+    assert store['leader']['summary'] == store['follower']['summary'] == 'Shared summary'
+    assert (store['leader']['request_time'], store['follower']['request_time']) == (0.5, 0.1)
+    later = flights.join(key, 'later')
+    assert later.leader == 'later'
+    flights.land(later)
+    for request_id in ('leader', 'follower'):
+        del store[request_id]
+
+def test_history_search_and_view(client):
+    """Test that processed articles can be searched and reopened from the user's history"""
+    import app as app_module
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    article = {'title': 'Tide tables', 'markdown': 'High tide arrives <b>twice</b> a day.', 'char_count': 36,
+               'token_count': 9, 'link_char_count': 0, 'link_token_count': 0, 'link_percentage': 0.0}
+    timings = {'request_time': 0.1, 'queue_time': 0, 'readability_time': 0.05}
+    app_module.history.record('testuser', 'https://example.com/tides', article, timings, 'req-1')
+    app_module.history.record('someone-else', 'https://example.com/tides', article, timings, 'req-2')
+    app_module.history.add_summary('req-1', {'summary': 'Tides come **twice** daily.', 'llm_time': 1.0,
+                                             'custom_llm_time': 0, 'llm_wall_time': 1.0})
+    app_module.history.flush()
+    response = client.get("/history", params={"q": "twice"})
+    assert "Tide tables" in response.text
+    assert "<mark>twice</mark>" in response.text
+    assert "&lt;b&gt;" in client.get("/history", params={"q": "arrives"}).text
+    assert "No matching articles" in client.get("/history", params={"q": "volcano"}).text
+    article_id = app_module.history.search('testuser')[0]['id']
+    page = client.get(f"/history/{article_id}")
+    assert "<strong>twice</strong>" in page.text
+    other_id = app_module.history.search('someone-else')[0]['id']
+    assert "not in your history" in client.get(f"/history/{other_id}").text
+
+def test_feeds_register_and_remove(client):
+    """Test that users register feeds, see only their own, and can remove them"""
+    import app as app_module
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    response = client.post("/feeds", data={"url": "https://example.com/feed.xml"})
+    assert "https://example.com/feed.xml" in response.text
+    assert "not yet" in response.text
+    assert "must start with" in client.post("/feeds", data={"url": "ftp://example.com/feed"}).text
+    app_module.feed_store.add("https://example.com/other.xml", "someone-else")
+    assert "already registered" in client.post("/feeds", data={"url": "https://example.com/other.xml"}).text
+    assert "other.xml" not in client.get("/feeds").text
+    feed_id = app_module.feed_store.list("testuser")[0]['id']
+    assert "No feeds registered yet" in client.post(f"/feeds/{feed_id}/delete").text
+
+def test_summary_cached_across_chunks(monkeypatch):
+    """Test that a long article's summary counts as cached only once its chunk and combining calls are"""
+    import app as app_module
+    cache = app_module.LLMCache(database(':memory:'))
+    monkeypatch.setattr(app_module, 'llm_cache', cache)
+    chunks = ['first part', 'second part']
+    assert not app_module.summary_cached('m', chunks, None)
+    cache.put('m', app_module.CHUNK_PROMPT, None, 'first part', 'One.')
+    cache.put('m', app_module.CHUNK_PROMPT, None, 'second part', 'Two.')
+    assert not app_module.summary_cached('m', chunks, None)
+    cache.put('m', app_module.REDUCE_PROMPT, None, 'One.\n\nTwo.', 'Both.')
+    assert app_module.summary_cached('m', chunks, None)
+    assert not app_module.summary_cached('m', chunks, 'List the dates')
+    assert cache.stats['hits'] == 0
+
+def test_fused_mode_caches_only_valid_replies(monkeypatch):
+    """Test that an unparseable fused reply isn't cached, and a valid one counts as a cached summary"""
+    import app as app_module
+    replies = ["Not JSON at all", "Separate summary.", "Separate response.",
+               '{"summary": "Fused summary.", "custom_response": "Fused response."}']
+
+    class Completions:
+        def create(self, model, messages, **kwargs):
+            delta = type('Delta', (), {'content': replies.pop(0)})
+            return [type('Chunk', (), {'usage': None, 'choices': [type('Choice', (), {'delta': delta})]})]
+
+    class Client:
+        def __init__(self, endpoint):
+            self.chat = type('Chat', (), {'completions': Completions()})
+
+    cache = app_module.LLMCache(database(':memory:'))
+    monkeypatch.setattr(app_module, 'make_client', Client)
+    monkeypatch.setattr(app_module, 'llm_clients', None)
+    monkeypatch.setattr(app_module, 'llm_cache', cache)
+    monkeypatch.setattr(app_module, 'SUMMARY_MODE', 'fused')
+    result = app_module.summarize(['article'], 'List the dates', 'm')
+    assert {result['summary'], result['custom_response']} == {"Separate summary.", "Separate response."}
+    assert cache.peek('m', app_module.FUSED_PROMPT, 'List the dates', 'article') is None
+    assert app_module.summary_cached('m', ['article'], 'List the dates')
+    assert not app_module.summary_cached('m', ['other article'], 'List the dates')
+    app_module.summarize(['other article'], 'List the dates', 'm')
+    assert app_module.summary_cached('m', ['other article'], 'List the dates')
+    assert not cache.contains('m', app_module.SUMMARY_PROMPT, None, 'other article')
+
+def test_failed_leader_lands_its_flight(client, monkeypatch):
+    """Test that a request failing before its summary job starts doesn't leave identical requests waiting"""
+    import app as app_module
+    article = {'title': 'Flaky', 'markdown': 'Some text.', 'char_count': 10, 'token_count': 2,
+               'link_char_count': 0, 'link_token_count': 0, 'link_percentage': 0.0}
+
+    async def load_article(url):
+        return article, {'request_time': 0.1, 'queue_time': 0, 'readability_time': 0.05}
+
+    def summary_cached(model, chunks, prompt):
+        raise apsw.BusyError("database is locked")
+
+    monkeypatch.setattr(app_module, 'load_article', load_article)
+    monkeypatch.setattr(app_module, 'summary_cached', summary_cached)
+    client.post("/register", data={"username": "testuser", "password": "testpass"})
+    response = client.post("/process-url", data={"url": "https://example.com/flaky", "format": "markdown"})
+    assert "database is locked" in response.text
+    assert app_module.summary_flights.flights == {}
+
+@pytest.fixture
+def pages():
+    """Serve article pages from a local HTTP server"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (f"<html><head><title>Page {self.path}</title></head><body><article><h1>Page {self.path}</h1>"
+                    "<p>A paragraph with <a href='https://example.com/a'>a link</a> in it, long enough to count as content.</p>"
+                    "<p>Another paragraph of article text so that readability keeps the body of the page.</p>"
+                    "</article></body></html>").encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.mark.parametrize('output', ['ndjson', 'csv'])
+def test_batch_rows_report_timings_and_progress(client, pages, monkeypatch, output):
+    """Test that batch rows carry article stats, timings, summaries and progress, and count dropped URLs"""
+    import csv, io, json, sys
+    import app as app_module
+    import extract
+    sys.path.insert(0, 'bench')
+    from stub_llm import REPLY, start_stub
+    server, base_url = start_stub()
+    monkeypatch.setenv('OPENROUTER_BASE_URL', base_url)
+    monkeypatch.setenv('OPENROUTER_API_KEY', 'test')
+    monkeypatch.setattr(app_module, 'llm_clients', None)
+    monkeypatch.setattr(app_module, 'BATCH_MAX_URLS', 2)
+    monkeypatch.setattr(extract, 'WORKERS', 0)
+    try:
+        client.post("/register", data={"username": "batchtest", "password": "testpass123"})
+        urls = '\n'.join(f"{pages}/{output}/{i}" for i in range(3))
+        response = client.post("/batch", data={"urls": urls, "output": output, "with_summary": "1"})
+    finally:
+        server.shutdown()
+        server.server_close()
+    if output == 'csv':
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+    else:
+        rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(int(row['completed']) for row in rows) == [1, 2]
+    assert sorted(row['url'] for row in rows) == [f"{pages}/{output}/0", f"{pages}/{output}/1"]
+    for row in rows:
+        assert (row['status'], int(row['total']), int(row['dropped'])) == ('ok', 2, 1)
+        assert row['summary'] == REPLY
+        assert int(row['link_char_count']) == len("a link") and float(row['link_percentage']) > 0
+        assert all(float(row[k]) >= 0 for k in ('request_time', 'queue_time', 'readability_time', 'llm_time'))
+        assert int(row['chunk_count']) == 1
+
+def test_concurrent_summary_updates_are_not_lost(monkeypatch):
+    """Test that the summary and custom prompt threads publishing at once both land in the entry"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import app as app_module
+    from summary_store import SummaryStore
+
+    class SlowStore(SummaryStore):
+        def get(self, request_id, default=None):
+            entry = super().get(request_id, default)
+            time.sleep(0.001)
+            return entry
+
+    store = SlowStore(sweep_interval=0)
+    monkeypatch.setattr(app_module, 'summary_cache', store)
+    store['r'] = {'status': 'pending'}
+    fields = [{f'summary_{i}': 'x'} for i in range(20)] + [{f'custom_{i}': 'y'} for i in range(20)]
+    with ThreadPoolExecutor(2) as threads:
+        list(threads.map(lambda f: app_module.update_summary('r', **f), fields))
+    assert len(store['r']) == 41
+
+def test_fetch_article_keeps_cache_io_off_the_loop(client, pages, monkeypatch):
+    """Test that the article cache is read and written from worker threads, not the event loop"""
+    import asyncio, threading
+    import app as app_module
+    import extract
+    threads = []
+    cache = app_module.get_article_cache()
+    get, put = cache.get, cache.put
+    monkeypatch.setattr(cache, 'get', lambda *a: threads.append(threading.current_thread()) or get(*a))
+    monkeypatch.setattr(cache, 'put', lambda *a: threads.append(threading.current_thread()) or put(*a))
+    monkeypatch.setattr(extract, 'WORKERS', 0)
+
+    async def run():
+        await app_module.fetch_article(f"{pages}/cached")
+        await app_module.fetcher.close_client()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 2 and loop_thread not in threads
+
+def test_stream_summary_is_woken_by_updates(client, monkeypatch):
+    """Test that an open summary stream sends partial text and finishes as soon as the entry changes"""
+    import threading, time
+    import app as app_module
+    from summary_store import SummaryStore
+    store = SummaryStore(sweep_interval=0)
+    monkeypatch.setattr(app_module, 'summary_cache', store)
+    # Far longer than the test takes, so only notifications can move the stream along
+    monkeypatch.setattr(app_module, 'SHARED_PUBLISH_INTERVAL', 30)
+    store['r'] = {'status': 'pending'}
+
+    def publish():
+        while not app_module.summary_watchers.get('r'):
+            time.sleep(0.01)
+        app_module.update_summary('r', partial_summary='Partial *text*')
+        time.sleep(0.1)
+        app_module.update_summary('r', status='complete', summary='Done.')
+
+    start = time.time()
+    threading.Thread(target=publish, daemon=True).start()
+    with client.stream("GET", "/stream-summary/r") as response:
+        body = ''.join(response.iter_text())
+    assert time.time() - start < 10
+    assert "<em>text</em>" in body
+    assert "event: done" in body
+    assert app_module.summary_watchers == {}
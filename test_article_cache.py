@@ -0,0 +1,54 @@
+import pytest
+import httpx
+from fasthtml.common import database
+
+from article_cache import ArticleCache
+from fetcher import normalize_url
+
+EXTRACTED = {
+    'title': 'Test Article',
+    'markdown': '# Test\n\nSome [link](http://example.com) text\n',
+    'char_count': 44,
+    'token_count': 9,
+    'link_char_count': 4,
+    'link_token_count': 0,
+    'link_percentage': 9.1
+}
+
+@pytest.fixture
+def cache():
+    """Create an article cache on an in-memory database"""
+    return ArticleCache(database(':memory:'))
+
+def test_normalize_url():
+    """Test that equivalent URLs share a cache key"""
+    assert normalize_url("HTTPS://Example.COM:443/a?b=2&a=1#frag") == "https://example.com/a?a=1&b=2"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/x") == "http://example.com:8080/x"
+
+def test_cache_miss(cache):
+    """Test that an unknown URL has no cached entry or validators"""
+    assert cache.get("https://example.com/missing") is None
+    assert cache.revalidation_headers(None) == {}
+
+def test_cache_put_and_revalidate(cache):
+    """Test storing an article and building conditional request headers"""
+    response = httpx.Response(200, headers={'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    cache.put("https://example.com/post#top", response, EXTRACTED)
+    
+    cached = cache.get("https://EXAMPLE.com/post")
+    assert cached['title'] == 'Test Article'
+    assert cached['markdown'] == EXTRACTED['markdown']
+    assert cache.revalidation_headers(cached) == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'
+    }
+
+def test_cache_put_replaces_entry(cache):
+    """Test that a changed page overwrites the cached extraction"""
+    cache.put("https://example.com/post", httpx.Response(200, headers={'ETag': '"v1"'}), EXTRACTED)
+    cache.put("https://example.com/post", httpx.Response(200, headers={'ETag': '"v2"'}), dict(EXTRACTED, title='Updated'))
+    
+    cached = cache.get("https://example.com/post")
+    assert cached['etag'] == '"v2"'
+    assert cached['title'] == 'Updated'
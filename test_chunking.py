@@ -0,0 +1,58 @@
+import pytest
+
+from chunking import count_tokens, split_sections
+
+def section(title, paragraphs=3, words=80):
+    body = '\n\n'.join(' '.join(f"word{i}" for i in range(words)) + '.' for _ in range(paragraphs))
+    return f"## {title}\n\n{body}\n\n"
+
+def test_count_tokens():
+    """Test that token counts grow with the text and are zero for empty text"""
+    assert count_tokens('') == 0
+    assert 0 < count_tokens('Hello, world!') < count_tokens('Hello, world! ' * 10)
+
+def test_short_text_is_one_chunk():
+    """Test that text within the budget is returned unchanged as a single chunk"""
+    text = section("Intro", paragraphs=1)
+    assert split_sections(text, 1000) == [text.strip('\n')]
+
+def test_chunks_respect_budget_and_keep_all_text():
+    """Test that every chunk fits the budget and no words are dropped"""
+    text = ''.join(section(f"Part {i}") for i in range(10))
+    chunks = split_sections(text, 400)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 400 for chunk in chunks)
+    assert ' '.join(chunks).split() == text.split()
+
+def test_splits_on_headings_first():
+    """Test that sections are split at headings when each fits the budget"""
+    text = section("One") + section("Two") + section("Three")
+    budget = max(count_tokens(section(t)) for t in ("One", "Two", "Three"))
+    chunks = split_sections(text, budget)
+    assert [chunk.splitlines()[0] for chunk in chunks] == ["## One", "## Two", "## Three"]
+
+def test_oversized_paragraph_is_split():
+    """Test that a paragraph without any structure is still cut to the budget"""
+    text = 'x' * 5000 + ' ' + 'word ' * 2000
+    chunks = split_sections(text, 100)
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    assert ''.join(''.join(chunks).split()) == ''.join(text.split())
+
+def test_encoding_loads_on_first_count(monkeypatch):
+    """Test that the tokenizer is loaded once, by the first count rather than at import"""
+    import sys, types
+    import chunking
+    loads = []
+
+    class Encoding:
+        def encode(self, text, disallowed_special):
+            return text.split()
+
+    tiktoken = types.SimpleNamespace(get_encoding=lambda name: loads.append(name) or Encoding())
+    monkeypatch.setitem(sys.modules, 'tiktoken', tiktoken)
+    monkeypatch.setattr(chunking, '_encoding', None)
+    monkeypatch.setattr(chunking, '_encoding_loaded', False)
+    assert loads == []
+    assert count_tokens('three short words') == 3
+    assert count_tokens('two words') == 2
+    assert loads == ['cl100k_base']
@@ -0,0 +1,73 @@
+import gzip
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, choose_encoding
+
+BODY = "hello world " * 500
+
+async def large(request):
+    return PlainTextResponse(BODY)
+
+async def small(request):
+    return PlainTextResponse("tiny")
+
+async def stream(request):
+    async def parts():
+        for i in range(3):
+            yield f"part {i}\n" * 100
+    return StreamingResponse(parts(), media_type="application/x-ndjson")
+
+async def events(request):
+    async def parts():
+        yield "data: x\n\n" * 100
+    return StreamingResponse(parts(), media_type="text/event-stream")
+
+@pytest.fixture
+def client():
+    """Create a test client for an app behind the compression middleware"""
+    app = Starlette(routes=[Route('/large', large), Route('/small', small), Route('/stream', stream),
+                            Route('/events', events)],
+                    middleware=[Middleware(CompressionMiddleware)])
+    return TestClient(app)
+
+def test_choose_encoding(monkeypatch):
+    """Test Accept-Encoding negotiation including q-values and missing brotli"""
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert choose_encoding('gzip, deflate, br') == 'gzip'
+    assert choose_encoding('') is None
+    assert choose_encoding('gzip;q=0') is None
+    assert choose_encoding('*') == 'gzip'
+    monkeypatch.setattr(compression, 'brotli', object())
+    assert choose_encoding('gzip, br') == 'br'
+    assert choose_encoding('gzip;q=1.0, br;q=0.5') == 'gzip'
+    assert choose_encoding('br;q=0, gzip') == 'gzip'
+
+def test_large_response_is_gzipped(client):
+    """Test that a large body is compressed with matching headers"""
+    response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert int(response.headers['content-length']) < len(BODY)
+    assert response.text == BODY
+
+def test_small_and_unaccepted_responses_are_not_compressed(client):
+    """Test that tiny bodies and clients without gzip get the plain body"""
+    assert 'content-encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'content-encoding' not in client.get('/large', headers={'Accept-Encoding': 'identity'}).headers
+
+def test_streaming_response_is_compressed_per_chunk(client):
+    """Test that streamed bodies are compressed and decode to the full content"""
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == ''.join(f"part {i}\n" * 100 for i in range(3))
+
+def test_event_stream_is_not_compressed(client):
+    """Test that server-sent events pass through untouched"""
+    response = client.get('/events', headers={'Accept-Encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
@@ -0,0 +1,57 @@
+import pytest
+import textwrap
+from pathlib import Path
+
+import html2text
+
+from dom_markdown import _wrap, convert
+from extract import LINK_PATTERN
+
+CORPUS = Path(__file__).parent / 'bench' / 'corpus'
+
+SNIPPETS = [
+    "<p>Plain <b>bold</b>, <i>italic</i> and <code>code</code> text.</p>",
+    "<h2>Title</h2><p>A <a href='https://example.com/a'>link</a> and <a href='/b' title='T'>another</a>.</p>",
+    "<ul><li>one</li><li>two <a href='/x'>x</a></li></ul><ol><li>first</li><li>second</li></ol>",
+    "<blockquote><p>Quoted text that is long enough to be wrapped over more than one line by the formatter.</p></blockquote>",
+    "<pre><code>def f():\n    return 1 &lt; 2</code></pre>",
+    "<p>Entities: &mdash; &amp; &copy; &#8217; &#x2014; &nbsp;x &bogus; AT&amp;T</p>",
+    "<p>Image <img src='/i.png' alt='alt text'> and linked <a href='/p'><img src='/t.png' alt='thumb'></a></p>",
+    "<table><tr><th>A</th><th>B</th></tr><tr><td>1</td><td>2</td></tr></table>",
+    "<div><p>1. not a list</p><p>- not a bullet</p><p>+ plus</p><br><hr></div>",
+    "<p>" + " ".join(["word"] * 60) + " a-hyphenated-word " + " ".join(["more"] * 30) + "</p>",
+    "<p>Script <script>var x = '<b>';</script>and <!-- comment --> done</p>",
+    "<p>a <b>unclosed <i>nest</p><p>next",
+    "<p>Literal [brackets](not link) text</p>",
+    "<p>Unclosed <a href='/a'>link</p><p>runs on <a href='/b'>into</a> more</p>",
+    "<table><tr><td>cell <b>bold</td><td>next</td></tr></table>",
+]
+
+def reference(html):
+    markdown = html2text.HTML2Text().handle(html)
+    return markdown, sum(len(text) for text in LINK_PATTERN.findall(markdown))
+
+@pytest.mark.parametrize('html', SNIPPETS)
+def test_matches_html2text_on_snippets(html):
+    """Test that markdown and link text length match html2text and the link regex"""
+    assert convert(html) == reference(html)
+
+@pytest.mark.parametrize('name', ['small_blog.html', 'link_index.html', 'huge_news.html', 'malformed.html'])
+def test_matches_html2text_on_corpus(name):
+    """Test that the benchmark corpus pages convert exactly as before"""
+    html = (CORPUS / name).read_text(encoding='utf-8')
+    assert convert(html) == reference(html)
+
+def test_empty_input():
+    """Test that empty or whitespace-only input produces no markdown"""
+    assert convert('') == reference('')
+    assert convert('  \n ') == reference('  \n ')
+
+@pytest.mark.parametrize('text', [
+    "short line", "  leading spaces kept", "trailing   ", " ".join(["word"] * 50),
+    "x" * 100 + " tail", "a  b   c " * 20, "with-hyphens and-more " * 8, "tab\there " * 10,
+])
+def test_wrap_matches_textwrap(text):
+    """Test the fast wrap against textwrap for plain and fallback cases"""
+    for indent in ('', '    ', '> '):
+        assert _wrap(text, 78, indent) == textwrap.wrap(text, 78, break_long_words=False, subsequent_indent=indent)
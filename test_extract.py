@@ -0,0 +1,105 @@
+import pytest
+import asyncio
+
+import extract
+
+PAGE = """<html><head><title>Test Article</title></head><body><article>
+<h1>Test Article</h1>
+<p>This is a test paragraph with <a href="https://example.com/a">a link</a> in it, long enough to count as content.</p>
+<p>Another paragraph of article text so that readability keeps the body of the page intact for extraction.</p>
+</article></body></html>"""
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Run extraction through a fresh single-worker pool"""
+    extract.shutdown_pool()
+    monkeypatch.setattr(extract, 'WORKERS', 1)
+    yield
+    extract.shutdown_pool()
+
+def test_extract_article_link_stats():
+    """Test markdown conversion and link statistics"""
+    article = extract.extract_article(PAGE, "https://example.com/post")
+    assert "a link" in article['markdown']
+    assert article['char_count'] == len(article['markdown'])
+    assert article['link_char_count'] == len("a link")
+    assert 0 < article['link_percentage'] < 100
+
+def test_extract_in_pool_reports_timings(pool):
+    """Test that pooled extraction reports queue and extraction time separately"""
+    article = asyncio.run(extract.extract(PAGE, "https://example.com/post"))
+    assert "a link" in article['markdown']
+    assert article['queue_time'] >= 0
+    assert article['readability_time'] >= 0
+
+def burn(html, url):
+    while True:
+        pass
+
+def test_extract_cpu_limit(pool, monkeypatch):
+    """Test that a runaway page is stopped at the CPU budget"""
+    monkeypatch.setattr(extract, 'extract_article', burn)
+    monkeypatch.setattr(extract, 'CPU_LIMIT', 1)
+    with pytest.raises(extract.ExtractionTimeout):
+        asyncio.run(extract.extract(PAGE, "https://example.com/post"))
+
+real_extract_article = extract.extract_article
+
+def slow_or_stuck(html, url):
+    import signal, time
+    if url.endswith('/stuck'):
+        # Blocked where the worker's alarm can't reach it
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        time.sleep(60)
+    if url.endswith('/hang'):
+        time.sleep(60)
+    time.sleep(0.45)
+    return real_extract_article(html, url)
+
+def test_wall_limit_starts_when_the_worker_does(pool, monkeypatch):
+    """Test that time spent queued behind another page doesn't count against the wall-clock limit"""
+    monkeypatch.setattr(extract, 'extract_article', slow_or_stuck)
+    monkeypatch.setattr(extract, 'WALL_LIMIT', 0.7)
+
+    async def run():
+        return await asyncio.gather(*[extract.extract(PAGE, f"https://example.com/{i}") for i in range(2)])
+
+    articles = asyncio.run(run())
+    assert max(a['queue_time'] for a in articles) > 0.3
+    assert all("a link" in a['markdown'] for a in articles)
+
+def test_wall_limit_stops_a_blocked_worker(pool, monkeypatch):
+    """Test that a worker blocked off-CPU is stopped by its alarm and the pool keeps working"""
+    monkeypatch.setattr(extract, 'extract_article', slow_or_stuck)
+    monkeypatch.setattr(extract, 'WALL_LIMIT', 0.3)
+    with pytest.raises(extract.ExtractionTimeout):
+        asyncio.run(extract.extract(PAGE, "https://example.com/hang"))
+    assert extract._pool is not None
+
+def test_stuck_worker_is_killed_and_other_pages_retried(pool, monkeypatch):
+    """Test that a worker the alarm can't stop is killed, and pages running beside it still extract"""
+    monkeypatch.setattr(extract, 'extract_article', slow_or_stuck)
+    monkeypatch.setattr(extract, 'WORKERS', 2)
+    monkeypatch.setattr(extract, 'WALL_LIMIT', 0.5)
+    monkeypatch.setattr(extract, 'KILL_GRACE', 0.3)
+    stuck_pool = extract.get_pool()
+
+    async def later():
+        await asyncio.sleep(0.5)
+        return await extract.extract(PAGE, "https://example.com/beside")
+
+    async def run():
+        return await asyncio.gather(extract.extract(PAGE, "https://example.com/stuck"), later(),
+                                    return_exceptions=True)
+
+    stuck, beside = asyncio.run(run())
+    assert isinstance(stuck, extract.ExtractionTimeout)
+    assert "a link" in beside['markdown']
+    assert extract._pool is not stuck_pool
+
+def test_concurrent_callers_share_one_pool(pool):
+    """Test that threads asking for the pool at the same time all get the same one"""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(8) as threads:
+        pools = list(threads.map(lambda _: extract.get_pool(), range(32)))
+    assert len(set(map(id, pools))) == 1
@@ -0,0 +1,182 @@
+import pytest
+import asyncio
+from fasthtml.common import database
+
+import feeds
+from fetcher import Page
+
+RSS = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom"><channel>
+<title>Example</title>
+<item><title>Newer</title><atom:link rel="self"/><link>https://example.com/2</link>
+  <guid isPermaLink="false">post-2</guid><pubDate>Tue, 02 Jan 2024 10:00:00 GMT</pubDate></item>
+<item><title>Older</title><link>https://example.com/1</link>
+  <guid isPermaLink="false">post-1</guid><pubDate>Mon, 01 Jan 2024 10:00:00 GMT</pubDate></item>
+</channel></rss>"""
+
+ATOM = """<feed xmlns="http://www.w3.org/2005/Atom"><title>Example</title>
+<entry><id>tag:example.com,2024:1</id><title>First</title><link rel="alternate" href="/posts/1"/>
+  <link rel="edit" href="/edit/1"/><updated>2024-01-01T10:00:00Z</updated></entry>
+</feed>"""
+
+SITEMAP = """<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<url><loc>https://example.com/a</loc><lastmod>2024-01-01</lastmod></url>
+<url><loc>https://example.com/b</loc><lastmod>2024-03-01</lastmod></url>
+<url><loc>https://example.com/c</loc></url>
+</urlset>"""
+
+def page(text, status=200, headers=None):
+    return Page('https://example.com/feed', status, headers or {}, text)
+
+@pytest.fixture
+def store():
+    """Create a feed store on an in-memory database"""
+    return feeds.Feeds(database(':memory:'), poll_interval=60, max_items=2)
+
+def test_parse_rss_atom_and_sitemap():
+    """Test that entries are read from each format, newest first, with relative links resolved"""
+    kind, entries = feeds.parse_feed(RSS)
+    assert kind == 'feed'
+    assert [(e['id'], e['url'], e['title']) for e in entries] == [
+        ('post-2', 'https://example.com/2', 'Newer'), ('post-1', 'https://example.com/1', 'Older')]
+    kind, entries = feeds.parse_feed(ATOM, 'https://example.com/atom.xml')
+    assert (kind, entries[0]['url'], entries[0]['id']) == ('feed', 'https://example.com/posts/1', 'tag:example.com,2024:1')
+    assert entries[0]['updated'] == feeds.parse_time('2024-01-01T10:00:00+00:00')
+    kind, entries = feeds.parse_feed(SITEMAP)
+    assert kind == 'sitemap'
+    assert [e['url'] for e in entries] == ['https://example.com/b', 'https://example.com/a', 'https://example.com/c']
+    with pytest.raises(feeds.FeedError):
+        feeds.parse_feed("<html><body>Not a feed</body></html>")
+
+def test_new_entries_since_last_seen():
+    """Test that feeds stop at the last seen entry and sitemaps at the newest lastmod seen"""
+    _, entries = feeds.parse_feed(RSS)
+    assert feeds.new_entries('feed', entries, None) == (entries, 'post-2')
+    assert feeds.new_entries('feed', entries, 'post-1') == (entries[:1], 'post-2')
+    assert feeds.new_entries('feed', entries, 'post-2') == ([], 'post-2')
+    _, entries = feeds.parse_feed(SITEMAP)
+    new, last_seen = feeds.new_entries('sitemap', entries, None)
+    assert len(new) == 3
+    new, _ = feeds.new_entries('sitemap', entries, str(feeds.parse_time('2024-02-01')))
+    assert [e['url'] for e in new] == ['https://example.com/b', 'https://example.com/c']
+    assert feeds.new_entries('sitemap', entries, last_seen) == ([entries[2]], last_seen)
+
+def test_polls_are_claimed_once_and_entries_deduplicated(store):
+    """Test that a due feed is handed out once and repeated entries are only queued the first time"""
+    feed = store.add('https://example.com/feed', 'alice')
+    assert store.add('https://example.com/feed', 'bob')['username'] == 'alice'
+    assert [f['id'] for f in store.claim_due()] == [feed['id']]
+    assert store.claim_due() == []
+    _, entries = feeds.parse_feed(SITEMAP)
+    assert store.polled(feed, 'sitemap', entries, None, page('', headers={'etag': '"v1"'})) == 2
+    assert store.counts() == {'queued': 2, 'skipped': 1}
+    assert store.polled(feed, 'sitemap', entries, None, page('')) == 0
+    assert store.list('alice')[0]['etag'] is None
+    first, second = store.claim_item(), store.claim_item()
+    assert {first['url'], second['url']} == {'https://example.com/a', 'https://example.com/b'}
+    assert store.claim_item() is None
+    store.finished(first)
+    store.finished(second, error='boom')
+    assert store.counts() == {'done': 1, 'error': 1, 'skipped': 1}
+
+def test_poll_errors_back_off(store):
+    """Test that each failed poll pushes the next one further out"""
+    feed = store.add('https://example.com/feed')
+    store.polled(feed, error='timed out')
+    feed = store.claim_due(now=10 ** 10)[0]
+    assert (feed['failures'], feed['status']) == (1, 'error')
+    store.polled(feed, error='timed out')
+    assert store.claim_due(now=feed['polled_at'] + 200) == []
+    assert store.claim_due(now=feed['polled_at'] + 300)
+
+def test_ingester_polls_incrementally(store):
+    """Test that new entries are processed, and the next poll sends the ETag and queues nothing on a 304"""
+    requests, processed = [], []
+
+    async def fetch(url, headers):
+        requests.append(headers)
+        return page('', status=304) if headers.get('If-None-Match') == '"v1"' else page(RSS, headers={'etag': '"v1"'})
+
+    async def process(url):
+        processed.append(url)
+
+    async def run():
+        ingester = feeds.Ingester(store, fetch, process)
+        feed = store.add('https://example.com/feed')
+        for _ in range(2):
+            await ingester.step()
+            await asyncio.gather(*ingester.tasks)
+        store.feeds.update(dict(next_poll=0), feed['id'])
+        await ingester.step()
+        await asyncio.gather(*ingester.tasks)
+        return ingester
+
+    ingester = asyncio.run(run())
+    assert processed == ['https://example.com/2', 'https://example.com/1']
+    assert requests == [{}, {'If-None-Match': '"v1"'}]
+    assert ingester.stats['not_modified'] == 1
+    assert store.counts() == {'done': 2}
+
+def test_ingester_defers_to_interactive_work(store):
+    """Test that queued entries wait while `busy` reports interactive work"""
+    async def fetch(url, headers):
+        return page(SITEMAP)
+
+    async def process(url):
+        pass
+
+    async def run():
+        ingester = feeds.Ingester(store, fetch, process, busy=lambda: True)
+        store.add('https://example.com/sitemap.xml')
+        await ingester.step()
+        await asyncio.gather(*ingester.tasks)
+        await ingester.step()
+        return ingester
+
+    ingester = asyncio.run(run())
+    assert ingester.stats['deferred'] == 2
+    assert store.counts() == {'queued': 2, 'skipped': 1}
+
+def test_ingester_follows_changed_child_sitemaps(store):
+    """Test that a sitemap index is read through its child sitemaps changed since the last poll"""
+    index = """<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+    <sitemap><loc>https://example.com/old.xml</loc><lastmod>2023-01-01</lastmod></sitemap>
+    <sitemap><loc>https://example.com/new.xml</loc><lastmod>2024-03-01</lastmod></sitemap>
+    </sitemapindex>"""
+    fetched = []
+
+    async def fetch(url, headers):
+        fetched.append(url)
+        return page(index if url.endswith('index.xml') else SITEMAP)
+
+    async def process(url):
+        pass
+
+    async def run():
+        feed = store.add('https://example.com/index.xml')
+        store.feeds.update(dict(last_seen=str(feeds.parse_time('2023-06-01'))), feed['id'])
+        ingester = feeds.Ingester(store, fetch, process)
+        await ingester.step()
+        await asyncio.gather(*ingester.tasks)
+
+    asyncio.run(run())
+    assert fetched == ['https://example.com/index.xml', 'https://example.com/new.xml']
+    feed = store.db.q("select * from feeds")[0]
+    assert (feed['kind'], float(feed['last_seen'])) == ('sitemapindex', feeds.parse_time('2024-03-01'))
+    assert store.counts() == {'queued': 2, 'skipped': 1}
+
+def test_transactions_use_a_connection_per_thread(tmp_path):
+    """Test that on a database file, polls and removals write through the calling thread's own connection"""
+    store = feeds.Feeds(database(tmp_path / 'feeds.db'), poll_interval=60)
+    feed = store.add('https://example.com/feed', 'alice')
+    _, entries = feeds.parse_feed(RSS)
+
+    async def run():
+        return await asyncio.to_thread(store.polled, store.claim_due()[0], 'feed', entries, 'post-2', page(RSS))
+
+    assert asyncio.run(run()) == 2
+    assert store.local.__dict__.get('db') is None
+    assert store.list('alice')[0]['last_seen'] == 'post-2'
+    assert store.remove(feed['id'], 'alice')
+    assert store.local.db.conn is not store.db.conn
+    assert store.counts() == {}
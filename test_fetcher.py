@@ -0,0 +1,139 @@
+import pytest
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import fetcher
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    rate_limited = set()
+
+    def do_GET(self):
+        if self.path.startswith('/rate-limited') and self.path not in Handler.rate_limited:
+            Handler.rate_limited.add(self.path)
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/slow':
+            time.sleep(1)
+        body = b'<html><head><title>Test</title></head><body><p>Hello</p></body></html>'
+        content_type = 'text/html; charset=utf-8'
+        if self.path == '/pdf':
+            body, content_type = b'%PDF-1.4 binary', 'application/pdf'
+        elif self.path == '/big':
+            body = b'<html><body>' + b'x' * 100000 + b'</body></html>'
+        elif self.path == '/latin1':
+            body = '<html><head><meta charset="iso-8859-1"></head><body><p>Caf\xe9</p></body></html>'.encode('latin-1')
+            content_type = 'text/html'
+        if self.path == '/missing':
+            self.send_response(404)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    """Serve test pages from a local HTTP server"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+def test_fetch_returns_page(server):
+    """Test fetching a page through the shared client"""
+    async def run():
+        response = await fetcher.fetch(f"{server}/page")
+        await fetcher.close_client()
+        return response
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert "Hello" in response.text
+
+def test_fetch_reuses_client(server):
+    """Test that repeat fetches on one loop share a single pooled client"""
+    async def run():
+        first = fetcher.get_client()
+        await fetcher.fetch(f"{server}/page")
+        await fetcher.fetch(f"{server}/page")
+        second = fetcher.get_client()
+        await fetcher.close_client()
+        return first, second
+    first, second = asyncio.run(run())
+    assert first is second
+
+def test_fetch_raises_on_http_error(server):
+    """Test that error statuses raise like raise_for_status"""
+    async def run():
+        try:
+            await fetcher.fetch(f"{server}/missing")
+        finally:
+            await fetcher.close_client()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run())
+
+def test_fetch_total_timeout(server, monkeypatch):
+    """Test that a slow origin is cut off by the total timeout"""
+    monkeypatch.setattr(fetcher, 'TOTAL_TIMEOUT', 0.2)
+    async def run():
+        try:
+            await fetcher.fetch(f"{server}/slow")
+        finally:
+            await fetcher.close_client()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+
+def test_fetch_rejects_non_html(server):
+    """Test that non-HTML content types are refused before the body is read"""
+    async def run():
+        try:
+            await fetcher.fetch(f"{server}/pdf")
+        finally:
+            await fetcher.close_client()
+    with pytest.raises(fetcher.FetchError, match="application/pdf"):
+        asyncio.run(run())
+
+def test_fetch_enforces_byte_limit(server):
+    """Test that pages over the byte budget are aborted"""
+    async def run():
+        try:
+            await fetcher.fetch(f"{server}/big", max_bytes=50000)
+        finally:
+            await fetcher.close_client()
+    with pytest.raises(fetcher.FetchError, match="byte limit"):
+        asyncio.run(run())
+
+def test_fetch_detects_meta_charset(server):
+    """Test decoding with a charset declared only in the markup"""
+    async def run():
+        page = await fetcher.fetch(f"{server}/latin1")
+        await fetcher.close_client()
+        return page
+    page = asyncio.run(run())
+    assert page.encoding == 'iso8859-1'
+    assert "Caf\xe9" in page.text
+    assert page.bytes_read > 0
+    assert page.peak_bytes >= page.bytes_read
+
+def test_fetch_retries_rate_limited_response(server):
+    """Test that a 429 with Retry-After is retried rather than returned as an error"""
+    retries = fetcher.origins.stats['retries']
+    async def run():
+        try:
+            return await fetcher.fetch(f"{server}/rate-limited")
+        finally:
+            await fetcher.close_client()
+    assert "Hello" in asyncio.run(run()).text
+    assert fetcher.origins.stats['retries'] == retries + 1
@@ -0,0 +1,75 @@
+import pytest
+from fasthtml.common import database
+
+from history import History, MATCH_END, MATCH_START, fts_query
+
+ARTICLE = {'title': 'Rust memory safety', 'markdown': 'The borrow checker enforces lifetimes at compile time.',
+           'char_count': 55, 'token_count': 12, 'link_char_count': 0, 'link_token_count': 0, 'link_percentage': 0.0}
+TIMINGS = {'request_time': 0.2, 'queue_time': 0.0, 'readability_time': 0.1}
+
+@pytest.fixture
+def history():
+    """Create a history on an in-memory database"""
+    return History(database(':memory:'), flush_interval=0.01)
+
+def test_fts_query_quotes_words():
+    """Test that free text becomes quoted terms with a prefix match on the last one"""
+    assert fts_query('borrow "checker') == '"borrow" "checker"*'
+    assert fts_query('AND OR (') == '"AND" "OR"*'
+    assert fts_query(' -- ') is None
+
+def test_search_marks_matches(history):
+    """Test that recorded articles are found by their text, with matches marked in the snippet"""
+    history.record('alice', 'https://example.com/rust', ARTICLE, TIMINGS, 'r1')
+    history.flush()
+    rows = history.search('alice', 'lifetime')
+    assert [r['title'] for r in rows] == ['Rust memory safety']
+    assert f"{MATCH_START}lifetimes{MATCH_END}" in rows[0]['snippet']
+    assert history.search('alice', 'python') == []
+
+def test_search_is_per_user(history):
+    """Test that users only find their own articles"""
+    history.record('alice', 'https://example.com/rust', ARTICLE, TIMINGS, 'r1')
+    history.flush()
+    assert history.search('bob', 'borrow') == []
+    assert history.search('bob') == []
+    row = history.search('alice')[0]
+    assert history.get('bob', row['id']) is None
+    assert history.get('alice', row['id'])['markdown'] == ARTICLE['markdown']
+
+def test_summary_is_added_and_indexed(history):
+    """Test that a finished summary is stored with the article and searchable"""
+    history.record('alice', 'https://example.com/rust', ARTICLE, TIMINGS, 'r1')
+    history.add_summary('r1', {'summary': 'Ownership rules explained.', 'llm_time': 1.5, 'llm_wall_time': 1.5})
+    history.flush()
+    row = history.search('alice', 'ownership')[0]
+    stored = history.get('alice', row['id'])
+    assert stored['summary'] == 'Ownership rules explained.'
+    assert stored['llm_time'] == 1.5
+
+def test_reprocessing_replaces_entry(history):
+    """Test that processing the same page again updates the one entry and its index"""
+    history.record('alice', 'https://example.com/rust', ARTICLE, TIMINGS, 'r1')
+    history.record('alice', 'https://EXAMPLE.com/rust#intro', dict(ARTICLE, title='Rust ownership'), TIMINGS, 'r2')
+    history.flush()
+    assert [r['title'] for r in history.search('alice')] == ['Rust ownership']
+    assert [r['title'] for r in history.search('alice', 'ownership')] == ['Rust ownership']
+    assert history.search('alice', 'safety') == []
+
+def test_recent_pages(history):
+    """Test that an empty search lists the newest articles first, page by page"""
+    for i in range(5):
+        history.record('alice', f'https://example.com/{i}', dict(ARTICLE, title=f'Post {i}'), TIMINGS, f'r{i}')
+    history.flush()
+    assert [r['title'] for r in history.search('alice', limit=2)] == ['Post 4', 'Post 3']
+    assert [r['title'] for r in history.search('alice', limit=2, offset=4)] == ['Post 0']
+    assert history.stats['written'] == 5
+
+def test_writer_has_its_own_connection(tmp_path):
+    """Test that on a database file, queued writes go through the writer's own connection"""
+    db = database(tmp_path / 'history.db')
+    history = History(db, flush_interval=0.01)
+    history.record('alice', 'https://example.com/rust', ARTICLE, TIMINGS, 'r1')
+    history.flush()
+    assert history.write_db.conn is not db.conn
+    assert [r['title'] for r in history.search('alice', 'borrow')] == ['Rust memory safety']
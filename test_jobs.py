@@ -0,0 +1,69 @@
+import pytest
+import time
+from threading import Event
+
+import jobs
+
+def test_submit_runs_job():
+    """Test that a submitted job runs and resolves its future"""
+    scheduler = jobs.JobScheduler(workers=2, max_queue=10)
+    job = scheduler.submit('a', lambda x: x * 2, 21)
+    assert job.future.result(timeout=5) == 42
+    assert scheduler.snapshot()['completed'] == 1
+
+def test_failed_job_sets_exception():
+    """Test that a failing job reports its error"""
+    scheduler = jobs.JobScheduler(workers=1, max_queue=10)
+    def fail():
+        raise ValueError("boom")
+    job = scheduler.submit('a', fail)
+    with pytest.raises(ValueError):
+        job.future.result(timeout=5)
+    assert scheduler.snapshot()['failed'] == 1
+
+def test_queue_full_rejects():
+    """Test that submissions beyond max_queue are rejected"""
+    scheduler = jobs.JobScheduler(workers=1, max_queue=1)
+    release = Event()
+    scheduler.submit('running', release.wait)
+    while scheduler.get('running').status != 'running':
+        time.sleep(0.01)
+    scheduler.submit('waiting', lambda: None)
+    with pytest.raises(jobs.QueueFull):
+        scheduler.submit('rejected', lambda: None)
+    assert scheduler.snapshot()['rejected'] == 1
+    release.set()
+
+def test_batch_jobs_leave_reserved_slots():
+    """Test that batch jobs are rejected before the slots reserved for interactive ones"""
+    scheduler = jobs.JobScheduler(workers=1, max_queue=3, reserved=1)
+    release = Event()
+    scheduler.submit('running', release.wait)
+    while scheduler.get('running').status != 'running':
+        time.sleep(0.01)
+    scheduler.submit('batch-1', lambda: None, priority=jobs.BATCH)
+    scheduler.submit('batch-2', lambda: None, priority=jobs.BATCH)
+    with pytest.raises(jobs.QueueFull):
+        scheduler.submit('batch-3', lambda: None, priority=jobs.BATCH)
+    scheduler.submit('interactive', lambda: None)
+    with pytest.raises(jobs.QueueFull):
+        scheduler.submit('interactive-2', lambda: None)
+    release.set()
+
+def test_interactive_jobs_run_before_batch():
+    """Test priority ordering and queue positions"""
+    scheduler = jobs.JobScheduler(workers=1, max_queue=10)
+    release = Event()
+    order = []
+    scheduler.submit('blocker', release.wait)
+    while scheduler.get('blocker').status != 'running':
+        time.sleep(0.01)
+    batch = scheduler.submit('batch', order.append, 'batch', priority=jobs.BATCH)
+    interactive = scheduler.submit('interactive', order.append, 'interactive', priority=jobs.INTERACTIVE)
+    assert scheduler.position('interactive') == 1
+    assert scheduler.position('batch') == 2
+    assert scheduler.position('blocker') is None
+    release.set()
+    batch.future.result(timeout=5)
+    interactive.future.result(timeout=5)
+    assert order == ['interactive', 'batch']
@@ -0,0 +1,63 @@
+import pytest
+import time
+from fasthtml.common import database
+
+from llm_cache import LLMCache, cache_key
+
+TEMPLATE = "Summarize:\n\n{markdown}"
+
+@pytest.fixture
+def cache():
+    """Create an LLM cache on an in-memory database"""
+    return LLMCache(database(':memory:'))
+
+def test_cache_key_depends_on_all_inputs():
+    """Test that model, template, prompt and article text all change the key"""
+    base = cache_key('m', TEMPLATE, None, 'text')
+    assert base == cache_key('m', TEMPLATE, '', 'text')
+    assert base != cache_key('other', TEMPLATE, None, 'text')
+    assert base != cache_key('m', 'Other {markdown}', None, 'text')
+    assert base != cache_key('m', TEMPLATE, 'extract dates', 'text')
+    assert base != cache_key('m', TEMPLATE, None, 'different text')
+
+def test_miss_then_hit(cache):
+    """Test that a stored completion is returned and counted as a hit"""
+    assert cache.get('m', TEMPLATE, None, 'article') is None
+    cache.put('m', TEMPLATE, None, 'article', 'A summary.')
+    assert cache.contains('m', TEMPLATE, None, 'article')
+    assert cache.get('m', TEMPLATE, None, 'article') == 'A summary.'
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 1
+
+def test_expired_entries_miss(cache):
+    """Test that entries older than the TTL are not served"""
+    cache.ttl = 0.01
+    cache.put('m', TEMPLATE, None, 'article', 'A summary.')
+    time.sleep(0.02)
+    assert cache.get('m', TEMPLATE, None, 'article') is None
+    cache.evict()
+    assert cache.stats['evictions'] == 1
+
+def test_size_eviction_drops_least_recently_used(cache):
+    """Test that exceeding max_bytes evicts the least recently used entries"""
+    cache.max_bytes = 25
+    cache.put('m', TEMPLATE, None, 'first', 'x' * 10)
+    cache.put('m', TEMPLATE, None, 'second', 'y' * 10)
+    cache.get('m', TEMPLATE, None, 'first')
+    cache.put('m', TEMPLATE, None, 'third', 'z' * 10)
+    assert cache.contains('m', TEMPLATE, None, 'first')
+    assert not cache.contains('m', TEMPLATE, None, 'second')
+    assert cache.contains('m', TEMPLATE, None, 'third')
+
+def test_size_is_only_summed_past_the_limit(cache, monkeypatch):
+    """Test that puts keep a running total and only recount the table once it passes max_bytes"""
+    cache.max_bytes = 25
+    cache.put('m', TEMPLATE, None, 'first', 'x' * 10)
+    recounts = []
+    total = cache._total
+    monkeypatch.setattr(cache, '_total', lambda: recounts.append(1) or total())
+    cache.put('m', TEMPLATE, None, 'second', 'y' * 10)
+    assert (recounts, cache.bytes) == ([], 20)
+    cache.put('m', TEMPLATE, None, 'third', 'z' * 10)
+    assert (recounts, cache.bytes) == ([1], 20)
+    assert not cache.contains('m', TEMPLATE, None, 'first')
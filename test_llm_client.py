@@ -0,0 +1,114 @@
+import pytest
+import socket
+import time
+import sys
+
+import llm_client
+
+sys.path.insert(0, 'bench')
+from stub_llm import REPLY, start_stub
+
+MESSAGES = [{"role": "user", "content": "Summarize this"}]
+
+def make_client(endpoint):
+    from openai import OpenAI
+    return OpenAI(base_url=endpoint.base_url, api_key='test', max_retries=0)
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_stub(**kwargs)
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/v1"
+
+def test_parse_endpoints(monkeypatch):
+    """Test that endpoints are read with optional model and API key variable"""
+    monkeypatch.setenv('OTHER_KEY', 'secret')
+    endpoints = llm_client.parse_endpoints("https://a.example/v1, https://b.example/v1|small-model|OTHER_KEY,", 'default')
+    assert [(e.base_url, e.model, e.api_key) for e in endpoints] == [
+        ('https://a.example/v1', None, 'default'), ('https://b.example/v1', 'small-model', 'secret')]
+    assert [e.name for e in endpoints] == ['a.example', 'b.example/small-model']
+
+def test_routes_to_faster_endpoint(stubs):
+    """Test that once both endpoints are measured, calls go to the one answering sooner"""
+    slow, fast = stubs(latency=0.3), stubs()
+    created = []
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(f"{slow}|slow,{fast}|fast"),
+                                    lambda e: created.append(e) or make_client(e), explore=0)
+    served = [clients.complete('model', MESSAGES)[2].model for _ in range(5)]
+    assert set(served[:2]) == {'slow', 'fast'}
+    assert served[2:] == ['fast'] * 3
+    assert len(created) == 2
+
+def test_fails_over_to_working_endpoint(stubs):
+    """Test that a 5xx or unreachable endpoint fails over and is ranked behind the working one"""
+    failing, working = stubs(status=503), stubs()
+    endpoints = llm_client.parse_endpoints(f"{closed_port_url()}|down,{failing}|failing,{working}|working")
+    clients = llm_client.LLMClients(endpoints, make_client, explore=0)
+    streamed = []
+    content, output_tokens, endpoint = clients.complete('model', MESSAGES, on_text=streamed.append)
+    assert (content, endpoint.model) == (REPLY, 'working')
+    assert output_tokens == len(REPLY.split(' '))
+    assert streamed[-1] == REPLY
+    assert clients.stats['failovers'] == 2
+    assert clients.ranked()[0] is endpoint
+
+def test_last_endpoint_error_is_raised(stubs):
+    """Test that when every endpoint fails the last error reaches the caller"""
+    import openai
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(stubs(status=500)), make_client)
+    with pytest.raises(openai.InternalServerError):
+        clients.complete('model', MESSAGES)
+
+def test_deadline_exceeded(stubs):
+    """Test that a completion slower than its deadline is abandoned instead of failing over"""
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(f"{stubs(token_delay=0.05)},{stubs()}"), make_client,
+                                    explore=0)
+    with pytest.raises(llm_client.DeadlineExceeded):
+        clients.complete('model', MESSAGES, deadline=0.2)
+    assert clients.stats['deadline_exceeded'] == 1
+
+def test_deadline_covers_rate_limit_waits(stubs):
+    """Test that waiting for the provider's rate limit counts against the deadline"""
+    import ratelimit
+    limits = ratelimit.RateControl('llm', rate=0.5, burst=1, concurrency=4, retries=0)
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(stubs()), make_client, limits=limits)
+    clients.complete('model', MESSAGES)
+    start = time.monotonic()
+    with pytest.raises(llm_client.DeadlineExceeded):
+        clients.complete('model', MESSAGES, deadline=0.5)
+    assert time.monotonic() - start < 0.5
+
+def test_failed_calls_record_no_latency(stubs):
+    """Test that a fast error response doesn't count as a fast time to first token"""
+    failing, working = stubs(status=503), stubs(latency=0.1)
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(f"{failing}|failing,{working}|working"), make_client,
+                                    explore=0)
+    clients.complete('model', MESSAGES)
+    failed, served = clients.endpoints
+    assert (failed.failures, failed.latency) == (1, None)
+    assert served.latency >= 0.1
+
+def test_throttled_endpoint_is_skipped_without_a_failure(stubs):
+    """Test that our own rate control holding back an endpoint fails over without penalizing it"""
+    import ratelimit
+    limits = ratelimit.RateControl('llm', rate=1, burst=1, concurrency=4, retries=0, max_wait=0.1)
+    clients = llm_client.LLMClients(llm_client.parse_endpoints(f"{stubs()}|held,{stubs()}|open"), make_client,
+                                    limits=limits, explore=0)
+    held = clients.endpoints[0]
+    limits.upstream(held.provider).bucket.block(60)
+    assert clients.complete('model', MESSAGES)[2].model == 'open'
+    assert (held.calls, held.failures, held.errors, held.latency) == (0, 0, 0.0, None)
+    assert clients.stats['failovers'] == 1
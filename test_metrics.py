@@ -0,0 +1,49 @@
+import pytest
+
+import metrics
+
+@pytest.fixture
+def registry():
+    """Collect metrics in a private registry"""
+    return []
+
+def test_counter_with_labels(registry):
+    """Test counters render one sample per label set"""
+    errors = metrics.Counter('test_errors_total', "Errors", ['stage'], registry=registry)
+    errors.inc(stage='fetch')
+    errors.inc(2, stage='fetch')
+    errors.inc(stage='llm_summary')
+    text = metrics.render(registry)
+    assert "# TYPE test_errors_total counter" in text
+    assert 'test_errors_total{stage="fetch"} 3' in text
+    assert 'test_errors_total{stage="llm_summary"} 1' in text
+
+def test_histogram_buckets(registry):
+    """Test histogram buckets are cumulative with sum and count"""
+    latency = metrics.Histogram('test_seconds', "Latency", ['stage'], buckets=(0.1, 1), registry=registry)
+    latency.observe(0.05, stage='fetch')
+    latency.observe(0.5, stage='fetch')
+    latency.observe(5, stage='fetch')
+    text = metrics.render(registry)
+    assert 'test_seconds_bucket{stage="fetch",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="fetch",le="1"} 2' in text
+    assert 'test_seconds_bucket{stage="fetch",le="+Inf"} 3' in text
+    assert 'test_seconds_sum{stage="fetch"} 5.55' in text
+    assert 'test_seconds_count{stage="fetch"} 3' in text
+
+def test_gauge_set_and_collect(registry):
+    """Test gauges set directly and gauges read at scrape time"""
+    in_flight = metrics.Gauge('test_in_flight', "In flight", ['kind'], registry=registry)
+    in_flight.inc(kind='batch')
+    in_flight.inc(kind='batch')
+    in_flight.dec(kind='batch')
+    metrics.Gauge('test_jobs', "Jobs", ['state'], collect=lambda: {('queued',): 4}, registry=registry)
+    text = metrics.render(registry)
+    assert 'test_in_flight{kind="batch"} 1' in text
+    assert 'test_jobs{state="queued"} 4' in text
+
+def test_label_values_are_escaped(registry):
+    """Test quotes and backslashes in label values are escaped"""
+    counter = metrics.Counter('test_total', "Test", ['name'], registry=registry)
+    counter.inc(name='a "quoted" \\ value')
+    assert 'test_total{name="a \\"quoted\\" \\\\ value"} 1' in metrics.render(registry)
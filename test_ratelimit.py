@@ -0,0 +1,145 @@
+import pytest
+import asyncio
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import ratelimit
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+def flaky(errors, result='ok'):
+    """A function raising each of `errors` in turn, then returning `result`"""
+    errors = list(errors)
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+def test_parse_retry_after():
+    """Test that Retry-After is read as seconds or an HTTP date"""
+    assert ratelimit.parse_retry_after("3") == 3.0
+    assert ratelimit.parse_retry_after(None) is None
+    assert ratelimit.parse_retry_after("soon") is None
+    future = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 30))
+    assert 25 < ratelimit.parse_retry_after(future) <= 30
+    assert ratelimit.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+def test_token_bucket_paces_after_burst():
+    """Test that a bucket allows its burst, then spaces calls at its rate"""
+    bucket = ratelimit.TokenBucket(rate=10, burst=2)
+    assert bucket.take() == bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.1, abs=0.01)
+    assert bucket.take() == pytest.approx(0.2, abs=0.01)
+    bucket.block(5)
+    assert bucket.take() > 4.9
+    assert ratelimit.TokenBucket(rate=0, burst=1).take() == 0
+
+def test_token_bucket_cost():
+    """Test that a take can spend several tokens, making the next caller wait for all of them"""
+    bucket = ratelimit.TokenBucket(rate=100, burst=100)
+    assert bucket.take(150) == pytest.approx(0.5, abs=0.01)
+    assert bucket.take() == pytest.approx(0.51, abs=0.01)
+
+def test_adaptive_limit_aimd():
+    """Test that overloads halve the limit once per window and successes grow it back"""
+    limit = ratelimit.AdaptiveLimit(8)
+    limit.overload()
+    limit.overload()
+    assert limit.limit == 4
+    for _ in range(10):
+        limit.success()
+    assert 5 < limit.limit < 8
+    for _ in range(100):
+        limit.success()
+    assert limit.limit == 8
+
+def test_adaptive_limit_blocks_beyond_limit():
+    """Test that acquiring past the limit waits for a release"""
+    limit = ratelimit.AdaptiveLimit(1)
+    limit.acquire()
+    acquired = threading.Event()
+    threading.Thread(target=lambda: (limit.acquire(), acquired.set()), daemon=True).start()
+    assert not acquired.wait(0.1)
+    limit.release()
+    assert acquired.wait(1)
+
+def test_call_retries_rate_limits():
+    """Test that 429s and 5xx are retried, honouring Retry-After and shrinking the limit"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=4, retries=3)
+    fn = flaky([StatusError(429, {'retry-after': '0.05'}), StatusError(503)])
+    start = time.monotonic()
+    assert control.call('host', fn) == 'ok'
+    assert time.monotonic() - start >= 0.05
+    assert control.stats['retries'] == 2
+    assert control.retry_reasons == {'429': 1, '503': 1}
+    assert control.limits() == {'host': 2}
+
+def test_call_gives_up():
+    """Test that other errors, exhausted retries and long Retry-After waits are raised"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=4, retries=1, max_wait=5)
+    with pytest.raises(StatusError):
+        control.call('host', flaky([StatusError(404)]))
+    with pytest.raises(StatusError):
+        control.call('host', flaky([StatusError(500), StatusError(500)]))
+    with pytest.raises(StatusError):
+        control.call('host', flaky([StatusError(429, {'retry-after': '60'})]))
+    assert control.stats['retries'] == 1
+    assert control.stats['gave_up'] == 2
+
+def test_long_retry_after_does_not_hold_back_other_calls():
+    """Test that a Retry-After past max_wait fails its call without blocking the next ones"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=4, retries=3, max_wait=5)
+    with pytest.raises(StatusError):
+        control.call('host', flaky([StatusError(429, {'retry-after': '3600'})]))
+    assert control.upstream('host').bucket.take() == 0
+    assert control.call('host', flaky([])) == 'ok'
+
+def test_call_fails_fast_when_held_back_too_long():
+    """Test that a call whose turn is further off than max_wait raises Throttled without taking a token"""
+    control = ratelimit.RateControl('test', rate=1, burst=1, concurrency=4, retries=0, max_wait=0.5)
+    assert control.call('host', flaky([])) == 'ok'
+    with pytest.raises(ratelimit.Throttled):
+        control.call('host', flaky([]))
+    bucket = control.upstream('host').bucket
+    assert bucket.take() == pytest.approx(1, abs=0.05)
+
+def test_call_async_retries_transient_errors():
+    """Test that the async variant retries the given transient exceptions"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=1, retries=2)
+    fn = flaky([ConnectionError("reset")])
+
+    async def call():
+        return fn()
+
+    assert asyncio.run(control.call_async('host', call, transient=(ConnectionError,))) == 'ok'
+    assert control.retry_reasons == {'connection': 1}
+
+def test_acquire_gives_up_at_deadline():
+    """Test that a call waiting for a concurrency slot stops at its deadline"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=1, retries=0)
+    control.upstream('host').limit.acquire()
+    start = time.monotonic()
+    with pytest.raises(ratelimit.DeadlineExceeded):
+        control.call('host', flaky([]), deadline=time.monotonic() + 0.1)
+    assert time.monotonic() - start < 0.5
+    assert control.upstream('host').limit.waiters == deque()
+
+def test_idle_upstreams_are_dropped():
+    """Test that past max_upstreams, upstreams back in their starting state make room for new keys"""
+    control = ratelimit.RateControl('test', rate=0, burst=1, concurrency=4, retries=1, max_upstreams=2)
+    control.call('a', lambda: 'ok')
+    control.call('b', flaky([StatusError(503)]))
+    control.upstream('c')
+    assert set(control.upstreams) == {'b', 'c'}
+    assert control.limits() == {'b': 2}
+    bucket = ratelimit.TokenBucket(rate=10, burst=2)
+    bucket.take(2)
+    assert not bucket.full()
+    time.sleep(0.25)
+    assert bucket.full()
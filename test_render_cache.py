@@ -0,0 +1,24 @@
+import pytest
+
+from render_cache import RenderCache
+
+def test_render_is_cached_by_content():
+    """Test that the same markdown is rendered once and then served from the cache"""
+    cache = RenderCache()
+    html = cache.render("Some *text*")
+    assert "<em>text</em>" in html
+    assert cache.render("Some *text*") == html
+    assert cache.stats == {'hits': 1, 'misses': 1, 'evictions': 0}
+    cache.render("Other *text*")
+    assert cache.stats['misses'] == 2
+
+def test_size_limit_evicts_least_recently_used():
+    """Test that the oldest renders are dropped once over the byte budget"""
+    cache = RenderCache(max_bytes=len(RenderCache().render("a" * 100)) * 2)
+    cache.render("a" * 100)
+    cache.render("b" * 100)
+    cache.get("a" * 100)
+    cache.render("c" * 100)
+    assert cache.get("a" * 100) is not None
+    assert cache.get("b" * 100) is None
+    assert cache.stats['evictions'] == 1
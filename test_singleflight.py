@@ -0,0 +1,68 @@
+import pytest
+import asyncio
+
+import singleflight
+
+def test_concurrent_calls_share_one_execution():
+    """Test that concurrent awaits of one key run the call once and all get its result"""
+    group = singleflight.AsyncGroup()
+    calls = []
+
+    async def load(url):
+        calls.append(url)
+        await asyncio.sleep(0.05)
+        return url.upper()
+
+    async def run():
+        return await asyncio.gather(*(group.do('key', load, 'page') for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert calls == ['page']
+    assert [r for r, _ in results] == ['PAGE'] * 5
+    assert [shared for _, shared in results].count(False) == 1
+    assert group.stats == {'calls': 1, 'shared': 4}
+    assert group.calls == {}
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    """Test that a caller going away leaves the call running for the others"""
+    group = singleflight.AsyncGroup()
+
+    async def load():
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    async def run():
+        first = asyncio.ensure_future(group.do('key', load))
+        second = asyncio.ensure_future(group.do('key', load))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ('done', True)
+
+def test_errors_reach_every_caller():
+    """Test that a failed call raises for all callers and the next call starts afresh"""
+    group = singleflight.AsyncGroup()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(group.do('key', fail), group.do('key', fail), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in asyncio.run(run()))
+    assert group.calls == {}
+
+def test_flights_join_publish_and_land():
+    """Test that members join a running flight, see its progress, and that landing ends it"""
+    flights = singleflight.Flights()
+    flight = flights.join('key', 'a')
+    assert flight.leader == 'a'
+    assert flights.publish(flight, partial_summary='So far') == ['a']
+    joined = flights.join('key', 'b')
+    assert joined is flight
+    assert joined.state == {'partial_summary': 'So far'}
+    assert flights.land(flight) == ['a', 'b']
+    assert flights.join('key', 'c').leader == 'c'
+    assert flights.snapshot() == {'started': 2, 'joined': 1, 'in_flight': 1, 'attached': 1}
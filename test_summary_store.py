@@ -0,0 +1,121 @@
+import pytest
+import time
+from fasthtml.common import database
+
+from summary_store import SqliteSummaryStore, SummaryStore, entry_size
+
+def test_set_get_delete():
+    """Test dict-style access to stored entries"""
+    store = SummaryStore(sweep_interval=0)
+    store['a'] = {'status': 'pending', 'markdown': 'text'}
+    assert 'a' in store
+    assert store['a']['status'] == 'pending'
+    assert store.stats()['bytes'] == entry_size(store['a'])
+    del store['a']
+    assert 'a' not in store
+    assert store.get('a') is None
+    assert store.stats()['bytes'] == 0
+
+def test_delete_tolerates_missing_entries():
+    """Test that deleting an entry the sweeper already dropped is a no-op"""
+    store = SummaryStore(ttl=0.01, sweep_interval=0)
+    store['a'] = {'status': 'complete'}
+    time.sleep(0.02)
+    store.sweep()
+    del store['a']
+    del store['never']
+    assert store.stats()['bytes'] == 0
+
+def test_entries_expire():
+    """Test that entries are dropped after the TTL"""
+    store = SummaryStore(ttl=0.01, sweep_interval=0)
+    store['a'] = {'status': 'pending'}
+    store['b'] = {'status': 'pending'}
+    time.sleep(0.02)
+    assert 'a' not in store
+    assert store.sweep() == 1
+    stats = store.stats()
+    assert stats['entries'] == 0
+    assert stats['expired'] == 2
+
+def test_size_limit_evicts_least_recently_used():
+    """Test LRU eviction once the byte budget is exceeded"""
+    entry = {'markdown': 'x' * 1000}
+    store = SummaryStore(max_bytes=entry_size(entry) * 2, sweep_interval=0)
+    store['a'] = entry
+    store['b'] = entry
+    store.get('a')
+    store['c'] = entry
+    assert 'a' in store
+    assert 'b' not in store
+    assert 'c' in store
+    assert store.stats()['evicted_for_size'] == 1
+
+def test_sweeper_thread_expires_entries():
+    """Test that the background sweeper removes abandoned entries"""
+    store = SummaryStore(ttl=0.01, sweep_interval=0.02)
+    store['a'] = {'status': 'pending'}
+    time.sleep(0.1)
+    assert len(store) == 0
+
+def test_sqlite_store_is_shared_between_connections(tmp_path):
+    """Test that entries written by one worker's store are visible to another's"""
+    first = SqliteSummaryStore(database(tmp_path / 'jobs.db'), sweep_interval=0)
+    second = SqliteSummaryStore(database(tmp_path / 'jobs.db'), sweep_interval=0)
+    first['a'] = {'status': 'pending', 'queue_time': 0.5}
+    assert 'a' in second
+    assert second['a'] == {'status': 'pending', 'queue_time': 0.5}
+    first['a'] = {'status': 'complete', 'summary': 'Done.'}
+    assert second.get('a')['summary'] == 'Done.'
+    del second['a']
+    assert 'a' not in first
+    assert first.get('a') is None
+    assert len(first) == 0
+
+def test_sqlite_store_expiry_and_size_limit():
+    """Test TTL expiry and eviction of the least recently written entries"""
+    entry = {'markdown': 'x' * 1000}
+    store = SqliteSummaryStore(database(':memory:'), max_bytes=entry_size(entry) * 2, sweep_interval=0)
+    store['a'] = entry
+    store['b'] = entry
+    store['c'] = entry
+    assert 'a' not in store
+    assert 'b' in store and 'c' in store
+    assert store.stats()['evicted_for_size'] == 1
+    store.ttl = 0.01
+    time.sleep(0.02)
+    assert store.sweep() == 2
+    assert store.stats()['entries'] == 0
+
+def test_sqlite_store_only_sums_sizes_past_the_limit(monkeypatch):
+    """Test that writes keep a running size estimate and only recount the table once it passes max_bytes"""
+    entry = {'markdown': 'x' * 1000}
+    store = SqliteSummaryStore(database(':memory:'), max_bytes=entry_size(entry) * 3, sweep_interval=0)
+    store['a'] = entry
+    recounts = []
+    total = store._total
+    monkeypatch.setattr(store, '_total', lambda: recounts.append(1) or total())
+    store['a'] = entry
+    store['b'] = entry
+    assert recounts == []
+    store['c'] = entry
+    assert recounts == [1]
+    assert store.estimate == entry_size(entry) * 3
+    assert 'a' in store and 'c' in store
+
+def test_sqlite_store_fails_entries_of_stopped_workers(tmp_path):
+    """Test that pending entries left by a process that is gone are marked failed, and others are kept"""
+    import os, subprocess
+    stopped = subprocess.Popen(['true'])
+    stopped.wait()
+    store = SqliteSummaryStore(database(tmp_path / 'summaries.db'), sweep_interval=0)
+    store['dead'] = {'status': 'pending', 'worker': stopped.pid}
+    store['old'] = {'status': 'pending', 'worker': os.getpid()}
+    store['live'] = {'status': 'pending', 'worker': os.getppid()}
+    store['done'] = {'status': 'complete', 'summary': 'text'}
+    assert store.fail_orphans('restarted') == 2
+    assert store['dead'] == {'status': 'error', 'error': 'restarted', 'worker': stopped.pid}
+    assert store['old']['status'] == 'error'
+    assert store['live']['status'] == 'pending'
+    assert store['done']['status'] == 'complete'
+    assert SummaryStore(sweep_interval=0).fail_orphans('restarted') == 0